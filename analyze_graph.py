@@ -1,29 +1,52 @@
-from matplotlib import pyplot as plt
-import matplotlib.cm as cm
-import matplotlib
-import matplotlib.colors as mcolors
-from matplotlib.lines import Line2D
-from mpl_toolkits.axes_grid1.inset_locator import inset_axes
-from scipy.spatial import cKDTree
+# matplotlib (also imported by the map libraries) is imported in the plotting functions and after parsing the
+# arguments, so that --help and the argument errors do not wait for it
+import numpy as np
 
 from network import Network
+from network_stats import NO_DEPARTURE, get_network_stats
+from population_grid import PopulationGrid
+from stops import Stops
+from instrumentation import Instrumentation
+from isochrones import DEFAULT_THRESHOLDS, get_isochrones
 from utils import *
 import pandas as pd
-from tqdm import tqdm
 
 import warnings
 
 import argparse
+from datetime import datetime
+
+PLOTS = ("early_departure", "departures", "connections", "population", "reachable", "isochrones", "vehicles",
+         "route")
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--network_file', default='network.db', required=False)
+    parser.add_argument('--network_file', default='network.csr', required=False,
+                        help='compiled network directory (or a shelve file of the old format)')
     parser.add_argument('--stations_file', default='stops.csv', required=False)
     parser.add_argument('--time_limit', default=30, type=int, help='time limit in minutes', required=False)
     parser.add_argument('--start_time', default='09:00', type=str, help='start time in HH:MM', required=False)
     parser.add_argument('--station', default='Frankfurt Hauptbahnhof', type=str, required=False)
     parser.add_argument('--output', default='map.png', required=False)
+    parser.add_argument('--population_file', default='data/population_deu_2019-07-01.csv', required=False,
+                        help='population csv, converted into a population store next to it on first use')
+    parser.add_argument('--cache_entries', default=None, type=int,
+                        help='maximum number of decoded stops kept in memory (default: only bounded by their size)',
+                        required=False)
+    parser.add_argument('--date', default='2025-10-22', type=str, help='day of service in YYYY-MM-DD',
+                        required=False)
+    parser.add_argument('--algorithm', default='dijkstra', choices=Network.ALGORITHMS,
+                        help='search algorithm used for reachability and routing', required=False)
+    parser.add_argument('--instrumentation', default=None, type=str, required=False,
+                        help='append the counters of every search to this file as JSON lines')
+    parser.add_argument('--plots', default=list(PLOTS), nargs='+', choices=PLOTS, required=False,
+                        help='plots to draw (default: all)')
+    parser.add_argument('--isochrone_thresholds', default=list(DEFAULT_THRESHOLDS), nargs='+', type=int,
+                        help='time limits of the isochrones in minutes', required=False)
+    parser.add_argument('--tile_source', default=[], action='append', required=False,
+                        help='tile directory, MBTiles file or URL template of map tiles, tried in the given order '
+                             'before the OpenStreetMap tile server')
 
     return parser.parse_args()
 
@@ -31,44 +54,47 @@ def parse_arguments():
 def main():
     args = parse_arguments()
 
-    network = Network(args.network_file)
-    stops_data = pd.read_csv(args.stations_file, index_col="DHID")
-    stops_data.dropna(inplace=True)
+    network = Network(args.network_file, cache_entries=args.cache_entries)
+    network.instrumentation = Instrumentation(args.instrumentation)
+    from tile_cache import open_tile_source
+    tile_sources[:0] = [open_tile_source(source) for source in args.tile_source]
+    # the spatial index is persisted next to the stations file
+    stops = Stops.open(args.stations_file)
+    stops_data = stops.data
 
     map_box = (49.8388, 8.560719, 49.931479, 8.750582)  # area around Darmstadt
     # select stops in that area
-    in_area = stops_data[(stops_data["Latitude"] > map_box[0]) &
-                         (stops_data["Latitude"] < map_box[2]) &
-                         (stops_data["Longitude"] > map_box[1]) &
-                         (stops_data["Longitude"] < map_box[3])].copy()
-
-    get_early_departure_plot(network, in_area, map_box)
-    get_num_departures_plot(network, in_area, map_box)
-    get_num_connections_plot(network, in_area, map_box)
-    get_population_plot(network, in_area, map_box)
-    get_reacable_in_plot(network, in_area, map_box, "Darmstadt Schloss")
-
-    get_num_vehicles_plot(network, in_area, map_box)
-    get_fastest_route_plot(network, stops_data, [9 * 60 + 0, 9 * 60 + 15, 9 * 60 + 30, 9 * 60 + 45],
-                           "Darmstadt Schloss", "Dieburg Bahnhof")
-
-
-def get_num_departures_plot(network, in_area, map_box):
-    # get the data
-    def get_num_depatures(stop_id):
-        result = []
-        for stop_id, timetable in network.stops[stop_id].items():
-            timetable.sort()
-            for connection in timetable:
-                result.append(connection.departure)
-        return result
-
-    def count_daytime_departures(stop_id):
-        departures = get_num_depatures(stop_id)
-        return sum(9 <= (t // 60) < 18 for t in departures)  # counts hours 9–17
-
-    # collect number of departures
-    in_area["daytime_departures"] = in_area.index.map(count_daytime_departures)
+    in_area = stops.in_bbox(*map_box).copy()
+
+    date = datetime.strptime(args.date, "%Y-%m-%d").date()
+
+    if "early_departure" in args.plots:
+        get_early_departure_plot(network, in_area, map_box, date=date)
+    if "departures" in args.plots:
+        get_num_departures_plot(network, in_area, map_box, date=date)
+    if "connections" in args.plots:
+        get_num_connections_plot(network, in_area, map_box, date=date)
+    if "population" in args.plots:
+        get_population_plot(stops, in_area, map_box, args.population_file)
+    if "reachable" in args.plots:
+        get_reacable_in_plot(network, in_area, map_box, "Darmstadt Schloss", algorithm=args.algorithm, date=date)
+    if "isochrones" in args.plots:
+        get_isochrone_plot(network, stops, in_area, map_box, "Darmstadt Schloss", args.isochrone_thresholds,
+                           algorithm=args.algorithm, date=date)
+
+    if "vehicles" in args.plots:
+        get_num_vehicles_plot(network, in_area, map_box, date=date)
+    if "route" in args.plots:
+        get_fastest_route_plot(network, stops_data, [9 * 60 + 0, 9 * 60 + 15, 9 * 60 + 30, 9 * 60 + 45],
+                               "Darmstadt Schloss", "Dieburg Bahnhof", algorithm=args.algorithm, date=date)
+    print("Stop cache: {hits} hits, {misses} misses, {evictions} evictions".format(**network.get_cache_stats()))
+
+
+def get_num_departures_plot(network, in_area, map_box, date=None):
+    stop_table = get_network_stats(network, date).get_stop_table(network)
+    # collect number of departures, counts hours 9–17
+    in_area["daytime_departures"] = stop_table[[f"departures_{hour:02}" for hour in range(9, 18)]].sum(
+        axis=1).reindex(in_area.index, fill_value=0)
     # in_area["daytime_departures"] = in_area["daytime_departures"] / 8 # per hour
     # remove stations only used at night (or not at all)
     in_area_with_depatures = in_area[
@@ -78,25 +104,11 @@ def get_num_departures_plot(network, in_area, map_box):
                       kind="points", title="Number of Departures from 9 to 17:00", outname="num_departures")
 
 
-def get_early_departure_plot(network, in_area, map_box):
-    end_of_day = 2 * 60 + 50  # 02:50
-
-    # a bus leaving at 0:30 is part of the old day, that is your ticket from the previous day is still valid
-
-    def get_early(stop_id):
-        earliest_depature = 25 * 60  # next day
-        for stop_id, timetable in network.stops[stop_id].items():
-            timetable.sort()
-            idx = 0
-            while idx < len(timetable) and timetable[idx].departure < end_of_day:
-                idx += 1
-            # found the next departure
-            if idx < len(timetable):
-                earliest_depature = min(timetable[idx].departure, earliest_depature)
-        return earliest_depature
-
-    # to_series as, as the stop_id is the index
-    in_area["first_departure"] = in_area.index.to_series().apply(get_early)
+def get_early_departure_plot(network, in_area, map_box, date=None):
+    # first departure after 02:50, a bus leaving at 0:30 is part of the old day,
+    # that is your ticket from the previous day is still valid
+    stop_table = get_network_stats(network, date).get_stop_table(network)
+    in_area["first_departure"] = stop_table["first_departure"].reindex(in_area.index, fill_value=NO_DEPARTURE)
     in_area["first_departure_hour"] = in_area["first_departure"] // 60  # only the hour
 
     get_plot_legend(in_area[in_area["first_departure_hour"] != 25],
@@ -105,27 +117,24 @@ def get_early_departure_plot(network, in_area, map_box):
                     legend_title="First Departure Hour", unit_name=":00", outname="earliest_departures")
 
 
-def get_num_connections_plot(network, in_area, map_box):
-    def get_num_connected_nodes(stop_id):
-        # for iid , _ in network.stops[stop_id].items():
-        #    print(stops_data.loc[iid]["Name"])
-        return len(network.stops[stop_id].items())
-
-    in_area["num_connections"] = in_area.index.to_series().apply(get_num_connected_nodes)
+def get_num_connections_plot(network, in_area, map_box, date=None):
+    stop_table = get_network_stats(network, date).get_stop_table(network)
+    in_area["num_connections"] = stop_table["degree"].reindex(in_area.index, fill_value=0)
     with_connections = in_area[in_area["num_connections"] > 0]
     get_plot_colorbar(with_connections, "num_connections", map_box, kind="points",
                       title="Number of connected nodes\n(also counting stations outside of shown area)",
                       outname="num_connections")
 
 
-def get_fastest_route_plot(network, stops_data, start_times, start_station_name, stop_station_name):
+def get_fastest_route_plot(network, stops_data, start_times, start_station_name, stop_station_name,
+                           algorithm="dijkstra", date=None):
     start = find_closest_station_id_by_name(start_station_name, stops_data)
     stop = find_closest_station_id_by_name(stop_station_name, stops_data)
     map_box = (49.8488, 8.560719, 49.931479, 8.90061)  # area around Darmstadt including Dieburg
     rows = []
 
     for t in start_times:
-        route = network.get_fastest_route(start, t, stop)
+        route = network.get_fastest_route(start, t, stop, algorithm=algorithm, date=date)
         # trace back the route to draw it on the map
         current_stop = stop
         while current_stop != start:
@@ -146,43 +155,38 @@ def get_fastest_route_plot(network, stops_data, start_times, start_station_name,
                     outname="fastest_route")
 
 
-def get_num_vehicles_plot(network, in_area, map_box):
+def get_num_vehicles_plot(network, in_area, map_box, date=None):
     # number of vehicles on this network section per day
-    network_frequencies = {}
-    for stop_id, row in in_area.iterrows():
-        for connected_stop, timetable in network.stops[stop_id].items():
-            if connected_stop in in_area.index:  # only connections inside the area
-                if (stop_id, connected_stop) in network_frequencies:
-                    network_frequencies[(stop_id, connected_stop)] += len(timetable)
-                elif (connected_stop, stop_id) in network_frequencies:
-                    network_frequencies[(connected_stop, stop_id)] += len(timetable)
-                else:
-                    # add new entry
-                    network_frequencies[(connected_stop, stop_id)] = len(timetable)
-    # get coordinates of start and end
-    rows = []
-    for (stop1, stop2), num_vehicles in network_frequencies.items():
-        if num_vehicles > 2:
-            # cleaner visualization as some single or twice a day trips look wired on the map (this happens mostly in the night)
-            rows.append([in_area.loc[stop1, "Latitude"], in_area.loc[stop1, "Longitude"],
-                         in_area.loc[stop2, "Latitude"], in_area.loc[stop2, "Longitude"],
-                         num_vehicles])
+    edges = get_network_stats(network, date).get_edge_table(network)
+    # only connections inside the area
+    edges = edges[edges["stop_from"].isin(in_area.index) & edges["stop_to"].isin(in_area.index)]
+    # both directions of a section count together
+    first = np.where(edges["stop_from"] < edges["stop_to"], edges["stop_from"], edges["stop_to"])
+    second = np.where(edges["stop_from"] < edges["stop_to"], edges["stop_to"], edges["stop_from"])
+    sections = edges.groupby([first, second])["vehicles"].sum()
+    # cleaner visualization as some single or twice a day trips look wired on the map (this happens mostly in the night)
+    sections = sections[sections > 2]
+    stop1, stop2 = sections.index.get_level_values(0), sections.index.get_level_values(1)
 
-    # to pandas dataframe
-    route_data = pd.DataFrame(rows,
-                              columns=["Latitude_start", "Longitude_start", "Latitude_stop", "Longitude_stop",
-                                       "num_vehicles"])
+    # get coordinates of start and end
+    positions = in_area[~in_area.index.duplicated()]
+    route_data = pd.DataFrame({"Latitude_start": positions.loc[stop1, "Latitude"].to_numpy(),
+                               "Longitude_start": positions.loc[stop1, "Longitude"].to_numpy(),
+                               "Latitude_stop": positions.loc[stop2, "Latitude"].to_numpy(),
+                               "Longitude_stop": positions.loc[stop2, "Longitude"].to_numpy(),
+                               "num_vehicles": sections.to_numpy()})
     get_plot_colorbar(route_data, "num_vehicles", map_box, kind="lines",
                       title=f"Number of Vehicles on route Per day",
                       outname="vehicles_per_day")
 
 
-def get_reacable_in_plot(network, in_area, map_box, start_station_name):
+def get_reacable_in_plot(network, in_area, map_box, start_station_name, algorithm="dijkstra", date=None):
     time_limit = 180
     start = find_closest_station_id_by_name(start_station_name, in_area)
     start_time = 9 * 60
 
-    reachable_info = network.get_reachable_stations_in_time(start, start_time, time_limit)
+    reachable_info = network.get_reachable_stations_in_time(start, start_time, time_limit, algorithm=algorithm,
+                                                            date=date)
 
     in_area["reachable_in"] = in_area.apply(
         # row.name is the station id
@@ -195,30 +199,60 @@ def get_reacable_in_plot(network, in_area, map_box, start_station_name):
                       legend_title="Reachable in minutes", outname="reachable_in")
 
 
-def get_population_plot(network, in_area, map_box):
-    print("Read Population data")
-    # data from: https://data.humdata.org/dataset/germany-high-resolution-population-density-maps-demographic-estimates
-    df = pd.read_csv("data/population_deu_2019-07-01.csv")
-    # only the relevant part
-    in_area_population = df[(map_box[0] <= df["Lat"]) & (df["Lat"] <= map_box[2]) &
-                            (map_box[1] <= df["Lon"]) & (df["Lon"] <= map_box[3])].copy()
+def get_isochrone_plot(network, stops, in_area, map_box, start_station_name, thresholds, algorithm="dijkstra",
+                       date=None):
+    start = find_closest_station_id_by_name(start_station_name, in_area)
+    start_time = 9 * 60
+    thresholds = sorted(thresholds)
+    # one search to the largest time limit for all isochrones
+    isochrones = get_isochrones(network, stops, start, start_time, thresholds, algorithm=algorithm, date=date,
+                                map_box=map_box)
 
-    station_coords = in_area[["Latitude", "Longitude"]].to_numpy()
+    title = f"Reachable from {in_area.loc[start, 'Name']} (starting {minutes_to_time(start_time)})"
+    print(f"Draw Plot: {title}")
+    boundaries = [0] + thresholds
+    # one color per band, taken in the middle of the band
+    band_centers = [(lower + upper) / 2 for lower, upper in zip(boundaries[:-1], boundaries[1:])]
+    import matplotlib
+    import matplotlib.colors as mcolors
+    from matplotlib.patches import PathPatch
+    from matplotlib.path import Path
+    cmap = matplotlib.colormaps["tab10"]
+    norm = mcolors.BoundaryNorm(boundaries, cmap.N)
+
+    map, ax = draw_map(map_box, title)
+    # the bands do not overlap, so every area gets the color of the first time limit it is reached within
+    for isochrone, band_center in zip(isochrones, band_centers):
+        color = cmap(norm(band_center))
+        for rings in isochrone.band_polygons:
+            vertices = [np.column_stack(map.to_pixels(ring[:, 0], ring[:, 1])) for ring in rings]
+            codes = [[Path.MOVETO] + [Path.LINETO] * (len(ring) - 2) + [Path.CLOSEPOLY] for ring in vertices]
+            ax.add_patch(PathPatch(Path(np.concatenate(vertices), np.concatenate(codes)), facecolor=color,
+                                   edgecolor=color, alpha=0.3, zorder=2))
+
+    import matplotlib.cm as cm
+    from matplotlib import pyplot as plt
+    from mpl_toolkits.axes_grid1.inset_locator import inset_axes
+    cax = inset_axes(ax, width="5%", height="50%", loc='upper right', borderpad=2)
+    sm = cm.ScalarMappable(norm=norm, cmap=cmap)
+    cbar = plt.colorbar(sm, cax=cax, boundaries=boundaries, ticks=band_centers)
+    cbar.ax.set_yticklabels([f"{threshold}" for threshold in thresholds])
+    cbar.set_label("Minutes to Reach")
+    save_plot("isochrones")
 
-    # Build KD-tree for station locations
-    tree = cKDTree(station_coords)
 
-    # Query nearest station for each population point
-    population_coords = in_area_population[["Lat", "Lon"]].to_numpy()
-    distances, indices = tree.query(population_coords, k=1)
+def get_population_plot(stops, in_area, map_box, population_file):
+    print("Read Population data")
+    # data from: https://data.humdata.org/dataset/germany-high-resolution-population-density-maps-demographic-estimates
+    # converted once into a tiled, memory-mapped store, so that only the tiles around the area are read
+    population = PopulationGrid.open(population_file)
 
-    in_area_population["nearest_station_id"] = in_area.index[indices]  # save nearest station
-    population_per_station = in_area_population.groupby("nearest_station_id")["Population"].sum()
+    # nearest station for each population point, from the spatial index over all stations,
+    # so people living closer to a station outside the area are not counted for the area
+    population_per_station = population.get_population_per_stop(stops, *map_box)
 
-    in_area["Population"] = in_area.apply(
-        # row.name is the station id
-        # 1 as minimum, as 0 cannot be visualized in plot
-        lambda row: population_per_station[row.name] if row.name in population_per_station else 1, axis=1)
+    # 1 as minimum, as 0 cannot be visualized in plot
+    in_area["Population"] = population_per_station.reindex(in_area.index, fill_value=1)
 
     get_plot_colorbar(in_area,
                       "Population", map_box, kind="points",
@@ -242,43 +276,41 @@ def draw_map(map_box, title):
     return map, ax
 
 
+def get_colors(values, cmap=None, norm=None, colordict=None):
+    # colors of all values at once, either from the colormap or from the given colors per value
+    if colordict is None:
+        assert norm is not None
+        assert cmap is not None
+        return cmap(norm(np.asarray(values)))
+    assert norm is None
+    assert cmap is None
+    return [colordict[value] for value in values]
+
+
 def draw_data_points(map, ax, df, values_col, cmap=None, norm=None, colordict=None):
-    for _, row in tqdm(df.iterrows(), total=len(df)):
-        lat, lon = row["Latitude"], row["Longitude"]
-        x, y = map.to_pixels(lat, lon)
-
-        value = row[values_col]
-        if colordict is None:
-            assert norm is not None
-            assert cmap is not None
-            color = cmap(norm(value))
-        else:
-            assert norm is None
-            assert cmap is None
-            color = colordict[value]
-        ax.plot(x, y, 'o', color=color, ms=10, mew=0.5, alpha=.5)
+    # one projection and one scatter for all points, instead of an artist per point
+    x, y = map.to_pixels(df["Latitude"].to_numpy(), df["Longitude"].to_numpy())
+    colors = get_colors(df[values_col], cmap=cmap, norm=norm, colordict=colordict)
+    # same look as markers of size 10 drawn by ax.plot (scatter sizes are the squared marker size)
+    ax.scatter(x, y, s=10 ** 2, c=colors, edgecolors="face", linewidths=0.5, alpha=.5, zorder=2)
 
 
 def draw_data_lines(map, ax, df, values_col, cmap=None, norm=None, colordict=None):
-    for _, row in tqdm(df.iterrows(), total=len(df)):
-        lat1, lon1 = row["Latitude_start"], row["Longitude_start"]
-        x1, y1 = map.to_pixels(lat1, lon1)
-        lat2, lon2 = row["Latitude_stop"], row["Longitude_stop"]
-        x2, y2 = map.to_pixels(lat2, lon2)
-
-        value = row[values_col]
-        if colordict is None:
-            assert norm is not None
-            assert cmap is not None
-            color = cmap(norm(value))
-        else:
-            assert norm is None
-            assert cmap is None
-            color = colordict[value]
-        ax.plot([x1, x2], [y1, y2], '-', color=color, linewidth=2, alpha=.75)
+    from matplotlib.collections import LineCollection
+    # one projection and one LineCollection for all lines, instead of an artist per line
+    x1, y1 = map.to_pixels(df["Latitude_start"].to_numpy(), df["Longitude_start"].to_numpy())
+    x2, y2 = map.to_pixels(df["Latitude_stop"].to_numpy(), df["Longitude_stop"].to_numpy())
+    segments = np.stack([np.column_stack([x1, y1]), np.column_stack([x2, y2])], axis=1)
+    colors = get_colors(df[values_col], cmap=cmap, norm=norm, colordict=colordict)
+    ax.add_collection(LineCollection(segments, colors=colors, linewidths=2, alpha=.75, capstyle="projecting"))
+    # unlike ax.plot, adding a collection does not update the view
+    ax.autoscale_view()
 
 
 def add_colorbar(ax, norm, cmap, legend_title):
+    import matplotlib.cm as cm
+    from matplotlib import pyplot as plt
+    from mpl_toolkits.axes_grid1.inset_locator import inset_axes
     cax = inset_axes(ax,
                      width="5%",  # width of colorbar relative to parent axes
                      height="50%",  # height of colorbar relative to parent axes
@@ -289,6 +321,7 @@ def add_colorbar(ax, norm, cmap, legend_title):
 
 
 def add_legend(ax, colordict, unit_name, legend_title):
+    from matplotlib.lines import Line2D
     legend_elements = [
         Line2D([0], [0], marker='o', color='w', label=f"{key}{unit_name}",
                markerfacecolor=color, markersize=10)
@@ -298,6 +331,7 @@ def add_legend(ax, colordict, unit_name, legend_title):
 
 
 def save_plot(filename):
+    from matplotlib import pyplot as plt
     # write to file
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", category=UserWarning)
@@ -310,6 +344,8 @@ def save_plot(filename):
 def get_plot_colorbar(df, values_col, map_box, kind="points", title="", legend_title="", outname="plot",
                       colormap_name="plasma"):
     print(f"Draw Plot: {title}")
+    import matplotlib
+    import matplotlib.colors as mcolors
     norm = mcolors.LogNorm(
         vmin=df[values_col].min(),
         vmax=df[values_col].max()
@@ -331,6 +367,7 @@ def get_plot_legend(df, values_col, map_box, kind="points", title="", legend_tit
     print(f"Draw Plot: {title}")
     unique_values = sorted(df[values_col].unique())
     n_colors = len(unique_values)
+    import matplotlib
     colors = matplotlib.colormaps[colormap_name]
     colordict = {value: colors(i) for i, value in enumerate(unique_values)}
 
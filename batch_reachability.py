@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import typing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+from instrumentation import Instrumentation
+from network import Network
+from utils import time_to_minutes
+
+# pandas (and the stations with it) is imported where it is used, so that the worker processes start quickly
+if typing.TYPE_CHECKING:
+    import pandas as pd
+
+# batch output format: a directory of raw column files that are appended to while results come in
+#   origin, start_time, stop, arrival   int32 columns, one row per reachable stop of each (origin, start time)
+#   stop_ids.npy                        stop index → stop id for the stop column
+#   meta.json                           origins (the origin column indexes into them) and the search parameters,
+#                                       written last
+COLUMNS = ("origin", "start_time", "stop", "arrival")
+META_FILE = "meta.json"
+
+# the network of a worker process, opened once by the pool initializer
+_worker_network: typing.Optional[Network] = None
+
+
+def _init_worker(network_file: str, instrumentation_file: typing.Optional[str]) -> None:
+    global _worker_network
+    # a compiled network is memory-mapped, so all workers share the same pages of the network
+    _worker_network = Network(network_file)
+    _worker_network.instrumentation = Instrumentation(instrumentation_file)
+
+
+def _reachable_from(origin_idx: int, origin: str, start_time: int, time_limit: int, algorithm: str,
+                    date: typing.Optional[datetime.date]) -> typing.Dict[str, np.ndarray]:
+    reachable = _worker_network.get_reachable_stations_in_time(origin, start_time, time_limit, algorithm=algorithm,
+                                                               date=date)
+    stop_index = _worker_network.get_stop_index()
+    return {
+        "origin": np.full(len(reachable), origin_idx, dtype=np.int32),
+        "start_time": np.full(len(reachable), start_time, dtype=np.int32),
+        "stop": np.array([stop_index[stop_id] for stop_id in reachable], dtype=np.int32),
+        "arrival": np.array([arrival for arrival, _ in reachable.values()], dtype=np.int32),
+    }
+
+
+def run_batch(network_file: str, origins: typing.List[str], start_times: typing.List[int], time_limit: int,
+              output: str, num_workers: typing.Optional[int] = None, algorithm: str = "csa",
+              date: typing.Optional[datetime.date] = None, instrumentation_file: typing.Optional[str] = None) -> int:
+    """
+    Computes the reachable stations for all combinations of origins and start times in a process pool
+    and streams the results into a columnar output directory.
+
+    Args:
+        network_file (str): Path to the network, should be a compiled network, so the workers share it.
+        origins (list): Origin stop IDs.
+        start_times (list): Start times in minutes since midnight.
+        time_limit (int): Time limit in minutes.
+        output (str): Output directory.
+        num_workers (Optional[int]): Number of worker processes, defaults to the number of CPUs.
+        algorithm (str): Search to use, one of `Network.ALGORITHMS`.
+        date (Optional[datetime.date]): Only use connections running on this date,
+            None for the default date of the network.
+        instrumentation_file (Optional[str]): File the workers append the counters of every search to.
+
+    Returns:
+        int: Number of rows written.
+    """
+    os.makedirs(output, exist_ok=True)
+    network = Network(network_file)
+    stop_ids = network.get_stop_index()
+    np.save(os.path.join(output, "stop_ids.npy"),
+            np.array([stop_id.encode("utf-8") for stop_id in stop_ids], dtype=np.bytes_))
+    unknown = [origin for origin in origins if origin not in stop_ids]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown origins: {unknown[:10]}")
+    # resolved here, so that the meta data records the date the results are for
+    if date is None:
+        date = network.default_date
+
+    num_rows = 0
+    column_files = {name: open(os.path.join(output, f"{name}.bin"), "wb") for name in COLUMNS}
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                                 initargs=(network_file, instrumentation_file)) as executor:
+            futures = [executor.submit(_reachable_from, origin_idx, origin, start_time, time_limit, algorithm, date)
+                       for origin_idx, origin in enumerate(origins) for start_time in start_times]
+            # write results in the order they finish, so that memory does not depend on the batch size
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                result = future.result()
+                for name in COLUMNS:
+                    result[name].tofile(column_files[name])
+                num_rows += len(result["stop"])
+    finally:
+        for f in column_files.values():
+            f.close()
+
+    # meta data is written last, so an interrupted run is not mistaken for a complete result
+    with open(os.path.join(output, META_FILE), "w") as f:
+        json.dump({"origins": origins, "start_times": start_times, "time_limit": time_limit,
+                   "algorithm": algorithm, "date": None if date is None else date.isoformat(), "rows": num_rows},
+                  f)
+    return num_rows
+
+
+def read_batch_result(output: str) -> pd.DataFrame:
+    """
+    Reads the result of `run_batch`.
+
+    Args:
+        output (str): Output directory of the batch run.
+
+    Returns:
+        pd.DataFrame: columns origin, start_time, stop, arrival; origin and stop are categorical stop IDs.
+    """
+    import pandas as pd
+
+    with open(os.path.join(output, META_FILE)) as f:
+        meta = json.load(f)
+    columns = {name: np.fromfile(os.path.join(output, f"{name}.bin"), dtype=np.int32) for name in COLUMNS}
+    stop_ids = [stop_id.decode("utf-8") for stop_id in np.load(os.path.join(output, "stop_ids.npy")).tolist()]
+    columns["origin"] = pd.Categorical.from_codes(columns["origin"], categories=meta["origins"])
+    columns["stop"] = pd.Categorical.from_codes(columns["stop"], categories=stop_ids)
+    return pd.DataFrame(columns)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="compute the reachable stations for many origins in parallel")
+    parser.add_argument('--network_file', default='network.csr', required=False)
+    parser.add_argument('--stations_file', default='stops.csv', required=False)
+    parser.add_argument('--origins', default=None, type=str, required=False,
+                        help='file with one origin stop ID per line')
+    parser.add_argument('--bbox', default=None, type=float, nargs=4, metavar=('LAT1', 'LON1', 'LAT2', 'LON2'),
+                        required=False, help='use all stations inside this area as origins')
+    parser.add_argument('--start_times', default=['09:00'], type=str, nargs='+', help='start times in HH:MM',
+                        required=False)
+    parser.add_argument('--time_limit', default=30, type=int, help='time limit in minutes', required=False)
+    parser.add_argument('--date', default=None, type=str, required=False,
+                        help='day of service in YYYY-MM-DD (default: the default date of the network)')
+    parser.add_argument('--algorithm', default='csa', choices=Network.ALGORITHMS, required=False)
+    parser.add_argument('--workers', default=None, type=int, help='number of worker processes', required=False)
+    parser.add_argument('--output', default='reachability', required=False, help='output directory')
+    parser.add_argument('--instrumentation', default=None, type=str, required=False,
+                        help='append the counters of every search to this file as JSON lines')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.origins is not None:
+        with open(args.origins) as f:
+            origins = [line.strip() for line in f if line.strip() != ""]
+    elif args.bbox is not None:
+        from stops import Stops
+
+        origins = list(Stops.open(args.stations_file).in_bbox(*args.bbox).index)
+    else:
+        raise SystemExit("either --origins or --bbox is required")
+
+    start_times = [time_to_minutes(t) for t in args.start_times]
+    date = None if args.date is None else datetime.date.fromisoformat(args.date)
+    num_rows = run_batch(args.network_file, origins, start_times, args.time_limit, args.output,
+                         num_workers=args.workers, algorithm=args.algorithm, date=date,
+                         instrumentation_file=args.instrumentation)
+    print(f"wrote {num_rows} rows for {len(origins)} origins to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+import typing
+import zipfile
+
+from compiled_network import write_compiled_network
+from connection_columns import ConnectionColumns
+from network import Network, runs_on
+from parse_input_file import get_line_info_from_file
+from synthetic_netex import SyntheticTimetable
+
+# benchmarks of the build and the searches on a synthetic timetable (see synthetic_netex.py),
+# every phase is repeated and the fastest run is reported, so the numbers are comparable across releases
+# departure window of the profile queries in minutes, every minute of it is checked with a single query
+PROFILE_WINDOW = 15
+
+
+def measure(function: typing.Callable[[], typing.Any], repeat: int) -> typing.Tuple[float, typing.Any]:
+    """
+    Runs the function `repeat` times.
+
+    Returns:
+        Tuple[float, Any]: The fastest run time in seconds and the result of the last run.
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def is_strictly_increasing(values: typing.Sequence[int]) -> bool:
+    return all(first < second for first, second in zip(values, values[1:]))
+
+
+def count_profile_mismatches(profile: typing.Dict[str, typing.List[typing.Tuple[int, int]]],
+                             single_queries: typing.List[typing.Dict[str, int]], start: str, departure_from: int,
+                             time_limit: int) -> int:
+    """
+    Compares an arrival profile with single queries for the first minutes of its departure window,
+    the window has to extend at least the time limit beyond the last single query.
+
+    Args:
+        profile (dict): The result of `get_arrival_profile`.
+        single_queries (list): Per minute from `departure_from` on, stop_id → earliest arrival.
+        start (str): The start of the queries, it is not part of the profile.
+        departure_from (int): First minute of the window.
+        time_limit (int): Time limit of the single queries.
+
+    Returns:
+        int: Number of minutes with other earliest arrivals than the profile, plus one if the profile holds
+        labels that are not Pareto-optimal.
+    """
+    mismatches = 0
+    if not all(is_strictly_increasing([departure for departure, _ in labels]) and
+               is_strictly_increasing([arrival for _, arrival in labels]) for labels in profile.values()):
+        mismatches += 1
+    for departure, reference in enumerate(single_queries, start=departure_from):
+        # the earliest arrival leaving at or after the departure is the first such label
+        arrivals = {}
+        for stop_id, labels in profile.items():
+            arrival = next((arrival for label_departure, arrival in labels if label_departure >= departure), None)
+            if arrival is not None and arrival <= departure + time_limit:
+                arrivals[stop_id] = arrival
+        reference = {stop_id: arrival for stop_id, arrival in reference.items() if stop_id != start}
+        mismatches += arrivals != reference
+    return mismatches
+
+
+def get_arrivals_by_transfers(network: Network, start: str, start_time: int, time_limit: int,
+                              day: typing.Optional[int]) -> typing.List[typing.Dict[str, int]]:
+    """
+    Brute force reference of `get_pareto_arrivals` without transfer time: one pass over all trips per round,
+    boarding every trip at the stops reached in the round before.
+
+    Returns:
+        list: Per maximum number of transfers from 0 on, the earliest arrivals (stop_id → arrival),
+        until more transfers reach no stop earlier.
+    """
+    end_time = start_time + time_limit
+    trips = [trip for trip in network.trips if day is None or runs_on(trip.service_days, day)]
+    previous = {network.stop_ids.find(start): start_time}
+    result = []
+    while True:
+        arrivals = dict(previous)
+        for trip in trips:
+            boarded = False
+            for position, stop in enumerate(trip.stops):
+                if boarded and trip.arrivals[position] <= end_time and \
+                        trip.arrivals[position] < arrivals.get(stop, end_time + 1):
+                    arrivals[stop] = trip.arrivals[position]
+                if trip.departures[position] >= end_time:
+                    break
+                boarded = boarded or previous.get(stop, end_time + 1) <= trip.departures[position]
+        if arrivals == previous:
+            return result
+        result.append({network.stop_ids[stop]: arrival for stop, arrival in arrivals.items()})
+        previous = arrivals
+
+
+def count_pareto_mismatches(pareto: typing.Dict[str, typing.List[typing.Tuple[int, int, str, str]]],
+                            single_queries: typing.List[typing.Dict[str, int]], reference: typing.Dict[str, int],
+                            start: str) -> int:
+    """
+    Compares Pareto arrivals with single queries: the earliest arrival with at most k transfers with the
+    query limited to k transfers, and the earliest arrival with any number of transfers with `_dijkstra`.
+
+    Args:
+        pareto (dict): The result of `get_pareto_arrivals`.
+        single_queries (list): Per maximum number of transfers from 0 on, the earliest arrivals (stop_id → arrival).
+        reference (dict): Earliest arrivals of `_dijkstra`.
+        start (str): The start of the queries.
+
+    Returns:
+        int: 1 if the Pareto arrivals differ or hold labels that are not Pareto-optimal, else 0.
+    """
+    pareto = {stop_id: labels for stop_id, labels in pareto.items() if stop_id != start}
+    if not all(is_strictly_increasing([transfers for transfers, _, _, _ in labels]) and
+               is_strictly_increasing([-arrival for _, arrival, _, _ in labels]) for labels in pareto.values()):
+        return 1
+    for max_transfers, arrivals in enumerate(single_queries):
+        expected = {stop_id: min(arrival for transfers, arrival, _, _ in labels if transfers <= max_transfers)
+                    for stop_id, labels in pareto.items() if labels[0][0] <= max_transfers}
+        if {stop_id: arrival for stop_id, arrival in arrivals.items() if stop_id != start} != expected:
+            return 1
+    return int({stop_id: labels[-1][1] for stop_id, labels in pareto.items()} !=
+               {stop_id: arrival for stop_id, arrival in reference.items() if stop_id != start})
+
+
+def run_benchmarks(timetable: SyntheticTimetable, num_queries: int = 100, time_limit: int = 60, repeat: int = 3,
+                   algorithms: typing.Sequence[str] = Network.ALGORITHMS,
+                   directory: typing.Optional[str] = None) -> typing.Dict[str, typing.Any]:
+    """
+    Benchmarks parsing, merging, writing the compiled network and the searches,
+    and checks that all searches give the same arrival times as `_dijkstra` on the network in memory,
+    and that the profiles and Pareto arrivals match brute force single queries.
+
+    Args:
+        timetable (SyntheticTimetable): The timetable to benchmark with.
+        num_queries (int): Number of reachability and of fastest route queries per algorithm.
+        time_limit (int): Time limit of the reachability queries in minutes.
+        repeat (int): Number of runs of every phase.
+        algorithms (Sequence[str]): Searches to benchmark, see `Network.ALGORITHMS`.
+        directory (Optional[str]): Directory for the generated files, a temporary directory if None.
+
+    Returns:
+        dict: phase → {"seconds", plus throughput numbers}, and "mismatches" → queries with other arrival times.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory = temp_dir if directory is None else directory
+        zip_path = os.path.join(directory, "timetable.zip")
+        timetable.write_zip(zip_path)
+
+        with zipfile.ZipFile(zip_path) as zip_file:
+            xml_files = zip_file.namelist()
+            num_bytes = sum(zip_file.getinfo(xml_file).file_size for xml_file in xml_files)
+            seconds, networks = measure(
+                lambda: [get_line_info_from_file(zip_file.open(xml_file), timetable.calendar_start)
+                         for xml_file in xml_files], repeat)
+        num_connections = sum(len(timetable) for network in networks
+                              for connections in network.stops.values() for timetable in connections.values())
+        results["parse"] = {"seconds": seconds, "files_per_second": len(xml_files) / seconds,
+                            "mb_per_second": num_bytes / seconds / 1e6, "connections": num_connections}
+
+        def merge():
+            merged = Network(None)
+            for network in networks:
+                merged.merge(network)
+            return merged
+
+        seconds, network = measure(merge, repeat)
+        results["merge"] = {"seconds": seconds, "connections_per_second": num_connections / seconds}
+
+        # the path of build_full_network.py: flat columns per file, concatenated and deduplicated at once
+        seconds, _ = measure(lambda: ConnectionColumns.concatenate(
+            [ConnectionColumns.from_network(network) for network in networks]).deduplicate(), repeat)
+        results["columns_merge"] = {"seconds": seconds, "connections_per_second": num_connections / seconds}
+
+        compiled_path = os.path.join(directory, "network.csr")
+        coordinates = timetable.get_stop_coordinates()
+        seconds, _ = measure(lambda: write_compiled_network(network, compiled_path, coordinates), repeat)
+        results["write_compiled"] = {"seconds": seconds}
+        seconds, compiled = measure(lambda: Network(compiled_path), repeat)
+        results["open_compiled"] = {"seconds": seconds}
+
+        # the same queries for every algorithm, on a weekday of the calendar
+        rnd = random.Random(timetable.seed)
+        stops = sorted(network.get_stops())
+        date = timetable.calendar_start + datetime.timedelta(days=(2 - timetable.calendar_start.weekday()) % 7)
+        reachability_queries = [(rnd.choice(stops), rnd.randrange(6 * 60, 22 * 60)) for _ in range(num_queries)]
+        route_queries = [(*rnd.sample(stops, 2), rnd.randrange(6 * 60, 22 * 60)) for _ in range(num_queries)]
+        reference_reachable = [
+            {stop_id: arrival for stop_id, (arrival, _) in network.get_reachable_stations_in_time(
+                start, start_time, time_limit, algorithm="dijkstra", date=date).items()}
+            for start, start_time in reachability_queries]
+        reference_route = [network.get_fastest_route(start, start_time, end, algorithm="dijkstra",
+                                                     date=date).get(end, (None,))[0]
+                           for start, end, start_time in route_queries]
+
+        mismatches = {}
+        for algorithm in algorithms:
+            seconds, reachable = measure(lambda: [compiled.get_reachable_stations_in_time(
+                start, start_time, time_limit, algorithm=algorithm, date=date)
+                for start, start_time in reachability_queries], repeat)
+            results[f"reachable_{algorithm}"] = {"seconds": seconds, "queries_per_second": num_queries / seconds}
+            mismatches[f"reachable_{algorithm}"] = sum(
+                {stop_id: arrival for stop_id, (arrival, _) in result.items()} != reference
+                for result, reference in zip(reachable, reference_reachable))
+
+            seconds, routes = measure(lambda: [compiled.get_fastest_route(start, start_time, end, algorithm=algorithm,
+                                                                          date=date)
+                                               for start, end, start_time in route_queries], repeat)
+            results[f"route_{algorithm}"] = {"seconds": seconds, "queries_per_second": num_queries / seconds}
+            mismatches[f"route_{algorithm}"] = sum(
+                route.get(end, (None,))[0] != reference
+                for route, (_, end, _), reference in zip(routes, route_queries, reference_route))
+
+        # profiles and Pareto arrivals against brute force single queries, at the starts of the reachability queries
+        # the single queries may leave up to the time limit after the minute they start at
+        seconds, profiles = measure(lambda: [compiled.get_arrival_profile(
+            start, start_time, start_time + PROFILE_WINDOW + time_limit, time_limit, date=date)
+            for start, start_time in reachability_queries], repeat)
+        results["profile"] = {"seconds": seconds, "queries_per_second": num_queries / seconds}
+        mismatches["profile"] = sum(count_profile_mismatches(profile, [
+            {stop_id: arrival for stop_id, (arrival, _) in network.get_reachable_stations_in_time(
+                start, departure, time_limit, algorithm="dijkstra", date=date).items()}
+            for departure in range(start_time, start_time + PROFILE_WINDOW + 1)], start, start_time, time_limit) > 0
+            for profile, (start, start_time) in zip(profiles, reachability_queries))
+
+        seconds, pareto = measure(lambda: [compiled.get_pareto_arrivals(start, start_time, time_limit, date=date)
+                                           for start, start_time in reachability_queries], repeat)
+        results["pareto"] = {"seconds": seconds, "queries_per_second": num_queries / seconds}
+        day = (date - network.calendar_start).days
+        mismatches["pareto"] = sum(count_pareto_mismatches(
+            result, get_arrivals_by_transfers(network, start, start_time, time_limit, day), reference, start)
+            for result, (start, start_time), reference in zip(pareto, reachability_queries, reference_reachable))
+        results["mismatches"] = mismatches
+    return results
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="benchmark the build and the searches on a synthetic timetable")
+    parser.add_argument('--stops', default=400, type=int, required=False)
+    parser.add_argument('--lines', default=40, type=int, required=False)
+    parser.add_argument('--lines_per_file', default=2, type=int, required=False)
+    parser.add_argument('--stops_per_line', default=12, type=int, required=False)
+    parser.add_argument('--journeys_per_line', default=24, type=int, help='per direction and day type',
+                        required=False)
+    parser.add_argument('--seed', default=0, type=int, required=False)
+    parser.add_argument('--queries', default=100, type=int, help='number of queries per algorithm', required=False)
+    parser.add_argument('--time_limit', default=60, type=int, help='time limit of the reachability queries',
+                        required=False)
+    parser.add_argument('--repeat', default=3, type=int, help='runs per phase, the fastest is reported',
+                        required=False)
+    parser.add_argument('--algorithms', default=list(Network.ALGORITHMS), nargs='+', choices=Network.ALGORITHMS,
+                        required=False)
+    parser.add_argument('--output', default=None, required=False, help='write the results to this json file')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    timetable = SyntheticTimetable(num_stops=args.stops, num_lines=args.lines, lines_per_file=args.lines_per_file,
+                                   stops_per_line=args.stops_per_line, journeys_per_line=args.journeys_per_line,
+                                   seed=args.seed)
+    results = run_benchmarks(timetable, num_queries=args.queries, time_limit=args.time_limit, repeat=args.repeat,
+                             algorithms=args.algorithms)
+    mismatches = results.pop("mismatches")
+    for phase, numbers in results.items():
+        print(f"{phase:<20}" + "  ".join(f"{name} {value:.4g}" for name, value in numbers.items()))
+    for query, count in mismatches.items():
+        if count > 0:
+            print(f"{query}: {count} of {args.queries} queries differ from the reference")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"parameters": vars(args), "results": results, "mismatches": mismatches}, f, indent=2)
+    if any(count > 0 for count in mismatches.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
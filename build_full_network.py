@@ -1,18 +1,20 @@
-import datetime
 import os
-from time import strftime
+import tempfile
+import time
 import zipfile
 from datetime import datetime
 
 import pandas as pd
 from tqdm import tqdm
 
-import shelve
-
 from parse_input_file import get_line_info_from_file
 from network import Network
-import pickle
-import json
+from compiled_network import write_compiled_columns
+from connection_columns import ConnectionColumns
+from network_stats import write_network_stats
+from stops import Stops, get_index_file
+from parse_cache import ParseCache
+from instrumentation import Instrumentation, get_peak_rss
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
 #TODO argparse for these settings
@@ -21,69 +23,139 @@ use_parallel_processing = True
 # 4 batches per worker, as the files have different sizes (mostly depending on frequency of the respective service)
 batches_per_worker = 4
 
-date_to_use = datetime.strptime("2025-10-22", "%Y-%m-%d").date()  # a Wednesday outside of Holidays
+# first day of the service days stored for every connection, days before are dropped
+calendar_start = datetime.strptime("2025-07-21", "%Y-%m-%d").date()  # release date of the timetable data
+# day used by queries that select no day, a Wednesday outside of Holidays
+default_date = datetime.strptime("2025-10-22", "%Y-%m-%d").date()
+
+# parse results of the single files are cached, so that a new release only parses the changed files
+# set to None to disable the cache
+parse_cache_dir = "parse_cache"
+
+# days the per stop and per edge statistics are precomputed for (see network_stats.py), None for all days
+statistics_dates = [None, default_date]
 
+# set to a file name to record the build phases and the work of every batch as JSON lines (see instrumentation.py)
+instrumentation = Instrumentation(None)
 
-def process_xml_batch(xml_files):
-    local_network = Network(None)
+
+def process_xml_batch(xml_files, output_file):
+    # the connections of the batch are written as flat columns, the parent deduplicates all batches at once
+    parts = []
+    parse_cache = None if parse_cache_dir is None else ParseCache(parse_cache_dir)
+    # work of the batch for the instrumentation, the times are in seconds
+    stats = {"files": len(xml_files), "bytes": 0, "parsed_files": 0, "parse_seconds": 0.0, "cache_seconds": 0.0}
     with zipfile.ZipFile(file_to_read, 'r') as zip_file:
         for xml_file in xml_files:
-            local_network.merge(get_line_info_from_file(zip_file.open(xml_file), date_to_use))
-    return local_network
+            stats["bytes"] += zip_file.getinfo(xml_file).file_size
+            start = time.perf_counter()
+            key = None if parse_cache is None else ParseCache.get_key(zip_file.getinfo(xml_file), calendar_start)
+            file_connections = None if parse_cache is None else parse_cache.load(key)
+            stats["cache_seconds"] += time.perf_counter() - start
+            if file_connections is None:
+                start = time.perf_counter()
+                file_connections = ConnectionColumns.from_network(
+                    get_line_info_from_file(zip_file.open(xml_file), calendar_start))
+                stats["parse_seconds"] += time.perf_counter() - start
+                stats["parsed_files"] += 1
+                if parse_cache is not None:
+                    start = time.perf_counter()
+                    parse_cache.store(key, file_connections)
+                    stats["cache_seconds"] += time.perf_counter() - start
+            parts.append(file_connections)
+    start = time.perf_counter()
+    batch_connections = ConnectionColumns.concatenate(parts)
+    batch_connections.save(output_file)
+    stats.update(connections=len(batch_connections), save_seconds=time.perf_counter() - start,
+                 peak_rss=get_peak_rss())
+    instrumentation.record("batch", output_file=os.path.basename(output_file), **stats)
+    return output_file
 
 
-network = Network(None)
 print("Read Timetable Data ...")
-with zipfile.ZipFile(file_to_read, 'r') as zip_file:
+with zipfile.ZipFile(file_to_read, 'r') as zip_file, tempfile.TemporaryDirectory() as batch_dir:
     xml_files = [f for f in zip_file.namelist() if f.endswith(".xml")]
 
     num_workers = os.cpu_count()
-    batch_size = len(xml_files) // (num_workers * batches_per_worker)
+    batch_size = max(1, len(xml_files) // (num_workers * batches_per_worker))
     print("Batch_size %i" % batch_size)
     # batch the xml_files
     batches = [xml_files[i:i + batch_size] for i in range(0, len(xml_files), batch_size)]
-
-    if not use_parallel_processing:
-        for batch in tqdm(batches):
-            network.merge(process_xml_batch(batch))
-    else:
-        with ProcessPoolExecutor(max_workers=num_workers) as executor:
-            # dynamic scheduling of batches
-            futures = {executor.submit(process_xml_batch, b): b for b in batches}
-
-            # retrieve results in any order
-            for future in tqdm(as_completed(futures), total=len(batches)):
-                try:
-                    result = future.result()
-                    network.merge(result)  # Merge results globally
-                except Exception as e:
-                    print(f"Error processing Files: {e}")
-                    exit(1)
+    batch_files = [os.path.join(batch_dir, "batch_%i.npz" % i) for i in range(len(batches))]
+
+    with instrumentation.phase("parse", files=len(xml_files), batches=len(batches),
+                               bytes=sum(zip_file.getinfo(f).file_size for f in xml_files)) as phase:
+        start = time.perf_counter()
+        if not use_parallel_processing:
+            for batch, batch_file in tqdm(zip(batches, batch_files), total=len(batches)):
+                process_xml_batch(batch, batch_file)
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                # dynamic scheduling of batches
+                futures = {executor.submit(process_xml_batch, b, f): b for b, f in zip(batches, batch_files)}
+
+                # wait for all batches, the results are only read once all are written
+                for future in tqdm(as_completed(futures), total=len(batches)):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"Error processing Files: {e}")
+                        exit(1)
+        phase["files_per_second"] = len(xml_files) / max(time.perf_counter() - start, 1e-9)
+
+    print("Merge Batches")
+    # one concatenation and deduplication of all batches
+    with instrumentation.phase("load_batches"):
+        batch_connections = [ConnectionColumns.load(f) for f in batch_files]
+    with instrumentation.phase("concatenate"):
+        connections = ConnectionColumns.concatenate(batch_connections)
+    num_read = len(connections)
+    with instrumentation.phase("deduplicate", connections=num_read) as phase:
+        connections = connections.deduplicate()
+        phase["deduplicated"] = num_read - len(connections)
+    print("Read %i connections, %i after removing duplicates" % (num_read, len(connections)))
+    connections.calendar_start = calendar_start
+
+if parse_cache_dir is not None:
+    # drop the cached results of files no longer in the timetable data
+    with zipfile.ZipFile(file_to_read, 'r') as zip_file, instrumentation.phase("prune_parse_cache"):
+        removed = ParseCache(parse_cache_dir).prune(
+            ParseCache.get_key(zip_file.getinfo(xml_file), calendar_start) for xml_file in xml_files)
+    print("Removed %i outdated entries from the parse cache" % removed)
 
 print("Read Station Positions")
-stops_data = pd.read_csv("data/20250721_zHV_gesamt/zHV_aktuell_csv.2025-07-21.csv",
-                         delimiter=';', index_col="DHID",
-                         usecols=["DHID", "Name", "Latitude", "Longitude"],
-                         dtype={"DHID": str, "Name": str, "Latitude": float, "Longitude": float},
-                         decimal=","
-                         )
+with instrumentation.phase("read_stations"):
+    stops_data = pd.read_csv("data/20250721_zHV_gesamt/zHV_aktuell_csv.2025-07-21.csv",
+                             delimiter=';', index_col="DHID",
+                             usecols=["DHID", "Name", "Latitude", "Longitude"],
+                             dtype={"DHID": str, "Name": str, "Latitude": float, "Longitude": float},
+                             decimal=","
+                             )
 stops_data.dropna(inplace=True)
 print("Cross-Reference Data")
 # only keep relevant ones
-stops_data = stops_data.loc[stops_data.index.isin(network.get_stops())]
-# and remove unknown stops
-valid_stops = set(stops_data.index)
-stops_to_remove = [stop for stop in network.get_stops() if stop not in valid_stops]
-for stop in tqdm(stops_to_remove):
-    network.remove_stop(stop)
-
-with shelve.open('network.db') as db:
-    for key, value in network.stops.items():
-        db[key] = value
-# with open('network.json', 'w') as f:
-#    json.dump(network.stops, f)
-
-# and the stops
+stops_data = stops_data.loc[stops_data.index.isin(connections.stop_ids)]
+# and remove unknown stops, in one pass over all connections
+num_stops, num_connections = len(connections.stop_ids), len(connections)
+with instrumentation.phase("remove_unknown_stops") as phase:
+    connections = connections.retain_stops(stops_data.index)
+    phase.update(stops=num_stops - len(connections.stop_ids), connections=num_connections - len(connections))
+print("Removed %i unknown stops with %i connections" % (num_stops - len(connections.stop_ids),
+                                                        num_connections - len(connections)))
+
+print("Write Network")
+# the stop coordinates give the lower bounds of the goal-directed search
+coordinates = stops_data.groupby(level=0).first().reindex(connections.stop_ids)
+with instrumentation.phase("write", connections=len(connections), stops=len(connections.stop_ids)):
+    write_compiled_columns(connections, 'network.csr', coordinates["Latitude"].to_numpy(),
+                           coordinates["Longitude"].to_numpy(), default_date)
+with instrumentation.phase("write_statistics", dates=len(statistics_dates)):
+    write_network_stats(Network('network.csr'), 'network.csr', statistics_dates)
+# the previous shelve format can still be read by Network, connections.to_network() gives the network in memory
+
+# and the stops, with their spatial index
 stops_data.to_csv("stops.csv")
+Stops(stops_data).save(get_index_file("stops.csv"))
 
+instrumentation.record("done", peak_rss=get_peak_rss())
 print("done")
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import dataclasses
+import datetime
+import json
+import os
+import typing
+
+import numpy as np
+
+from connection_columns import ConnectionColumns
+from network import ALL_DAYS, Connection, ConnectionScanTable, DepartureIndex, LowerBoundTable, Network, RaptorTable, \
+    StopConnections, StringTable, get_stop_positions, trips_cover_connections
+from utils import midnight
+
+# compiled network format: a directory of numpy arrays that are memory-mapped when opened,
+# laid out like a compressed sparse row graph:
+#   stop_ids          sorted stop ids, the position is the stop index
+#   stop_offsets      stop index → range of its outgoing edges
+#   edge_targets      edge → stop index of the connected stop
+#   edge_offsets      edge → range of its connections
+#   departure, arrival, line, transport_type   one entry per connection, sorted by departure within each edge
+#   earliest_arrival  per connection, the suffix minimum of arrivals within its edge (see `DepartureIndex`)
+#   calendar          per connection, index into calendars (-1 for connections running every day)
+#   calendars         the distinct service day bitmasks, see `pack_service_days`
+#   csa_*             all connections sorted by departure, for the connection scan algorithm
+#   raptor_*          the trips grouped into routes, for the round based search (see `RaptorTable`),
+#                     only if the trips cover all connections
+#   stop_position     per stop, position for the lower bounds of the goal-directed search (see `LowerBoundTable`)
+#   meta.json         format version, calendar start, default date of queries,
+#                     the line / transport type names the codes refer to,
+#                     the fastest speed of the network and whether it has routes
+FORMAT_VERSION = 7
+META_FILE = "meta.json"
+
+
+def is_compiled_network(path: str) -> bool:
+    """
+    Checks whether the given path holds a compiled network.
+
+    Args:
+        path (str): Path to check.
+
+    Returns:
+        bool: True if the path is a compiled network directory.
+    """
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def write_compiled_network(network: Network, directory: str,
+                           coordinates: typing.Optional[typing.Mapping[str, typing.Tuple[float, float]]] = None) -> None:
+    """
+    Writes the network in the compiled format.
+
+    Args:
+        network (Network): Network to write.
+        directory (str): Output directory, created if it does not exist.
+        coordinates (Optional[Mapping]): stop_id → (latitude, longitude), needed for the goal-directed search.
+    """
+    connections = ConnectionColumns.from_network(network)
+    latitude = longitude = None
+    if coordinates is not None:
+        latitude, longitude = np.array([coordinates.get(stop_id, (np.nan, np.nan))
+                                        for stop_id in connections.stop_ids.tolist()], dtype=np.float64).reshape(-1, 2).T
+    write_compiled_columns(connections, directory, latitude, longitude, network.default_date)
+
+
+def write_compiled_columns(connections: ConnectionColumns, directory: str,
+                           latitude: typing.Optional[np.ndarray] = None,
+                           longitude: typing.Optional[np.ndarray] = None,
+                           default_date: typing.Optional[datetime.date] = None) -> None:
+    """
+    Writes flat connection columns in the compiled format, without building a Network first.
+
+    Args:
+        connections (ConnectionColumns): Connections to write, all stops of its stop table become part of the network.
+        directory (str): Output directory, created if it does not exist.
+        latitude (Optional[np.ndarray]): Latitude per stop of the stop table (NaN if unknown),
+            needed for the goal-directed search.
+        longitude (Optional[np.ndarray]): Longitude per stop of the stop table (NaN if unknown).
+        default_date (Optional[datetime.date]): Day used by queries without date, needed for queries without date
+            if the connections have a calendar.
+    """
+    os.makedirs(directory, exist_ok=True)
+    num_stops = len(connections.stop_ids)
+    # the stop table is sorted, so stop codes are the stop indices of the compiled network
+    order = np.lexsort((connections.arrival, connections.departure, connections.stop_to, connections.stop_from))
+    stop_from = connections.stop_from[order]
+    stop_to = connections.stop_to[order]
+    departure = connections.departure[order].astype(np.int32)
+    # day wrap around (e.g. a night train)
+    arrival = connections.arrival[order].astype(np.int32)
+    wrapped_arrival = np.where(arrival < departure, arrival + midnight, arrival)
+
+    # an edge starts wherever stop_from or stop_to changes
+    edge_starts = np.flatnonzero(np.append(True, (stop_from[1:] != stop_from[:-1]) | (stop_to[1:] != stop_to[:-1]))
+                                 ) if len(order) > 0 else np.zeros(0, dtype=np.int64)
+    edge_offsets = np.append(edge_starts, len(order)).astype(np.int64)
+    stop_offsets = np.searchsorted(stop_from[edge_starts], np.arange(num_stops + 1)).astype(np.int64)
+
+    # suffix minimum of arrivals within each edge (see `DepartureIndex`): a running minimum over the reversed
+    # connections, with the arrivals of each edge shifted above all arrivals of the edges before it
+    edge_id = np.repeat(np.arange(len(edge_starts), dtype=np.int64), np.diff(edge_offsets))
+    shift = edge_id * (int(wrapped_arrival.max()) + 1 if len(order) > 0 else 1)
+    earliest_arrival = np.minimum.accumulate((wrapped_arrival + shift)[::-1])[::-1] - shift
+
+    columns = {
+        "stop_ids": np.char.encode(connections.stop_ids.astype(str), "utf-8").astype(np.bytes_),
+        "stop_offsets": stop_offsets,
+        "edge_targets": stop_to[edge_starts].astype(np.int32),
+        "edge_offsets": edge_offsets,
+        "departure": departure,
+        "arrival": arrival,
+        "earliest_arrival": earliest_arrival.astype(np.int32),
+        "line": connections.line[order].astype(np.int32),
+        "transport_type": connections.transport_type[order].astype(np.int16),
+        "calendar": connections.calendar[order].astype(np.int32),
+        "calendars": connections.calendars,
+    }
+
+    # flat table for the connection scan algorithm
+    csa_order = np.lexsort((wrapped_arrival, departure))
+    columns["csa_departure"] = departure[csa_order]
+    columns["csa_arrival"] = wrapped_arrival[csa_order].astype(np.int32)
+    columns["csa_stop_from"] = stop_from[csa_order].astype(np.int32)
+    columns["csa_stop_to"] = stop_to[csa_order].astype(np.int32)
+    columns["csa_calendar"] = columns["calendar"][csa_order]
+
+    # routes for the round based search, left out if the trips do not cover the connections
+    has_routes = trips_cover_connections(stop_from, stop_to, departure, arrival, connections.trip_offsets,
+                                         connections.trip_stops, connections.trip_arrival,
+                                         connections.trip_departure)
+    if has_routes:
+        raptor_table = RaptorTable.from_trips(num_stops, connections.trip_offsets, connections.trip_stops,
+                                              connections.trip_arrival, connections.trip_departure,
+                                              connections.trip_line, connections.trip_calendar,
+                                              connections.calendars)
+        for field in dataclasses.fields(raptor_table):
+            if field.name != "calendars":
+                columns[f"raptor_{field.name}"] = getattr(raptor_table, field.name)
+
+    # lower bounds for the goal-directed search
+    if latitude is None or longitude is None:
+        latitude = longitude = np.full(num_stops, np.nan)
+    lower_bound_table = LowerBoundTable.from_connections(get_stop_positions(latitude, longitude), stop_from, stop_to,
+                                                         departure, wrapped_arrival)
+    columns["stop_position"] = get_stop_positions(latitude, longitude)
+
+    for name, column in columns.items():
+        np.save(os.path.join(directory, f"{name}.npy"), column)
+    # meta data is written last, so an interrupted write is not recognized as a compiled network
+    with open(os.path.join(directory, META_FILE), "w") as f:
+        calendar_start = None if connections.calendar_start is None else connections.calendar_start.isoformat()
+        json.dump({"format_version": FORMAT_VERSION, "calendar_start": calendar_start,
+                   "default_date": None if default_date is None else default_date.isoformat(),
+                   "lines": connections.lines.tolist(), "transport_types": connections.transport_types.tolist(),
+                   "max_speed": None if lower_bound_table is None else lower_bound_table.max_speed,
+                   "has_routes": has_routes}, f)
+
+
+class StopIds(typing.Sequence[str]):
+    """
+    Sorted, memory-mapped stop ids: stop index → stop id and stop id → stop index by binary search.
+    """
+
+    def __init__(self, stop_ids: np.ndarray) -> None:
+        self._stop_ids = stop_ids
+
+    def __len__(self) -> int:
+        return len(self._stop_ids)
+
+    def __getitem__(self, idx: int) -> str:
+        return self._stop_ids[idx].decode("utf-8")
+
+    def find(self, stop_id: str) -> int:
+        """
+        Returns the stop index of the given stop id or -1 if it is not part of the network.
+        """
+        key = stop_id.encode("utf-8")
+        idx = int(np.searchsorted(self._stop_ids, key))
+        if idx < len(self._stop_ids) and self._stop_ids[idx] == key:
+            return idx
+        return -1
+
+
+class CompiledStops(typing.Mapping[int, StopConnections]):
+    """
+    Read-only stop index → connections mapping backed by a memory-mapped compiled network.
+    Can be used in place of `Network.stops`, the timetables are decoded without unpickling.
+    """
+
+    def __init__(self, directory: str) -> None:
+        """
+        Opens a compiled network. The arrays are memory-mapped, so opening is near instant and
+        the pages are shared between all processes using the same network.
+
+        Args:
+            directory (str): Directory written by `write_compiled_network`.
+        """
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported network format version {meta['format_version']} in {directory}")
+        self.directory = directory
+        self.lines = StringTable(meta["lines"])
+        self.transport_types = StringTable(meta["transport_types"])
+        self.calendar_start = None
+        if meta["calendar_start"] is not None:
+            self.calendar_start = datetime.date.fromisoformat(meta["calendar_start"])
+        self.default_date = None
+        if meta["default_date"] is not None:
+            self.default_date = datetime.date.fromisoformat(meta["default_date"])
+
+        def load(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        self.stop_ids = StopIds(load("stop_ids"))
+        self.stop_offsets = load("stop_offsets")
+        self.edge_targets = load("edge_targets")
+        self.edge_offsets = load("edge_offsets")
+        self.departure = load("departure")
+        self.arrival = load("arrival")
+        self.earliest_arrival = load("earliest_arrival")
+        self.line = load("line")
+        self.transport_type = load("transport_type")
+        self.calendar = load("calendar")
+        self.calendars = load("calendars")
+        # calendar index → service days, decoded on first use
+        self._service_days = {-1: ALL_DAYS}
+        self.csa_table = ConnectionScanTable(load("csa_departure"), load("csa_arrival"), load("csa_stop_from"),
+                                             load("csa_stop_to"), load("csa_calendar"), self.calendars)
+        self.raptor_table = None
+        if meta["has_routes"]:
+            self.raptor_table = RaptorTable(**{field.name: load(f"raptor_{field.name}")
+                                               for field in dataclasses.fields(RaptorTable)
+                                               if field.name != "calendars"},
+                                            calendars=self.calendars)
+        self.lower_bound_table = None
+        if meta["max_speed"] is not None:
+            self.lower_bound_table = LowerBoundTable(load("stop_position"), meta["max_speed"])
+
+    def _get_service_days(self, calendar: int) -> int:
+        if calendar not in self._service_days:
+            self._service_days[calendar] = int.from_bytes(self.calendars[calendar].tobytes(), "little")
+        return self._service_days[calendar]
+
+    def __getitem__(self, idx: int) -> StopConnections:
+        first_edge, last_edge = int(self.stop_offsets[idx]), int(self.stop_offsets[idx + 1])
+        offsets = self.edge_offsets[first_edge:last_edge + 1].tolist()
+        # decode all connections of this stop at once
+        first, last = offsets[0], offsets[-1]
+        connections = [Connection(departure, arrival, line, transport_type, self._get_service_days(calendar))
+                       for departure, arrival, line, transport_type, calendar in zip(
+                self.departure[first:last].tolist(), self.arrival[first:last].tolist(),
+                self.line[first:last].tolist(), self.transport_type[first:last].tolist(),
+                self.calendar[first:last].tolist())]
+        return {target: connections[begin - first:end - first]
+                for target, begin, end in zip(self.edge_targets[first_edge:last_edge].tolist(), offsets, offsets[1:])}
+
+    def get_departure_index(self, idx: int) -> typing.Dict[int, DepartureIndex]:
+        """
+        Returns the departure index of all connections from a given stop, see `Network.get_departure_index`.
+        """
+        first_edge, last_edge = int(self.stop_offsets[idx]), int(self.stop_offsets[idx + 1])
+        offsets = self.edge_offsets[first_edge:last_edge + 1].tolist()
+        first, last = offsets[0], offsets[-1]
+        departures = self.departure[first:last].tolist()
+        earliest_arrivals = self.earliest_arrival[first:last].tolist()
+        return {target: DepartureIndex(departures[begin - first:end - first],
+                                       earliest_arrivals[begin - first:end - first])
+                for target, begin, end in zip(self.edge_targets[first_edge:last_edge].tolist(), offsets, offsets[1:])}
+
+    def __contains__(self, idx: object) -> bool:
+        return isinstance(idx, int) and 0 <= idx < len(self.stop_ids)
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(range(len(self.stop_ids)))
+
+    def __len__(self) -> int:
+        return len(self.stop_ids)
@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import dataclasses
+import datetime
+import typing
+from dataclasses import dataclass
+
+import numpy as np
+
+from network import ALL_DAYS, Connection, Network, StringTable, Trip, pack_service_days
+
+# the integer columns of ConnectionColumns, one entry per connection
+COLUMNS = ("stop_from", "stop_to", "departure", "arrival", "line", "transport_type", "calendar")
+# the integer columns of the trips, one entry per trip and one entry per stop of each trip
+TRIP_COLUMNS = ("trip_line", "trip_transport_type", "trip_calendar")
+STOP_TIME_COLUMNS = ("trip_stops", "trip_arrival", "trip_departure")
+
+
+def _unpack_service_days(calendars: np.ndarray) -> typing.List[int]:
+    return [int.from_bytes(row.tobytes(), "little") for row in calendars]
+
+
+def _merge_tables(tables: typing.List[np.ndarray]) -> typing.Tuple[np.ndarray, typing.List[np.ndarray]]:
+    """
+    Merges string tables into one sorted table.
+    Returns the merged table and for each input table the mapping of its codes to the merged codes.
+    """
+    merged, inverse = np.unique(np.concatenate(tables), return_inverse=True)
+    offsets = np.cumsum([0] + [len(table) for table in tables])
+    return merged, [inverse[begin:end].astype(np.int32) for begin, end in zip(offsets, offsets[1:])]
+
+
+# all connections and trips of a network as flat columns, used to pass parse results between processes without
+# pickling, stops, lines and transport types are codes into sorted string tables, calendar is an index into calendars
+@dataclass
+class ConnectionColumns:
+    calendar_start: typing.Optional[datetime.date]
+    stop_ids: np.ndarray
+    lines: np.ndarray
+    transport_types: np.ndarray
+    calendars: np.ndarray  # see pack_service_days
+    stop_from: np.ndarray
+    stop_to: np.ndarray
+    departure: np.ndarray
+    arrival: np.ndarray
+    line: np.ndarray
+    transport_type: np.ndarray
+    calendar: np.ndarray  # -1 for connections running every day
+    trip_offsets: np.ndarray  # trip → range of its stops in the stop time columns
+    trip_stops: np.ndarray
+    trip_arrival: np.ndarray  # see `Trip`
+    trip_departure: np.ndarray
+    trip_line: np.ndarray
+    trip_transport_type: np.ndarray
+    trip_calendar: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.departure)
+
+    @staticmethod
+    def from_network(network: Network) -> ConnectionColumns:
+        """
+        Flattens the connections and trips of a network.
+
+        Args:
+            network (Network): The network, stops without connections are kept.
+
+        Returns:
+            ConnectionColumns: The connections.
+        """
+        stops_from, stops_to, departures, arrivals, lines, transport_types, service_days = [], [], [], [], [], [], []
+        for stop, connections in network.stops.items():
+            for connected_stop, timetable in connections.items():
+                for connection in timetable:
+                    stops_from.append(stop)
+                    stops_to.append(connected_stop)
+                    departures.append(connection.departure)
+                    arrivals.append(connection.arrival)
+                    lines.append(connection.line)
+                    transport_types.append(connection.transport_type)
+                    service_days.append(connection.service_days)
+        trips = [] if network.trips is None else network.trips
+        # the trips share the calendars with the connections
+        calendar, calendars = pack_service_days(service_days + [trip.service_days for trip in trips])
+
+        def sorted_table(table, codes):
+            # the string tables of ConnectionColumns are sorted, remap the codes of the network
+            codes = list(codes)
+            strings, inverse = np.unique(np.array([table[code] for code in codes], dtype=str), return_inverse=True)
+            mapping = np.zeros(max(codes, default=-1) + 1, dtype=np.int32)
+            mapping[codes] = inverse.reshape(-1)
+            return strings, mapping
+
+        # only the stops still part of the network, the stop table may hold removed ones
+        stop_ids, stop_mapping = sorted_table(network.stop_ids, network.stops.keys())
+        line_names, line_mapping = sorted_table(network.lines, range(len(network.lines)))
+        type_names, type_mapping = sorted_table(network.transport_types, range(len(network.transport_types)))
+
+        def column(values, mapping=None):
+            values = np.array(values, dtype=np.int32)
+            return values if mapping is None else mapping[values]
+
+        return ConnectionColumns(network.calendar_start, stop_ids, line_names, type_names, calendars,
+                                 column(stops_from, stop_mapping), column(stops_to, stop_mapping),
+                                 column(departures), column(arrivals), column(lines, line_mapping),
+                                 column(transport_types, type_mapping), calendar[:len(service_days)],
+                                 np.cumsum([0] + [len(trip.stops) for trip in trips]).astype(np.int64),
+                                 column([stop for trip in trips for stop in trip.stops], stop_mapping),
+                                 column([time for trip in trips for time in trip.arrivals]),
+                                 column([time for trip in trips for time in trip.departures]),
+                                 column([trip.line for trip in trips], line_mapping),
+                                 column([trip.transport_type for trip in trips], type_mapping),
+                                 calendar[len(service_days):])
+
+    def to_network(self) -> Network:
+        """
+        Builds a Network of the connections and trips.
+
+        Returns:
+            Network: The network, with timetables sorted by departure.
+        """
+        network = Network(None)
+        network.calendar_start = self.calendar_start
+        # the codes are used as they are
+        network.stop_ids = StringTable(self.stop_ids.tolist())
+        network.lines = StringTable(self.lines.tolist())
+        network.transport_types = StringTable(self.transport_types.tolist())
+        service_days = _unpack_service_days(self.calendars) + [ALL_DAYS]  # calendar -1 is the last entry
+        network.stops = {stop: {} for stop in range(len(self.stop_ids))}
+        order = np.lexsort((self.arrival, self.departure, self.stop_to, self.stop_from))
+        for stop_from, stop_to, departure, arrival, line, transport_type, calendar in zip(
+                *(getattr(self, name)[order].tolist() for name in COLUMNS)):
+            connections = network.stops[stop_from]
+            if stop_to not in connections:
+                connections[stop_to] = []
+            connections[stop_to].append(Connection(departure, arrival, line, transport_type, service_days[calendar]))
+        offsets = self.trip_offsets.tolist()
+        stops, arrivals, departures = (getattr(self, name).tolist() for name in STOP_TIME_COLUMNS)
+        network.trips = [Trip(tuple(stops[begin:end]), tuple(arrivals[begin:end]), tuple(departures[begin:end]),
+                              line, transport_type, service_days[calendar])
+                         for begin, end, line, transport_type, calendar in zip(
+                offsets, offsets[1:], *(getattr(self, name).tolist() for name in TRIP_COLUMNS))]
+        return network
+
+    def save(self, file: typing.Union[str, typing.BinaryIO]) -> None:
+        """
+        Writes the columns into a numpy .npz file.
+
+        Args:
+            file (str or file): Path or open binary file to write to.
+        """
+        calendar_start = "" if self.calendar_start is None else self.calendar_start.isoformat()
+        np.savez(file, calendar_start=np.array(calendar_start), **{
+            field.name: getattr(self, field.name) for field in dataclasses.fields(self)
+            if field.name != "calendar_start"})
+
+    @staticmethod
+    def load(path: str) -> ConnectionColumns:
+        """
+        Reads columns written by `save`.
+        """
+        with np.load(path) as data:
+            columns = {field.name: data[field.name] for field in dataclasses.fields(ConnectionColumns)}
+        calendar_start = str(columns["calendar_start"])
+        columns["calendar_start"] = None if calendar_start == "" else datetime.date.fromisoformat(calendar_start)
+        return ConnectionColumns(**columns)
+
+    @staticmethod
+    def concatenate(parts: typing.List[ConnectionColumns]) -> ConnectionColumns:
+        """
+        Concatenates the connections and trips of several parts, the string tables and calendars are merged.
+        Duplicates are kept, see `deduplicate`.
+        """
+        if len(parts) == 0:
+            return ConnectionColumns.from_network(Network(None))
+        calendar_starts = {part.calendar_start for part in parts} - {None}
+        if len(calendar_starts) > 1:
+            raise ValueError(f"Cannot concatenate connections with calendar starts {calendar_starts}")
+        calendar_start = calendar_starts.pop() if len(calendar_starts) == 1 else None
+
+        stop_ids, stop_mappings = _merge_tables([part.stop_ids for part in parts])
+        lines, line_mappings = _merge_tables([part.lines for part in parts])
+        transport_types, type_mappings = _merge_tables([part.transport_types for part in parts])
+        # only few distinct calendars, so they are merged in python
+        calendar_index = {}
+        calendar_mappings = []
+        for part in parts:
+            mapping = [calendar_index.setdefault(days, len(calendar_index))
+                       for days in _unpack_service_days(part.calendars)]
+            calendar_mappings.append(np.array(mapping + [-1], dtype=np.int32))  # calendar -1 stays -1
+        _, calendars = pack_service_days(calendar_index)
+
+        def concat(columns, dtype=np.int32):
+            return np.concatenate(columns).astype(dtype)
+
+        def remap(name, mappings):
+            return concat([mapping[getattr(part, name)] for part, mapping in zip(parts, mappings)])
+
+        def concat_offsets():
+            # shift the offsets of each part behind the stop times of the parts before
+            shifts = np.cumsum([0] + [part.trip_offsets[-1] for part in parts])
+            return concat([np.zeros(1)] + [part.trip_offsets[1:] + shift for part, shift in zip(parts, shifts)],
+                          np.int64)
+
+        return ConnectionColumns(
+            calendar_start, stop_ids, lines, transport_types, calendars,
+            remap("stop_from", stop_mappings), remap("stop_to", stop_mappings),
+            concat([part.departure for part in parts]), concat([part.arrival for part in parts]),
+            remap("line", line_mappings), remap("transport_type", type_mappings),
+            remap("calendar", calendar_mappings),
+            concat_offsets(), remap("trip_stops", stop_mappings),
+            concat([part.trip_arrival for part in parts]), concat([part.trip_departure for part in parts]),
+            remap("trip_line", line_mappings), remap("trip_transport_type", type_mappings),
+            remap("trip_calendar", calendar_mappings))
+
+    def deduplicate(self) -> ConnectionColumns:
+        """
+        Removes duplicated connections, the same connection on different days is combined into one
+        (as in `Network.merge`). Trips are kept as they are, as the same trip is rarely defined twice.
+
+        Returns:
+            ConnectionColumns: The connections without duplicates, sorted by stop from, stop to and departure.
+        """
+        order = np.lexsort((self.calendar, self.transport_type, self.line, self.arrival, self.departure,
+                            self.stop_to, self.stop_from))
+        columns = {name: getattr(self, name)[order] for name in COLUMNS}
+        key_columns = COLUMNS[:-1]
+
+        def same_key_as_next():
+            same = np.ones(len(columns["calendar"]) - 1, dtype=bool) if len(columns["calendar"]) > 0 else \
+                np.zeros(0, dtype=bool)
+            for name in key_columns:
+                same &= columns[name][1:] == columns[name][:-1]
+            return same
+
+        starts = np.flatnonzero(np.append(True, ~same_key_as_next())) if len(order) > 0 else \
+            np.zeros(0, dtype=np.int64)
+
+        # the same connection on one or more days, the calendars of each group are combined at once,
+        # a group with a connection running every day runs every day
+        service_days = _unpack_service_days(self.calendars)
+        calendar = columns["calendar"]
+        every_day = np.minimum.reduceat(calendar, starts) == -1 if len(starts) > 0 else np.zeros(0, dtype=bool)
+        # calendar -1 picks the appended empty row
+        packed = np.append(self.calendars, np.zeros((1, self.calendars.shape[1]), dtype=np.uint8), axis=0)
+        combined, inverse = np.unique(np.bitwise_or.reduceat(packed[calendar], starts, axis=0), axis=0,
+                                      return_inverse=True)
+        columns = {name: column[starts] for name, column in columns.items()}
+        columns["calendar"] = np.where(every_day, -1, len(service_days) + inverse.reshape(-1)).astype(np.int32)
+        service_days += _unpack_service_days(combined)
+
+        # drop the calendars no longer used by connections or trips, combined calendars may equal existing ones
+        num_connections = len(columns["calendar"])
+        used, calendar = np.unique(np.concatenate([columns["calendar"], self.trip_calendar]), return_inverse=True)
+        codes, calendars = pack_service_days(ALL_DAYS if code == -1 else service_days[code] for code in used.tolist())
+        calendar = codes[calendar.reshape(-1)]
+        columns["calendar"] = calendar[:num_connections]
+        return dataclasses.replace(self, calendars=calendars, trip_calendar=calendar[num_connections:], **columns)
+
+    def retain_stops(self, stop_ids: typing.Iterable[str]) -> ConnectionColumns:
+        """
+        Removes all stops except the given ones and all connections to/from the removed stops.
+        Trips are split at the removed stops.
+
+        Args:
+            stop_ids (Iterable[str]): Stop IDs to keep, IDs not part of the connections are ignored.
+
+        Returns:
+            ConnectionColumns: The remaining connections, the stop table only holds the kept stops.
+        """
+        keep = np.isin(self.stop_ids, np.array(list(stop_ids), dtype=str))
+        # old stop code → new stop code, -1 for removed stops
+        stop_mapping = np.where(keep, np.cumsum(keep) - 1, -1).astype(np.int32)
+        retained = keep[self.stop_from] & keep[self.stop_to]
+        columns = {name: getattr(self, name)[retained] for name in COLUMNS}
+        columns["stop_from"] = stop_mapping[columns["stop_from"]]
+        columns["stop_to"] = stop_mapping[columns["stop_to"]]
+
+        # the parts of the trips between removed stops, with at least two stops
+        kept = keep[self.trip_stops]
+        trip = np.repeat(np.arange(len(self.trip_offsets) - 1), np.diff(self.trip_offsets))
+        part_start = kept & np.append(True, ~kept[:-1] | (trip[1:] != trip[:-1]))
+        part = np.cumsum(part_start) - 1
+        part_length = np.bincount(part[kept], minlength=int(part_start.sum()))
+        keep_part = part_length >= 2
+        kept &= keep_part[np.where(kept, part, 0)] if len(keep_part) > 0 else False
+        part_trip = trip[part_start][keep_part]
+        columns["trip_offsets"] = np.cumsum(np.append(0, part_length[keep_part])).astype(np.int64)
+        for name in STOP_TIME_COLUMNS:
+            columns[name] = getattr(self, name)[kept]
+        columns["trip_stops"] = stop_mapping[columns["trip_stops"]]
+        for name in TRIP_COLUMNS:
+            columns[name] = getattr(self, name)[part_trip]
+        return dataclasses.replace(self, stop_ids=self.stop_ids[keep], **columns)
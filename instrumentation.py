@@ -0,0 +1,67 @@
+import contextlib
+import json
+import os
+import time
+import typing
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def get_peak_rss() -> typing.Optional[int]:
+    """
+    Returns the peak resident set size of the current process in bytes, None if it cannot be determined.
+    """
+    if resource is None:
+        return None
+    # reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Instrumentation:
+    """
+    Opt-in recording of structured events as JSON lines, e.g. build phases or search counters.
+    Without a file all methods do nothing, so the instrumented code needs no checks of its own.
+    """
+
+    def __init__(self, file: typing.Optional[str] = None) -> None:
+        """
+        Args:
+            file (Optional[str]): File the events are appended to, None to disable the instrumentation.
+        """
+        self.file = file
+
+    @property
+    def enabled(self) -> bool:
+        return self.file is not None
+
+    def record(self, event: str, **fields: typing.Any) -> None:
+        """
+        Appends an event with the given fields, plus the time and process ID.
+
+        Args:
+            event (str): Name of the event.
+            **fields: JSON serializable values of the event.
+        """
+        if self.file is None:
+            return
+        # one line per write, so that events of several processes do not interleave
+        line = json.dumps({"event": event, "time": time.time(), "pid": os.getpid(), **fields}) + "\n"
+        with open(self.file, "a") as f:
+            f.write(line)
+
+    @contextlib.contextmanager
+    def phase(self, name: str, **fields: typing.Any) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+        """
+        Records the wall time of a phase as a "phase" event when the phase ends.
+        Yields a dict the phase can add further fields to.
+
+        Args:
+            name (str): Name of the phase.
+            **fields: Fields known at the start of the phase.
+        """
+        start = time.perf_counter()
+        yield fields
+        self.record("phase", name=name, seconds=time.perf_counter() - start, **fields)
@@ -0,0 +1,171 @@
+import datetime
+import typing
+from dataclasses import dataclass
+from typing import Optional
+
+import contourpy
+import numpy as np
+
+from network import EARTH_RADIUS, Network
+from stops import Stops
+
+# isochrones: the area reachable from a start within each of several time limits, from one search to the largest
+# limit; every grid cell around the reached stops gets the earliest arrival at a stop plus the walk from that stop,
+# and the polygons are the filled contours of this raster at the time limits, so they are nested by construction
+DEFAULT_THRESHOLDS = (15, 30, 45, 60, 75, 90)
+WALKING_SPEED = 80  # meters per minute, about 5 km/h
+MAX_WALK = 1000  # meters walked from the last stop at most
+DEFAULT_CELL_SIZE = 100  # meters
+# larger grids get larger cells
+MAX_CELLS = 4_000_000
+
+
+@dataclass
+class Isochrone:
+    """
+    Area reachable within a time limit.
+    """
+    threshold: int  # time limit in minutes
+    # per polygon its rings as arrays of (latitude, longitude), the first ring is the outer boundary, the others holes
+    polygons: typing.List[typing.List[np.ndarray]]
+    # the part of the polygons not reachable within the previous time limit, same layout
+    band_polygons: typing.List[typing.List[np.ndarray]]
+    stops: typing.List[str]  # stop IDs reached within the time limit
+
+
+def get_travel_times(network: Network, start_point: str, start_time: int, time_limit: int,
+                     algorithm: str = "csa", date: Optional[datetime.date] = None) -> typing.Dict[str, int]:
+    """
+    Returns the travel time in minutes to every stop reachable within the time limit, from a single search.
+    """
+    reachable = network.get_reachable_stations_in_time(start_point, start_time, time_limit, algorithm=algorithm,
+                                                       date=date)
+    return {stop_id: arrival - start_time for stop_id, (arrival, _) in reachable.items()}
+
+
+def get_travel_time_raster(latitude: np.ndarray, longitude: np.ndarray, travel_time: np.ndarray,
+                           map_box: typing.Tuple[float, float, float, float], cell_size: float = DEFAULT_CELL_SIZE,
+                           walking_speed: float = WALKING_SPEED, max_walk: float = MAX_WALK) -> typing.Tuple[
+        np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes the travel time to the cells of a grid over the box: the minimum over the stops of the travel time
+    to the stop plus the walk (straight line) to the cell center, for cells within `max_walk` of a stop.
+
+    Args:
+        latitude (np.ndarray): Latitude per stop.
+        longitude (np.ndarray): Longitude per stop.
+        travel_time (np.ndarray): Travel time in minutes per stop.
+        map_box (tuple): Lat1 Lon1 Lat2 Lon2 of the grid.
+        cell_size (float): Edge length of the cells in meters, increased if the grid would exceed `MAX_CELLS`.
+        walking_speed (float): In meters per minute.
+        max_walk (float): Maximum walking distance in meters.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Latitudes of the cell rows, longitudes of the cell columns and
+        the travel times with shape (rows, columns), infinite for cells that cannot be reached.
+    """
+    lat1, lon1, lat2, lon2 = map_box
+    # equirectangular projection around the box, precise enough for walking distances
+    meters_per_degree = EARTH_RADIUS * np.pi / 180
+    x_scale = meters_per_degree * np.cos(np.radians((lat1 + lat2) / 2))
+    width, height = (lon2 - lon1) * x_scale, (lat2 - lat1) * meters_per_degree
+    cell_size = max(cell_size, np.sqrt(width * height / MAX_CELLS))
+    num_columns, num_rows = int(np.ceil(width / cell_size)) + 1, int(np.ceil(height / cell_size)) + 1
+    cell_x, cell_y = np.arange(num_columns) * cell_size, np.arange(num_rows) * cell_size
+
+    raster = np.full(num_rows * num_columns, np.inf)
+    x = (np.asarray(longitude, dtype=np.float64) - lon1) * x_scale
+    y = (np.asarray(latitude, dtype=np.float64) - lat1) * meters_per_degree
+    # offsets of the cells around a stop that may be within walking distance
+    reach = int(np.ceil(max_walk / cell_size)) + 1
+    offset_x, offset_y = [offsets.ravel() for offsets in np.meshgrid(np.arange(-reach, reach + 1),
+                                                                     np.arange(-reach, reach + 1))]
+    # chunked, as the stops times offsets arrays get large for fine grids
+    chunk_size = max(1, 2_000_000 // len(offset_x))
+    for first in range(0, len(x), chunk_size):
+        stop_x, stop_y = x[first:first + chunk_size, None], y[first:first + chunk_size, None]
+        column = np.rint(stop_x / cell_size).astype(np.int64) + offset_x
+        row = np.rint(stop_y / cell_size).astype(np.int64) + offset_y
+        distance = np.hypot(column * cell_size - stop_x, row * cell_size - stop_y)
+        valid = (distance <= max_walk) & (column >= 0) & (column < num_columns) & (row >= 0) & (row < num_rows)
+        times = np.asarray(travel_time, dtype=np.float64)[first:first + chunk_size, None] + distance / walking_speed
+        np.minimum.at(raster, (row * num_columns + column)[valid], times[valid])
+    return lat1 + cell_y / meters_per_degree, lon1 + cell_x / x_scale, raster.reshape(num_rows, num_columns)
+
+
+def get_contour_polygons(row_latitude: np.ndarray, column_longitude: np.ndarray, raster: np.ndarray,
+                         limits: typing.Sequence[typing.Tuple[float, float]]) -> typing.List[
+        typing.List[typing.List[np.ndarray]]]:
+    """
+    Returns the polygons of the raster cells with a value between the lower and upper limit of each pair,
+    see `Isochrone.polygons`.
+    """
+    # contour generators need finite values, anything above the largest limit is never inside a polygon
+    outside = max(upper for _, upper in limits) + 1
+    generator = contourpy.contour_generator(column_longitude, row_latitude, np.minimum(raster, outside),
+                                            fill_type=contourpy.FillType.OuterOffset)
+    result = []
+    for lower, upper in limits:
+        points, offsets = generator.filled(lower, upper)
+        # contour points are (x, y), i.e. (longitude, latitude)
+        result.append([[polygon_points[first:last, ::-1] for first, last in zip(polygon_offsets[:-1],
+                                                                                  polygon_offsets[1:])]
+                       for polygon_points, polygon_offsets in zip(points, offsets)])
+    return result
+
+
+def get_isochrones(network: Network, stops: Stops, start_point: str, start_time: int,
+                   thresholds: typing.Sequence[int] = DEFAULT_THRESHOLDS, algorithm: str = "csa",
+                   date: Optional[datetime.date] = None,
+                   map_box: Optional[typing.Tuple[float, float, float, float]] = None,
+                   cell_size: float = DEFAULT_CELL_SIZE, walking_speed: float = WALKING_SPEED,
+                   max_walk: float = MAX_WALK) -> typing.List[Isochrone]:
+    """
+    Computes the isochrones of all time limits from one search to the largest time limit.
+
+    Args:
+        network (Network): The network.
+        stops (Stops): The stops, for their coordinates; stops without coordinates are left out.
+        start_point (str): Starting stop ID.
+        start_time (int): Time in minutes since midnight.
+        thresholds (Sequence[int]): Time limits in minutes.
+        algorithm (str): Search to use, one of `Network.ALGORITHMS`.
+        date (Optional[datetime.date]): Only use connections running on this date,
+            None for the default date of the network.
+        map_box (Optional[tuple]): Lat1 Lon1 Lat2 Lon2 the polygons are clipped to,
+            by default the reached stops plus the walking distance.
+        cell_size (float): Edge length of the grid cells in meters.
+        walking_speed (float): In meters per minute.
+        max_walk (float): Maximum walking distance from the last stop in meters.
+
+    Returns:
+        List[Isochrone]: One isochrone per threshold, sorted by threshold.
+    """
+    thresholds = sorted(thresholds)
+    travel_times = get_travel_times(network, start_point, start_time, max(thresholds), algorithm=algorithm,
+                                    date=date)
+    positions = stops.data[~stops.data.index.duplicated()].reindex(list(travel_times))
+    positions = positions[positions["Latitude"].notna() & positions["Longitude"].notna()]
+    latitude, longitude = positions["Latitude"].to_numpy(), positions["Longitude"].to_numpy()
+    travel_time = np.array([travel_times[stop_id] for stop_id in positions.index], dtype=np.float64)
+
+    if len(positions) == 0:
+        polygons = band_polygons = [[] for _ in thresholds]
+    else:
+        if map_box is None:
+            margin_lat = max_walk / (EARTH_RADIUS * np.pi / 180)
+            margin_lon = margin_lat / np.cos(np.radians(latitude.mean()))
+            map_box = (latitude.min() - margin_lat, longitude.min() - margin_lon,
+                       latitude.max() + margin_lat, longitude.max() + margin_lon)
+        raster = get_travel_time_raster(latitude, longitude, travel_time, map_box, cell_size, walking_speed,
+                                        max_walk)
+        # travel times are at least 0, so -1 is below all of them
+        polygons = get_contour_polygons(*raster, [(-1, threshold) for threshold in thresholds])
+        band_polygons = get_contour_polygons(*raster, list(zip([-1] + thresholds[:-1], thresholds)))
+
+    # bucket the stops by the first threshold they are reached within
+    bands = np.searchsorted(np.asarray(thresholds), np.array(list(travel_times.values()), dtype=np.int64))
+    stop_ids = list(travel_times)
+    return [Isochrone(threshold, polygons[i], band_polygons[i],
+                      [stop_id for stop_id, band in zip(stop_ids, bands) if band <= i])
+            for i, threshold in enumerate(thresholds)]
@@ -0,0 +1,176 @@
+import bisect
+import difflib
+import re
+import typing
+import unicodedata
+import weakref
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# trigram postings are read from the rarest trigram on until this many name IDs are collected,
+# very common trigrams (e.g. of "bahnhof") add little to the ranking but cost the most
+MAX_CANDIDATE_POSTINGS = 5000
+# number of names the trigram overlap preselects for the final ranking
+NUM_RANKED = 16
+# number of names starting with the query that are ranked
+NUM_PREFIX = 16
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalizes a station name for the lookup: case folded, accents removed and words separated by single spaces.
+    """
+    name = unicodedata.normalize("NFKD", name.casefold())
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(re.findall(r"\w+", name))
+
+
+def get_trigrams(normalized_name: str) -> typing.Set[str]:
+    # padded, so that the first and last characters are part of as many trigrams as the others
+    padded = f"  {normalized_name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Index over station names for `utils.find_closest_station_id_by_name`: exact and normalized exact hash maps,
+    sorted normalized names for prefix lookups and trigram postings for similar names.
+    Similar names are preselected by the number of shared trigrams and ranked by the `difflib` similarity,
+    so only a few names are compared instead of all of them.
+    """
+
+    def __init__(self, names: typing.Iterable[str], stop_ids: typing.Iterable[str]) -> None:
+        """
+        Builds the index. Names can appear multiple times, a lookup gives the first stop ID with the name.
+
+        Args:
+            names (Iterable[str]): Name per stop.
+            stop_ids (Iterable[str]): Stop ID per stop.
+        """
+        self._exact: typing.Dict[str, int] = dict()
+        self.names: typing.List[str] = []
+        self.stop_ids: typing.List[str] = []
+        for name, stop_id in zip(names, stop_ids):
+            # missing names are NaN in data frames
+            if isinstance(name, str) and name not in self._exact:
+                self._exact[name] = len(self.names)
+                self.names.append(name)
+                self.stop_ids.append(stop_id)
+        self.normalized_names = [normalize_name(name) for name in self.names]
+        self._normalized: typing.Dict[str, int] = dict()
+        for name_id, normalized_name in enumerate(self.normalized_names):
+            self._normalized.setdefault(normalized_name, name_id)
+        self._prefix_order = sorted(range(len(self.names)), key=self.normalized_names.__getitem__)
+        self._sorted_names = [self.normalized_names[name_id] for name_id in self._prefix_order]
+
+        postings: typing.Dict[str, typing.List[int]] = dict()
+        self._num_trigrams = np.zeros(len(self.names), dtype=np.int32)
+        for name_id, normalized_name in enumerate(self.normalized_names):
+            trigrams = get_trigrams(normalized_name)
+            self._num_trigrams[name_id] = len(trigrams)
+            for trigram in trigrams:
+                postings.setdefault(trigram, []).append(name_id)
+        self._postings = {trigram: np.array(name_ids, dtype=np.int32) for trigram, name_ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _get_prefix_matches(self, normalized_query: str) -> typing.List[int]:
+        first = bisect.bisect_left(self._sorted_names, normalized_query)
+        last = min(first + NUM_PREFIX, len(self._sorted_names))
+        return [self._prefix_order[i] for i in range(first, last) if self._sorted_names[i].startswith(normalized_query)]
+
+    def _get_similar(self, normalized_query: str) -> typing.List[int]:
+        trigrams = get_trigrams(normalized_query)
+        postings = sorted((self._postings[trigram] for trigram in trigrams if trigram in self._postings), key=len)
+        if len(postings) == 0:
+            return []
+        num_postings = 1
+        while num_postings < len(postings) and \
+                sum(map(len, postings[:num_postings + 1])) <= MAX_CANDIDATE_POSTINGS:
+            num_postings += 1
+        name_ids, shared = np.unique(np.concatenate(postings[:num_postings]), return_counts=True)
+        # Dice coefficient of the trigram sets
+        score = 2 * shared / (len(trigrams) + self._num_trigrams[name_ids])
+        if len(name_ids) > NUM_RANKED:
+            best = np.argpartition(-score, NUM_RANKED)[:NUM_RANKED]
+            name_ids = name_ids[best]
+        return name_ids.tolist()
+
+    def search(self, query: str, k: int = 5, cutoff: float = 0.5) -> typing.List[typing.Tuple[str, str, float]]:
+        """
+        Returns the stations with the name most similar to the query.
+
+        Args:
+            query (str): Station name to find.
+            k (int): Maximum number of results.
+            cutoff (float): Minimum similarity (see `difflib.SequenceMatcher.ratio`) of the results.
+
+        Returns:
+            list: (stop_id, name, similarity) sorted by similarity, an exact match of the name comes first.
+        """
+        exact = self._exact.get(query)
+        if exact is not None and k == 1:
+            return [(self.stop_ids[exact], query, 1.0)]
+        normalized_query = normalize_name(query)
+        candidates = set(self._get_prefix_matches(normalized_query)) if normalized_query != "" else set()
+        candidates.update(self._get_similar(normalized_query))
+        if normalized_query in self._normalized:
+            candidates.add(self._normalized[normalized_query])
+        if exact is not None:
+            candidates.add(exact)
+
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(normalized_query)
+        ranked = []
+        for name_id in candidates:
+            matcher.set_seq1(self.normalized_names[name_id])
+            # the cheap upper bounds first, as in `difflib.get_close_matches`
+            if name_id != exact and (matcher.real_quick_ratio() < cutoff or matcher.quick_ratio() < cutoff):
+                continue
+            similarity = matcher.ratio()
+            if similarity >= cutoff or name_id == exact:
+                ranked.append((name_id != exact, -similarity, self.names[name_id], name_id))
+        ranked.sort()
+        return [(self.stop_ids[name_id], self.names[name_id], -similarity)
+                for _, similarity, _, name_id in ranked[:k]]
+
+    def find(self, query: str, cutoff: float = 0.5) -> Optional[str]:
+        """
+        Returns the stop ID of the station with the name most similar to the query, None if none is similar enough.
+        """
+        results = self.search(query, k=1, cutoff=cutoff)
+        return results[0][0] if len(results) > 0 else None
+
+
+# name indexes of data frames, keyed by the id of the data frame (data frames cannot be hashed)
+_indexes: typing.Dict[int, typing.Tuple[weakref.ref, int, NameIndex]] = dict()
+
+
+def register_name_index(df: pd.DataFrame, index: NameIndex) -> None:
+    """
+    Makes `get_name_index` use the given (e.g. persisted) index for the data frame.
+    """
+    key = id(df)
+
+    def remove(ref):
+        # the id may already be reused by a newer data frame
+        if key in _indexes and _indexes[key][0] is ref:
+            del _indexes[key]
+
+    _indexes[key] = (weakref.ref(df, remove), len(df), index)
+
+
+def get_name_index(df: pd.DataFrame) -> NameIndex:
+    """
+    Returns the name index of a data frame with stations (indexed by stop ID, with a Name column),
+    built on first use and kept as long as the data frame exists.
+    """
+    entry = _indexes.get(id(df))
+    # the length check catches data frames that were changed after the index was built
+    if entry is None or entry[0]() is not df or entry[1] != len(df):
+        register_name_index(df, NameIndex(df["Name"].tolist(), df.index.tolist()))
+        entry = _indexes[id(df)]
+    return entry[2]
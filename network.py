@@ -1,57 +1,811 @@
 from __future__ import annotations
 
+import datetime
 import typing
 from typing import Optional
+import dataclasses
 from dataclasses import dataclass
+import os
 import shelve
+from bisect import bisect_left, insort
+from collections import OrderedDict
 from heapq import heappush, heappop
+from time import perf_counter
 
+import numpy as np
 from typing_extensions import TypeAlias
+
+from instrumentation import Instrumentation
 from utils import midnight
 
 
-# a dataclass to define the information of a single connection
+# service days of a connection that runs every day (e.g. in networks built without calendar)
+ALL_DAYS = -1
+
+
+def with_slots(cls: type) -> type:
+    """
+    Recreates a dataclass with `__slots__` for its fields, as `dataclass(slots=True)` needs Python 3.10.
+    Frozen instances are pickled as the list of their field values.
+    """
+    names = tuple(field.name for field in dataclasses.fields(cls))
+    namespace = {key: value for key, value in cls.__dict__.items()
+                 if key not in names and key not in ("__dict__", "__weakref__")}
+    namespace["__slots__"] = names
+
+    def getstate(self) -> typing.List[typing.Any]:
+        return [getattr(self, name) for name in names]
+
+    def setstate(self, state: typing.List[typing.Any]) -> None:
+        for name, value in zip(names, state):
+            object.__setattr__(self, name, value)
+
+    namespace.setdefault("__getstate__", getstate)
+    namespace.setdefault("__setstate__", setstate)
+    slotted = type(cls)(cls.__name__, cls.__bases__, namespace)
+    slotted.__qualname__ = cls.__qualname__
+    return slotted
+
+
+# a dataclass to define the information of a single connection, with slots as networks hold millions of them
+@with_slots
 @dataclass(order=True, frozen=True)
 class Connection:
     departure: int
     arrival: int
-    line: str
-    transport_type: str
+    line: int  # index into `Network.lines`
+    transport_type: int  # index into `Network.transport_types`
+    # bitmask of the days the connection runs on, bit i is the i-th day after the calendar start of the network
+    service_days: int = ALL_DAYS
+
+    def __setstate__(self, state) -> None:
+        # connections pickled into shelve files before slots were used hold their fields in a dict
+        if isinstance(state, dict):
+            state = [state.get(name, ALL_DAYS) for name in ("departure", "arrival", "line", "transport_type",
+                                                            "service_days")]
+        for name, value in zip(("departure", "arrival", "line", "transport_type", "service_days"), state):
+            object.__setattr__(self, name, value)
+
+
+# a single vehicle trip along a sequence of stops, the connections between consecutive stops are part of the network
+# as well, the trips are used by the round based search (RAPTOR)
+@with_slots
+@dataclass(frozen=True)
+class Trip:
+    stops: typing.Tuple[int, ...]  # stop indices
+    # minutes since midnight, increasing along the trip (times after midnight are > 24 * 60)
+    arrivals: typing.Tuple[int, ...]
+    departures: typing.Tuple[int, ...]
+    line: int
+    transport_type: int
+    service_days: int = ALL_DAYS
+
+    def get_part(self, first: int, last: int) -> Trip:
+        """
+        Returns the part of the trip from stop position first up to (excluding) last.
+        """
+        return Trip(self.stops[first:last], self.arrivals[first:last], self.departures[first:last], self.line,
+                    self.transport_type, self.service_days)
+
+
+class StringTable(typing.Sequence[str]):
+    """
+    Interns strings (stop IDs, line names, transport types) into dense integer codes.
+    """
+
+    def __init__(self, strings: typing.Iterable[str] = ()) -> None:
+        self._strings: typing.List[str] = []
+        self._codes: typing.Dict[str, int] = {}
+        for string in strings:
+            self.intern(string)
+
+    def intern(self, string: str) -> int:
+        """
+        Returns the code of the given string, adding it to the table if it is new.
+        """
+        code = self._codes.get(string)
+        if code is None:
+            code = len(self._strings)
+            self._codes[string] = code
+            self._strings.append(string)
+        return code
+
+    def find(self, string: str) -> int:
+        """
+        Returns the code of the given string or -1 if it is not part of the table.
+        """
+        return self._codes.get(string, -1)
+
+    def __getitem__(self, code: int) -> str:
+        return self._strings[code]
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def __contains__(self, string: object) -> bool:
+        return string in self._codes
+
+
+class StopIndex(typing.Mapping[str, int]):
+    """
+    Stop id → stop index lookup on top of a stop table (`StringTable` or a compiled `StopIds`).
+    """
+
+    def __init__(self, stop_ids) -> None:
+        self._stop_ids = stop_ids
+
+    def __getitem__(self, stop_id: str) -> int:
+        idx = self._stop_ids.find(stop_id)
+        if idx < 0:
+            raise KeyError(stop_id)
+        return idx
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self._stop_ids)
+
+    def __len__(self) -> int:
+        return len(self._stop_ids)
+
+
+def runs_on(service_days: int, day: int) -> bool:
+    """
+    Checks if a connection with the given service days runs on the given day.
+
+    Args:
+        service_days (int): Bitmask of service days.
+        day (int): Day offset from the calendar start of the network.
+
+    Returns:
+        bool: True if the connection runs on this day.
+    """
+    return service_days == ALL_DAYS or (day >= 0 and (service_days >> day) & 1 == 1)
+
+
+def pack_service_days(service_days: typing.Iterable[int]) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Interns the service days of many connections into a table of distinct calendars.
+
+    Args:
+        service_days (Iterable[int]): Bitmask of service days per connection.
+
+    Returns:
+        tuple: calendar index per connection (-1 for ALL_DAYS) and the calendars, one row of bits per calendar
+        (little bit order, as used by `np.packbits`).
+    """
+    calendars = {}
+    codes = np.array([-1 if days == ALL_DAYS else calendars.setdefault(days, len(calendars))
+                      for days in service_days], dtype=np.int32)
+    num_bytes = max([(days.bit_length() + 7) // 8 for days in calendars] + [1])
+    packed = np.zeros((len(calendars), num_bytes), dtype=np.uint8)
+    for days, code in calendars.items():
+        packed[code] = np.frombuffer(days.to_bytes(num_bytes, "little"), dtype=np.uint8)
+    return codes, packed
+
+
+def active_calendars(calendars: np.ndarray, day: int) -> np.ndarray:
+    """
+    Checks which of the calendars packed by `pack_service_days` include the given day.
+
+    Args:
+        calendars (np.ndarray): Packed calendars.
+        day (int): Day offset from the calendar start of the network.
+
+    Returns:
+        np.ndarray: One bool per calendar and a final True for the calendar index -1 (ALL_DAYS).
+    """
+    if 0 <= day < calendars.shape[1] * 8:
+        active = (calendars[:, day >> 3] >> (day & 7)) & 1 == 1
+    else:
+        active = np.zeros(len(calendars), dtype=bool)
+    return np.append(active, True)
 
 
 # type aliases for ease of readability of the type annotations
 Timetable: TypeAlias = typing.List[Connection]
 ConnectionsDict: TypeAlias = typing.Dict[str, Timetable]
+# connections of a stop as stored in the network, keyed by the stop index of the connected stop
+StopConnections: TypeAlias = typing.Dict[int, Timetable]
 ReachableMap: TypeAlias = typing.Dict[str, typing.Tuple[int, str]]
+# stop_id → Pareto set of (departure at start, arrival), sorted by departure
+ProfileMap: TypeAlias = typing.Dict[str, typing.List[typing.Tuple[int, int]]]
+# stop_id → Pareto set of (transfers, arrival, stop_id where the last vehicle was boarded, line of the last vehicle),
+# sorted by transfers
+ParetoMap: TypeAlias = typing.Dict[str, typing.List[typing.Tuple[int, int, str, str]]]
+
+
+# index over a timetable sorted by departure, to find the next departure by binary search
+@dataclass(frozen=True)
+class DepartureIndex:
+    departures: typing.List[int]
+    # earliest arrival (day wrap around applied) when taking the connection at this position or any later one,
+    # as a later connection may run faster
+    earliest_arrivals: typing.List[int]
+
+    @staticmethod
+    def from_timetable(timetable: Timetable) -> DepartureIndex:
+        """
+        Builds the index of a timetable.
+
+        Args:
+            timetable (Timetable): Connections sorted by departure.
+
+        Returns:
+            DepartureIndex: The index.
+        """
+        departures = [connection.departure for connection in timetable]
+        earliest_arrivals = [0] * len(timetable)
+        earliest_arrival = None
+        for idx in range(len(timetable) - 1, -1, -1):
+            arrival = timetable[idx].arrival
+            # day wrap around (e.g. a night train)
+            if arrival < departures[idx]:
+                arrival = arrival + midnight  # +1 Day
+            if earliest_arrival is None or arrival < earliest_arrival:
+                earliest_arrival = arrival
+            earliest_arrivals[idx] = earliest_arrival
+        return DepartureIndex(departures, earliest_arrivals)
+
+    def next_departure(self, time: int) -> int:
+        """
+        Returns the position of the first departure at or after the given time,
+        or the length of the timetable if there is none.
+        """
+        return bisect_left(self.departures, time)
+
+
+# mean radius of the earth in meters
+EARTH_RADIUS = 6371000.0
+
+
+def get_stop_positions(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """
+    Converts coordinates into positions in space, whose straight-line (chord) distances are lower bounds of the
+    distances on the surface of the earth.
+
+    Args:
+        latitude (np.ndarray): Latitude per stop in degrees, NaN if unknown.
+        longitude (np.ndarray): Longitude per stop in degrees, NaN if unknown.
+
+    Returns:
+        np.ndarray: (x, y, z) in meters per stop, NaN for stops without coordinates.
+    """
+    latitude = np.radians(np.asarray(latitude, dtype=np.float64))
+    longitude = np.radians(np.asarray(longitude, dtype=np.float64))
+    return EARTH_RADIUS * np.stack([np.cos(latitude) * np.cos(longitude), np.cos(latitude) * np.sin(longitude),
+                                    np.sin(latitude)], axis=1)
+
+
+# lower bounds of the travel time between stops for the goal-directed search (A*): the straight-line distance
+# divided by the fastest speed of any connection of the network
+@dataclass
+class LowerBoundTable:
+    positions: np.ndarray  # per stop index, see `get_stop_positions`
+    max_speed: float  # meters per minute
+
+    @staticmethod
+    def from_connections(positions: np.ndarray, stop_from: np.ndarray, stop_to: np.ndarray, departure: np.ndarray,
+                         arrival: np.ndarray) -> Optional[LowerBoundTable]:
+        """
+        Determines the fastest speed of the connections.
+
+        Args:
+            positions (np.ndarray): Position per stop index, see `get_stop_positions`.
+            stop_from (np.ndarray): Stop index the connections depart from.
+            stop_to (np.ndarray): Stop index the connections arrive at.
+            departure (np.ndarray): Departure per connection.
+            arrival (np.ndarray): Arrival per connection, day wrap around already applied.
+
+        Returns:
+            Optional[LowerBoundTable]: The table, None if no connection has coordinates at both ends.
+        """
+        distance = np.linalg.norm(positions[stop_from] - positions[stop_to], axis=1)
+        # the times are full minutes, connections within the same minute are counted as one minute
+        speed = distance / np.maximum(np.asarray(arrival) - np.asarray(departure), 1)
+        if not np.isfinite(speed).any():
+            return None
+        return LowerBoundTable(positions, float(np.nanmax(speed)))
+
+    def get_lower_bounds(self, target: int) -> typing.List[int]:
+        """
+        Returns for every stop index a lower bound of the minutes needed to travel to the target,
+        0 for stops without coordinates.
+        """
+        distance = np.linalg.norm(self.positions - self.positions[target], axis=1)
+        bounds = np.floor(distance / self.max_speed)
+        return np.where(np.isfinite(bounds), bounds, 0).astype(np.int64).tolist()
+
+
+# default bound of the StopCache of a network, a stop is cached once per service day it is queried for
+DEFAULT_CACHE_BYTES = 256 << 20
+
+# a stop as held by the StopCache: its connections and the departure index over them
+CachedStop: TypeAlias = typing.Tuple[StopConnections, typing.Dict[int, DepartureIndex]]
+# the StopCache is keyed by stop index and service day (None for all days)
+StopKey: TypeAlias = typing.Tuple[int, Optional[int]]
+
+
+class StopCache:
+    """
+    Least recently used cache of decoded stops, bounded by the number of entries and/or their approximate size.
+    """
+    # rough estimate of the memory used by a decoded connection (Connection object, list slot, index entries)
+    # and by an edge (dict entry, list, DepartureIndex)
+    CONNECTION_BYTES = 150
+    EDGE_BYTES = 400
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None) -> None:
+        """
+        Args:
+            max_entries (Optional[int]): Maximum number of cached stops, None for no limit.
+            max_bytes (Optional[int]): Maximum approximate size of the cached stops in bytes, None for no limit.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: typing.OrderedDict[StopKey, typing.Tuple[CachedStop, int]] = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: StopKey, load: typing.Callable[[StopKey], CachedStop]) -> CachedStop:
+        """
+        Returns the cached stop, loading it with `load` on a miss.
+
+        Args:
+            key (StopKey): The stop index and service day to query.
+            load (Callable): Decodes the stop if it is not cached.
+
+        Returns:
+            CachedStop: Connections and departure index of the stop.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+        self.misses += 1
+        stop = load(key)
+        connections = stop[0]
+        size = self.EDGE_BYTES * len(connections) + self.CONNECTION_BYTES * sum(map(len, connections.values()))
+        self._entries[key] = (stop, size)
+        self.size_bytes += size
+        # evict least recently used entries, but always keep the one just loaded
+        while len(self._entries) > 1 and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                (self.max_bytes is not None and self.size_bytes > self.max_bytes)):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+            self.evictions += 1
+        return stop
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        """
+        Returns:
+            dict: hits, misses, evictions, number of entries and approximate size in bytes.
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self._entries), "bytes": self.size_bytes}
+
+
+# all connections of the network in one flat table, sorted by departure (used by the connection scan algorithm)
+@dataclass
+class ConnectionScanTable:
+    departure: np.ndarray
+    arrival: np.ndarray  # day wrap around already applied, so arrival >= departure
+    stop_from: np.ndarray  # stop index
+    stop_to: np.ndarray  # stop index
+    calendar: np.ndarray  # index into calendars, -1 for connections running every day
+    calendars: np.ndarray  # see pack_service_days
+
+    def get_connections(self, first: int, last: int, day: Optional[int]) -> typing.Tuple[
+        typing.List[int], typing.List[int], typing.List[int], typing.List[int]]:
+        """
+        Returns departures, arrivals, stops from and stops to of the connections in the range first:last,
+        only those running on the given day if a day is given.
+        """
+        columns = (self.departure[first:last], self.arrival[first:last],
+                   self.stop_from[first:last], self.stop_to[first:last])
+        if day is not None:
+            active = active_calendars(self.calendars, day)[self.calendar[first:last]]
+            columns = tuple(column[active] for column in columns)
+        return tuple(column.tolist() for column in columns)
+
+    @staticmethod
+    def from_stops(stops: typing.Mapping[int, StopConnections]) -> ConnectionScanTable:
+        """
+        Flattens the per-stop timetables into one array of connections sorted by departure.
+
+        Args:
+            stops (Mapping): stop index → connected stop index → timetable, as in `Network.stops`.
+
+        Returns:
+            ConnectionScanTable: The flattened connections.
+        """
+        departures, arrivals, stops_from, stops_to, service_days = [], [], [], [], []
+        for from_idx, connections in stops.items():
+            for to_idx, timetable in connections.items():
+                for connection in timetable:
+                    departures.append(connection.departure)
+                    arrivals.append(connection.arrival)
+                    stops_from.append(from_idx)
+                    stops_to.append(to_idx)
+                    service_days.append(connection.service_days)
+
+        departure = np.array(departures, dtype=np.int32)
+        arrival = np.array(arrivals, dtype=np.int32)
+        # day wrap around (e.g. a night train)
+        arrival = np.where(arrival < departure, arrival + midnight, arrival).astype(np.int32)
+        # sort by departure, ties by arrival so that connections with zero travel time are scanned in order
+        order = np.lexsort((arrival, departure))
+        calendar, calendars = pack_service_days(service_days)
+        return ConnectionScanTable(departure[order], arrival[order],
+                                   np.array(stops_from, dtype=np.int32)[order],
+                                   np.array(stops_to, dtype=np.int32)[order], calendar[order], calendars)
+
+
+def trips_cover_connections(stop_from: np.ndarray, stop_to: np.ndarray, departure: np.ndarray, arrival: np.ndarray,
+                            trip_offsets: np.ndarray, trip_stops: np.ndarray, trip_arrival: np.ndarray,
+                            trip_departure: np.ndarray) -> bool:
+    """
+    Checks that every connection is the ride of a trip between two consecutive stops at the same times,
+    the round based search only knows the connections of trips.
+
+    Args:
+        stop_from (np.ndarray): Stop index the connections leave from.
+        stop_to (np.ndarray): Stop index the connections arrive at.
+        departure (np.ndarray): Departure per connection.
+        arrival (np.ndarray): Arrival per connection.
+        trip_offsets (np.ndarray): trip → range of its stops in trip_stops, trip_arrival and trip_departure.
+        trip_stops (np.ndarray): Stop indices of the trips.
+        trip_arrival (np.ndarray): Arrival at each stop of the trips.
+        trip_departure (np.ndarray): Departure at each stop of the trips.
+
+    Returns:
+        bool: True if the trips cover all connections.
+    """
+    if len(stop_from) == 0:
+        return True
+    if len(trip_stops) == 0:
+        return False
+    # rides to the next stop of the same trip, times are compared within the day
+    ride = np.ones(len(trip_stops) - 1, dtype=bool)
+    ride[trip_offsets[1:-1] - 1] = False
+    rides = np.flatnonzero(ride)
+    keys = np.concatenate([
+        np.stack([trip_stops[rides], trip_stops[rides + 1], trip_departure[rides] % midnight,
+                  trip_arrival[rides + 1] % midnight], axis=1).astype(np.int64),
+        np.stack([stop_from, stop_to, departure % midnight, arrival % midnight], axis=1).astype(np.int64)])
+    _, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    return bool(np.isin(inverse[len(rides):], inverse[:len(rides)]).all())
+
+
+@with_slots
+@dataclass(frozen=True)
+class RaptorRoute:
+    """
+    The stop times of a route of `RaptorTable` as lists, which are faster to scan than the arrays.
+    """
+    line: int
+    stops: typing.List[int]
+    # per trip, sorted by departure
+    arrivals: typing.List[typing.List[int]]
+    departures: typing.List[typing.List[int]]
+    calendars: typing.List[int]
+    # per stop of the route, the departures of the trips there
+    stop_departures: typing.List[typing.List[int]]
+
+
+# the trips of the network grouped into routes (trips of the same line along the same stops, which do not overtake
+# each other), as used by the round based search (RAPTOR), see https://doi.org/10.1287/trsc.2014.0534
+@dataclass
+class RaptorTable:
+    route_line: np.ndarray  # per route, line code
+    route_stop_offsets: np.ndarray  # route → range of its stops in route_stops
+    route_stops: np.ndarray  # stop indices of the routes in order of travel
+    route_trip_offsets: np.ndarray  # route → range of its trips in trip_calendar, sorted by departure
+    route_time_offsets: np.ndarray  # route → start of its stop times in arrival / departure
+    # stop times of the trips, for each route trip after trip with one entry per stop of the route
+    arrival: np.ndarray
+    departure: np.ndarray
+    trip_calendar: np.ndarray  # index into calendars, -1 for trips running every day
+    calendars: np.ndarray  # see pack_service_days
+    stop_route_offsets: np.ndarray  # stop index → range of the routes serving it in stop_routes
+    stop_routes: np.ndarray  # route serving the stop
+    stop_route_positions: np.ndarray  # position of the stop in that route
+
+    def __post_init__(self) -> None:
+        # decoded on first use, see `get_route` and `get_stop_routes`
+        self._routes: typing.Dict[int, RaptorRoute] = {}
+        self._stop_routes: typing.Dict[int, typing.List[typing.Tuple[int, int]]] = {}
+
+    def get_route(self, route: int) -> RaptorRoute:
+        """
+        Returns the stop times of a route, decoded once.
+        """
+        decoded = self._routes.get(route)
+        if decoded is None:
+            stops = self.route_stops[self.route_stop_offsets[route]:self.route_stop_offsets[route + 1]].tolist()
+            first, last = int(self.route_trip_offsets[route]), int(self.route_trip_offsets[route + 1])
+            begin = int(self.route_time_offsets[route])
+            end = begin + (last - first) * len(stops)
+            arrival = np.asarray(self.arrival[begin:end]).reshape(-1, len(stops))
+            departure = np.asarray(self.departure[begin:end]).reshape(-1, len(stops))
+            decoded = RaptorRoute(int(self.route_line[route]), stops, arrival.tolist(), departure.tolist(),
+                                  self.trip_calendar[first:last].tolist(), departure.T.tolist())
+            self._routes[route] = decoded
+        return decoded
+
+    def get_stop_routes(self, stop: int) -> typing.List[typing.Tuple[int, int]]:
+        """
+        Returns the routes serving a stop with the position of the stop in the route, decoded once.
+        """
+        routes = self._stop_routes.get(stop)
+        if routes is None:
+            first, last = int(self.stop_route_offsets[stop]), int(self.stop_route_offsets[stop + 1])
+            routes = list(zip(self.stop_routes[first:last].tolist(), self.stop_route_positions[first:last].tolist()))
+            self._stop_routes[stop] = routes
+        return routes
+
+    @staticmethod
+    def from_trips(num_stops: int, trip_offsets: np.ndarray, trip_stops: np.ndarray, trip_arrival: np.ndarray,
+                   trip_departure: np.ndarray, trip_line: np.ndarray, trip_calendar: np.ndarray,
+                   calendars: np.ndarray) -> RaptorTable:
+        """
+        Groups trips into routes.
+
+        Args:
+            num_stops (int): Number of stop indices.
+            trip_offsets (np.ndarray): trip → range of its stops in trip_stops, trip_arrival and trip_departure.
+            trip_stops (np.ndarray): Stop indices of the trips.
+            trip_arrival (np.ndarray): Arrival at each stop of the trips.
+            trip_departure (np.ndarray): Departure at each stop of the trips.
+            trip_line (np.ndarray): Line code per trip.
+            trip_calendar (np.ndarray): Calendar index per trip.
+            calendars (np.ndarray): The calendars, see `pack_service_days`.
+
+        Returns:
+            RaptorTable: The routes.
+        """
+        patterns = {}
+        for trip in range(len(trip_offsets) - 1):
+            stops = trip_stops[trip_offsets[trip]:trip_offsets[trip + 1]]
+            patterns.setdefault((int(trip_line[trip]), stops.tobytes()), []).append(trip)
+
+        route_line, route_stops, route_trips, arrivals, departures = [], [], [], [], []
+        for (line, _), trips in patterns.items():
+            offsets = [int(trip_offsets[trip]) for trip in trips]
+            num_route_stops = int(trip_offsets[trips[0] + 1]) - offsets[0]
+            arrival = np.stack([trip_arrival[offset:offset + num_route_stops] for offset in offsets])
+            departure = np.stack([trip_departure[offset:offset + num_route_stops] for offset in offsets])
+            # sort by the departure at the first stop, then split into routes where no trip overtakes another one,
+            # so that the departures at every stop are sorted along the trips of a route
+            routes = []
+            for idx in np.lexsort(departure.T[::-1]).tolist():
+                for route in routes:
+                    last = route[-1]
+                    if (arrival[idx] >= arrival[last]).all() and (departure[idx] >= departure[last]).all():
+                        route.append(idx)
+                        break
+                else:
+                    routes.append([idx])
+            for route in routes:
+                route_line.append(line)
+                route_stops.append(trip_stops[offsets[0]:offsets[0] + num_route_stops])
+                route_trips.append([trips[idx] for idx in route])
+                arrivals.append(arrival[route].reshape(-1))
+                departures.append(departure[route].reshape(-1))
+
+        def offsets_of(parts):
+            return np.cumsum([0] + [len(part) for part in parts]).astype(np.int64)
+
+        def concat(parts, dtype):
+            return np.concatenate(parts).astype(dtype) if len(parts) > 0 else np.zeros(0, dtype=dtype)
+
+        route_stop_offsets = offsets_of(route_stops)
+        stops = concat(route_stops, np.int32)
+        # the routes serving each stop, with the position of the stop in the route
+        routes = np.repeat(np.arange(len(route_stops), dtype=np.int32), np.diff(route_stop_offsets))
+        positions = np.arange(len(stops), dtype=np.int32) - route_stop_offsets[routes].astype(np.int32)
+        order = np.argsort(stops, kind="stable")
+        return RaptorTable(np.array(route_line, dtype=np.int32), route_stop_offsets, stops,
+                           offsets_of(route_trips), offsets_of(arrivals), concat(arrivals, np.int32),
+                           concat(departures, np.int32),
+                           concat([trip_calendar[trips] for trips in route_trips], np.int32), calendars,
+                           np.searchsorted(stops[order], np.arange(num_stops + 1)).astype(np.int64),
+                           routes[order], positions[order])
+
+
+class ShelveStops(typing.Mapping[int, StopConnections]):
+    """
+    Read-only stop index → connections mapping over a network stored in the previous shelve format
+    (stop id → connected stop id → timetable with line names and transport types as strings).
+    """
+
+    def __init__(self, stops_file: str) -> None:
+        self._db = shelve.open(stops_file, flag="r")
+        self.stop_ids = StringTable(self._db.keys())
+        # filled while stops are decoded
+        self.lines = StringTable()
+        self.transport_types = StringTable()
+
+    def __getitem__(self, idx: int) -> StopConnections:
+        return {self.stop_ids.find(connected_stop): [
+            Connection(connection.departure, connection.arrival, self.lines.intern(connection.line),
+                       self.transport_types.intern(connection.transport_type), connection.service_days)
+            for connection in timetable]
+            for connected_stop, timetable in self._db[self.stop_ids[idx]].items()}
+
+    def __contains__(self, idx: object) -> bool:
+        return isinstance(idx, int) and 0 <= idx < len(self.stop_ids)
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(range(len(self.stop_ids)))
+
+    def __len__(self) -> int:
+        return len(self.stop_ids)
 
 
 class Network:
-    def __init__(self, stops_file: Optional[str]) -> None:
+    def __init__(self, stops_file: Optional[str], cache_entries: Optional[int] = None,
+                 cache_bytes: Optional[int] = DEFAULT_CACHE_BYTES) -> None:
         """
-        Initializes the Network. If `stops_file` is given, it loads the network from a shelve file.
-        Otherwise, initializes an empty network for manual building.
+        Initializes the Network. If `stops_file` is given, it loads the network from a compiled network directory
+        (see `compiled_network`) or a shelve file. Otherwise, initializes an empty network for manual building.
+
+        Stops, lines and transport types are stored as integer codes into the string tables `stop_ids`, `lines` and
+        `transport_types`, the public methods take and return stop IDs.
 
         Args:
-            stops_file (Optional[str]): Path to a shelve file or None for an empty network.
+            stops_file (Optional[str]): Path to a compiled network, a shelve file or None for an empty network.
+            cache_entries (Optional[int]): Maximum number of decoded stops to keep in memory, None for no limit.
+            cache_bytes (Optional[int]): Maximum approximate size of the decoded stops in bytes,
+                `DEFAULT_CACHE_BYTES` by default, None for no limit.
         """
+        # built on first use of the connection scan algorithm
+        self._connection_scan_table: Optional[ConnectionScanTable] = None
+        # built on first use of the round based search
+        self._raptor_table: Optional[RaptorTable] = None
+        # lower bounds for the goal-directed search, built on first use if the stop positions are known
+        self._lower_bound_table: Optional[LowerBoundTable] = None
+        # position per stop index, see `get_stop_positions`, None if the stop coordinates are not known
+        self._stop_positions: Optional[np.ndarray] = None
+        # decoded stops with their departure index, so that each stop is read from disk only once
+        self._stop_cache = StopCache(cache_entries, cache_bytes)
+        # opt-in recording of a "search" event per query, see `_run_search`
+        self.instrumentation = Instrumentation()
+        # counters of the running search, only collected while the instrumentation is enabled
+        self._search_counters: Optional[typing.Dict[str, int]] = None
+        # first day of the service days of the connections, None if the network was built without calendar
+        self.calendar_start: Optional[datetime.date] = None
+        # day used by queries without date, only needed if the network has a calendar
+        self.default_date: Optional[datetime.date] = None
         if stops_file is None:
-            self.stops = dict()  # empty network to build one
+            # empty network to build one
+            self.stops: typing.MutableMapping[int, StopConnections] = dict()
+            self.stop_ids = StringTable()
+            self.lines = StringTable()
+            self.transport_types = StringTable()
+            # the vehicle trips, None if the network holds no trips
+            self.trips: typing.Optional[typing.List[Trip]] = []
+            return
+        # the trips of a compiled network are only available as routes
+        self.trips = None
+        if os.path.isdir(stops_file):
+            # imported here, as the compiled format itself builds on this module
+            from compiled_network import CompiledStops
+            self.stops = CompiledStops(stops_file)
+            self._connection_scan_table = self.stops.csa_table
+            self._raptor_table = self.stops.raptor_table
+            self._lower_bound_table = self.stops.lower_bound_table
+            if self._lower_bound_table is not None:
+                self._stop_positions = self._lower_bound_table.positions
+            self.calendar_start = self.stops.calendar_start
+            self.default_date = self.stops.default_date
         else:
-            self.stops = shelve.open(stops_file)
+            self.stops = ShelveStops(stops_file)
+        self.stop_ids = self.stops.stop_ids
+        self.lines = self.stops.lines
+        self.transport_types = self.stops.transport_types
 
-    def get_connections(self, stop_id: str) -> ConnectionsDict:
+    def _find_stop(self, stop_id: str) -> int:
+        """
+        Returns the stop index of a stop ID, raises a KeyError for stops not in the network.
+        """
+        idx = self.stop_ids.find(stop_id)
+        if idx < 0 or idx not in self.stops:
+            raise KeyError(stop_id)
+        return idx
+
+    def _to_stop_ids(self, reachable: typing.Dict[int, typing.Tuple[int, int]]) -> ReachableMap:
+        stop_ids = self.stop_ids
+        return {stop_ids[stop]: (arrival, stop_ids[previous]) for stop, (arrival, previous) in reachable.items()}
+
+    def get_connections(self, stop_id: str, date: Optional[datetime.date] = None) -> ConnectionsDict:
         """
         Returns all connections from a given stop.
 
         Args:
             stop_id (str): The stop ID to query.
+            date (Optional[datetime.date]): Only return the connections running on this date,
+                None for the default date of the network.
+
+        Returns:
+            dict: Keys are connected stop IDs, values are lists of Connections, whose line and transport type are
+            indices into `lines` and `transport_types`.
+        """
+        connections = self._stop_cache.get((self._find_stop(stop_id), self._query_day(date)), self._load_stop)[0]
+        return {self.stop_ids[connected_stop]: timetable for connected_stop, timetable in connections.items()}
+
+    def get_departure_index(self, stop_id: str, date: Optional[datetime.date] = None) -> typing.Dict[
+        str, DepartureIndex]:
+        """
+        Returns the departure index of all connections from a given stop.
+
+        Args:
+            stop_id (str): The stop ID to query.
+            date (Optional[datetime.date]): Only index the connections running on this date,
+                None for the default date of the network.
 
         Returns:
-            dict: Keys are connected stop IDs, values are lists of (departure, arrival, line, type) tuples.
+            dict: Keys are connected stop IDs, values are the index over the respective timetable.
         """
-        return self.stops[stop_id]
+        departure_index = self._stop_cache.get((self._find_stop(stop_id), self._query_day(date)),
+                                               self._load_stop)[1]
+        return {self.stop_ids[connected_stop]: index for connected_stop, index in departure_index.items()}
 
-    def get_reachable_stations_in_time(self, start_point: str, start_time: int, time_limit: int) -> ReachableMap:
+    def get_cache_stats(self) -> typing.Dict[str, int]:
+        """
+        Returns the statistics of the cache of decoded stops.
+
+        Returns:
+            dict: hits, misses, evictions, number of entries and approximate size in bytes.
+        """
+        return self._stop_cache.stats()
+
+    def _service_day(self, date: Optional[datetime.date]) -> Optional[int]:
+        """
+        Converts a date into the day offset used by the service days of the connections,
+        None if all connections should be used.
+        """
+        if date is None or self.calendar_start is None:
+            return None
+        return (date - self.calendar_start).days
+
+    def _query_day(self, date: Optional[datetime.date]) -> Optional[int]:
+        """
+        Like `_service_day`, but queries without date use the default date of the network,
+        as the connections of all days mix weekdays, weekends and holidays.
+
+        Raises:
+            ValueError: if no date is given and the network has service days but no default date.
+        """
+        if date is None and self.calendar_start is not None:
+            if self.default_date is None:
+                raise ValueError("The network has no default date, the query needs a date")
+            date = self.default_date
+        return self._service_day(date)
+
+    def _load_stop(self, key: StopKey) -> CachedStop:
+        idx, day = key
+        connections = self.stops[idx]
+        if day is not None:
+            connections = {connected_stop: timetable for connected_stop, timetable in (
+                (connected_stop, [connection for connection in timetable if runs_on(connection.service_days, day)])
+                for connected_stop, timetable in connections.items()) if len(timetable) > 0}
+        elif hasattr(self.stops, "get_departure_index"):
+            # precomputed in the compiled network
+            return connections, self.stops.get_departure_index(idx)
+        return connections, {connected_stop: DepartureIndex.from_timetable(timetable)
+                             for connected_stop, timetable in connections.items()}
+
+    def get_reachable_stations_in_time(self, start_point: str, start_time: int, time_limit: int,
+                                       algorithm: str = "dijkstra",
+                                       date: Optional[datetime.date] = None) -> ReachableMap:
         """
         Computes all reachable stations from a start point within a given time limit.
 
@@ -59,28 +813,142 @@ class Network:
             start_point (str): Starting stop ID.
             start_time (int): Time in minutes since midnight.
             time_limit (int): Time limit in minutes.
+            algorithm (str): Search to use, one of `ALGORITHMS`.
+            date (Optional[datetime.date]): Only use connections running on this date,
+                None for the default date of the network.
 
         Returns:
             dict: stop_id → (arrival_time, previous_stop_id)
         """
-        return self._dijkstra(start_point, start_time, "", time_limit)
+        return self._to_stop_ids(self._run_search(algorithm, self._find_stop(start_point), start_time, -1, time_limit,
+                                                  self._query_day(date)))
 
-    def get_fastest_route(self, start_point: str, start_time: int, end_point: str) -> ReachableMap:
+    def get_fastest_route(self, start_point: str, start_time: int, end_point: str,
+                          algorithm: str = "dijkstra", date: Optional[datetime.date] = None) -> ReachableMap:
         """
-        Computes the fastest route from start to end using Dijkstra search.
+        Computes the fastest route from start to end.
 
         Args:
             start_point (str): Starting stop ID.
             start_time (int): Start time in minutes since midnight.
             end_point (str): Destination stop ID.
+            algorithm (str): Search to use, one of `ALGORITHMS`.
+            date (Optional[datetime.date]): Only use connections running on this date,
+                None for the default date of the network.
 
         Returns:
             dict: stop_id → (arrival_time, previous_stop_id)
+
+        Raises:
+            KeyError: if the start or the end is not in the network.
         """
         # end of search is 4 days, which should be sufficient to reach any other stop in germany
-        return self._dijkstra(start_point, start_time, end_point, 4 * 24 * 60)
+        return self._to_stop_ids(self._run_search(algorithm, self._find_stop(start_point), start_time,
+                                                  self._find_stop(end_point), 4 * 24 * 60, self._query_day(date)))
+
+    def get_arrival_profile(self, start_point: str, departure_from: int, departure_to: int,
+                            time_limit: int = 4 * 24 * 60, date: Optional[datetime.date] = None) -> ProfileMap:
+        """
+        Computes for every stop the earliest arrivals for all departures from the start point within a time window,
+        in a single pass over the connections (profile connection scan).
+
+        Args:
+            start_point (str): Starting stop ID.
+            departure_from (int): Earliest departure in minutes since midnight.
+            departure_to (int): Latest departure in minutes since midnight.
+            time_limit (int): Time limit in minutes after the latest departure.
+            date (Optional[datetime.date]): Only use connections running on this date,
+                None for the default date of the network.
+
+        Returns:
+            dict: stop_id → Pareto-optimal (departure, arrival) pairs sorted by departure, where departure is the latest
+            time to leave the start point to arrive at the stop at arrival.
+        """
+        profiles = self._connection_scan_profile(self._find_stop(start_point), departure_from, departure_to,
+                                                 time_limit, self._query_day(date))
+        return {self.stop_ids[stop]: profile for stop, profile in profiles.items()}
+
+    def get_pareto_arrivals(self, start_point: str, start_time: int, time_limit: int = 4 * 24 * 60,
+                            max_transfers: Optional[int] = None, transfer_time: int = 0,
+                            end_point: Optional[str] = None, date: Optional[datetime.date] = None) -> ParetoMap:
+        """
+        Computes for every stop the earliest arrival for each number of transfers, e.g. to answer
+        "the fastest route with at most 2 changes", with the round based search (RAPTOR).
+
+        Args:
+            start_point (str): Starting stop ID.
+            start_time (int): Start time in minutes since midnight.
+            time_limit (int): Time limit in minutes.
+            max_transfers (Optional[int]): Maximum number of transfers, None for no limit.
+            transfer_time (int): Minimum time in minutes to change between vehicles.
+            end_point (Optional[str]): If given, only the arrivals at this stop are complete, which allows to
+                stop searching early.
+            date (Optional[datetime.date]): Only use trips running on this date,
+                None for the default date of the network.
+
+        Returns:
+            dict: stop_id → Pareto-optimal (transfers, arrival, boarding stop_id, line), where fewer transfers
+            always arrive later. The route is the vehicle of the given line boarded at the boarding stop,
+            which was reached with one transfer less.
+        """
+        max_rounds = self.MAX_ROUNDS if max_transfers is None else max_transfers + 1
+        end = -1 if end_point is None else self._find_stop(end_point)
+        rounds, _ = self._raptor_rounds(self._find_stop(start_point), start_time, end, time_limit, max_rounds,
+                                        transfer_time, self._query_day(date))
+        stop_ids = self.stop_ids
+        pareto = {}
+        for num_trips, labels in enumerate(rounds[1:], start=1):
+            for stop, (arrival, boarding_stop, line) in labels.items():
+                pareto.setdefault(stop_ids[stop], []).append(
+                    (num_trips - 1, arrival, stop_ids[boarding_stop], self.lines[line]))
+        return pareto
 
-    def _dijkstra(self, start_point: str, start_time: int, end_point: str, time_limit: int) -> ReachableMap:
+    # names of the available search algorithms
+    ALGORITHMS = ("dijkstra", "csa", "raptor", "astar")
+    # the round based search stops after this number of vehicles at the latest
+    MAX_ROUNDS = 32
+
+    def _search(self, algorithm: str) -> typing.Callable[
+        [int, int, int, int, Optional[int]], typing.Dict[int, typing.Tuple[int, int]]]:
+        if algorithm == "dijkstra":
+            return self._dijkstra
+        if algorithm == "csa":
+            return self._connection_scan
+        if algorithm == "raptor":
+            return self._raptor
+        if algorithm == "astar":
+            return self._astar
+        raise ValueError(f"Unknown algorithm {algorithm}, expected one of {self.ALGORITHMS}")
+
+    def _run_search(self, algorithm: str, start_point: int, start_time: int, end_point: int, time_limit: int,
+                    day: Optional[int]) -> typing.Dict[int, typing.Tuple[int, int]]:
+        """
+        Runs a search, recording a "search" event if the instrumentation is enabled: wall time, reachable stops,
+        stops read from disk and the counters of the priority queue searches
+        (stops settled, edges relaxed, stale heap pops, peak heap size).
+        """
+        search = self._search(algorithm)
+        if not self.instrumentation.enabled:
+            return search(start_point, start_time, end_point, time_limit, day)
+        self._search_counters = dict()
+        misses = self._stop_cache.misses
+        start = perf_counter()
+        try:
+            reachable = search(start_point, start_time, end_point, time_limit, day)
+        finally:
+            counters, self._search_counters = self._search_counters, None
+        self.instrumentation.record("search", algorithm=algorithm, start_point=self.stop_ids[start_point],
+                                    start_time=start_time,
+                                    end_point=None if end_point < 0 else self.stop_ids[end_point],
+                                    time_limit=time_limit, day=day, seconds=perf_counter() - start,
+                                    reachable=len(reachable), stop_reads=self._stop_cache.misses - misses, **counters)
+        return reachable
+
+    # the searches work on stop indices: start and end point are stop indices (end point -1 for none),
+    # the result maps stop index → (arrival_time, previous stop index)
+
+    def _dijkstra(self, start_point: int, start_time: int, end_point: int, time_limit: int,
+                  day: Optional[int] = None) -> typing.Dict[int, typing.Tuple[int, int]]:
         """
         Dijkstra’s algorithm to compute the shortest paths
         see https://en.wikipedia.org/wiki/Dijkstra%27s_algorithm
@@ -92,39 +960,31 @@ class Network:
         to_visit = []
         heappush(to_visit, (start_time, start_point))  # first node to visit
         visited = set()
+        # counters for the instrumentation, cheap enough to always count
+        stale_heap_pops = edges_relaxed = peak_heap_size = 0
         while len(to_visit) > 0:
+            if len(to_visit) > peak_heap_size:
+                peak_heap_size = len(to_visit)
             cur_time, visiting = heappop(to_visit)
             if visiting == end_point:
                 break  # terminate search: found the endpoint
             if visiting in visited:
                 # already visited
+                stale_heap_pops += 1
                 continue
                 # this implementation keeps multiple instances of this node in the priority queue.
                 # This way don't actually need to update the priorities, but just insert a new instance with different priority
                 # python does not offer an update priority implementation
             visited.add(visiting)
-            for stop_id, timetable in self.stops[visiting].items():
-                timetable.sort()  # sort by departure
-                idx = 0
-                while idx < len(timetable) and timetable[idx].departure < cur_time:
-                    idx += 1
+            edges = self._stop_cache.get((visiting, day), self._load_stop)[1]
+            edges_relaxed += len(edges)
+            for stop_id, departure_index in edges.items():
+                departures = departure_index.departures
+                idx = departure_index.next_departure(cur_time)
                 # found the next departure, check if it is still in bounds
-                if idx < len(timetable) and timetable[idx].departure < end_time:
-                    earliest_arrival = timetable[idx].arrival
-                    cur_dep_time = timetable[idx].departure
-                    # day wrap around (e.g. a night train)
-                    if earliest_arrival < cur_dep_time:
-                        earliest_arrival = earliest_arrival + midnight  # +1 Day
-                    idx += 1
-                    while cur_dep_time < earliest_arrival and idx < len(timetable):
-                        assert timetable[idx].departure >= cur_dep_time
-                        # is there a later connection that runs faster (unlikely but possible)
-                        cur_dep_time = timetable[idx].departure
-                        arrival2 = timetable[idx].arrival
-                        if arrival2 < cur_dep_time:
-                            arrival2 = arrival2 + midnight  # +1 Day
-                        earliest_arrival = min(earliest_arrival, arrival2)
-                        idx += 1
+                if idx < len(departures) and departures[idx] < end_time:
+                    # includes later connections that run faster (unlikely but possible)
+                    earliest_arrival = departure_index.earliest_arrivals[idx]
                     # found the earliest arrival
                     if earliest_arrival <= end_time:
                         if stop_id not in reachable_stations:
@@ -140,8 +1000,327 @@ class Network:
                 else:
                     pass
                     # no further connection today
+        if self._search_counters is not None:
+            self._search_counters.update(stops_settled=len(visited), edges_relaxed=edges_relaxed,
+                                         stale_heap_pops=stale_heap_pops,
+                                         peak_heap_size=max(peak_heap_size, len(to_visit)))
+        return reachable_stations
+
+    def set_stop_coordinates(self, coordinates: typing.Mapping[str, typing.Tuple[float, float]]) -> None:
+        """
+        Sets the coordinates of the stops, needed for the goal-directed search (A*) in networks not read from
+        a compiled network (which stores the coordinates given when building it).
+
+        Args:
+            coordinates (Mapping): stop_id → (latitude, longitude), stops without coordinates may be missing.
+        """
+        latitude = np.full(len(self.stop_ids), np.nan)
+        longitude = np.full(len(self.stop_ids), np.nan)
+        for idx, stop_id in enumerate(self.stop_ids):
+            if stop_id in coordinates:
+                latitude[idx], longitude[idx] = coordinates[stop_id]
+        self._stop_positions = get_stop_positions(latitude, longitude)
+        self._lower_bound_table = None
+
+    def _get_lower_bound_table(self) -> Optional[LowerBoundTable]:
+        if self._lower_bound_table is None and self._stop_positions is not None:
+            # stops added after the coordinates were set have no position
+            positions = np.full((len(self.stop_ids), 3), np.nan)
+            positions[:len(self._stop_positions)] = self._stop_positions
+            table = self._get_connection_scan_table()
+            self._lower_bound_table = LowerBoundTable.from_connections(
+                positions, table.stop_from, table.stop_to, table.departure, table.arrival)
+        return self._lower_bound_table
+
+    def _astar(self, start_point: int, start_time: int, end_point: int, time_limit: int,
+               day: Optional[int] = None) -> typing.Dict[int, typing.Tuple[int, int]]:
+        """
+        Goal-directed variant of `_dijkstra` (A*), see https://en.wikipedia.org/wiki/A*_search_algorithm
+        Stops are visited in the order of their arrival plus a lower bound of the remaining travel time
+        (straight-line distance to the end point divided by the fastest speed in the network),
+        so stops in the direction of the end point are visited first.
+        The bound counts connections within the same minute as one minute, so a route using such connections
+        over long distances could be found slightly later than the fastest one.
+        Without end point or stop coordinates this is the same as `_dijkstra`.
+        """
+        lower_bound_table = self._get_lower_bound_table() if end_point >= 0 else None
+        if lower_bound_table is None:
+            return self._dijkstra(start_point, start_time, end_point, time_limit, day)
+        lower_bounds = lower_bound_table.get_lower_bounds(end_point)
+        end_time = start_time + time_limit
+        # (arrival time, from node)
+        reachable_stations = {start_point: (start_time, start_point)}
+        # (arrival time + lower bound, arrival time, node)
+        to_visit = [(start_time + lower_bounds[start_point], start_time, start_point)]
+        # counters for the instrumentation, see `_dijkstra`
+        stops_settled = stale_heap_pops = edges_relaxed = peak_heap_size = 0
+        while len(to_visit) > 0:
+            if len(to_visit) > peak_heap_size:
+                peak_heap_size = len(to_visit)
+            _, cur_time, visiting = heappop(to_visit)
+            if visiting == end_point:
+                break  # terminate search: found the endpoint
+            if cur_time > reachable_stations[visiting][0]:
+                stale_heap_pops += 1
+                continue  # an earlier arrival at this node was found in the meantime
+            stops_settled += 1
+            edges = self._stop_cache.get((visiting, day), self._load_stop)[1]
+            edges_relaxed += len(edges)
+            for stop_id, departure_index in edges.items():
+                departures = departure_index.departures
+                idx = departure_index.next_departure(cur_time)
+                if idx < len(departures) and departures[idx] < end_time:
+                    earliest_arrival = departure_index.earliest_arrivals[idx]
+                    if earliest_arrival <= end_time and earliest_arrival < reachable_stations.get(
+                            stop_id, (end_time + 1,))[0]:
+                        reachable_stations[stop_id] = (earliest_arrival, visiting)
+                        heappush(to_visit, (earliest_arrival + lower_bounds[stop_id], earliest_arrival, stop_id))
+        if self._search_counters is not None:
+            self._search_counters.update(stops_settled=stops_settled, edges_relaxed=edges_relaxed,
+                                         stale_heap_pops=stale_heap_pops,
+                                         peak_heap_size=max(peak_heap_size, len(to_visit)))
         return reachable_stations
 
+    def _get_connection_scan_table(self) -> ConnectionScanTable:
+        if self._connection_scan_table is None:
+            self._connection_scan_table = ConnectionScanTable.from_stops(self.stops)
+        return self._connection_scan_table
+
+    def _connection_scan(self, start_point: int, start_time: int, end_point: int, time_limit: int,
+                         day: Optional[int] = None) -> typing.Dict[int, typing.Tuple[int, int]]:
+        """
+        Connection Scan Algorithm to compute the earliest arrival at every stop
+        see https://arxiv.org/abs/1703.05997
+        Gives the same arrival times as `_dijkstra`, but scans one flat array of connections instead of a priority queue.
+        """
+        table = self._get_connection_scan_table()
+        end_time = start_time + time_limit
+        start_idx = start_point
+        end_idx = end_point
+
+        # only the connections departing within the time window are relevant
+        first = np.searchsorted(table.departure, start_time, side="left")
+        last = np.searchsorted(table.departure, end_time, side="left")
+
+        departures, arrivals, stops_from, stops_to = table.get_connections(first, last, day)
+
+        # stop index → earliest arrival, stop index → previous stop index
+        earliest = {start_idx: start_time}
+        previous = {start_idx: start_idx}
+        end_arrival = end_time + 1
+        block_start = 0  # first connection with the current departure time
+        rescan_block = False
+        idx = 0
+        while idx < len(departures) or rescan_block:
+            if idx == len(departures) or departures[idx] != departures[block_start]:
+                if rescan_block:
+                    # a connection without travel time reached a stop,
+                    # connections of the same minute leaving from there may have been scanned before
+                    rescan_block = False
+                    idx = block_start
+                    continue
+                block_start = idx
+            departure = departures[idx]
+            if departure >= end_arrival:
+                break  # terminate search: no later connection can reach the endpoint earlier
+            arrival = arrivals[idx]
+            stop_from = stops_from[idx]
+            stop_to = stops_to[idx]
+            idx += 1
+            if arrival > end_time:
+                continue
+            reached_at = earliest.get(stop_from)
+            if reached_at is None or reached_at > departure:
+                continue  # cannot catch this connection
+            if arrival < earliest.get(stop_to, end_time + 1):
+                earliest[stop_to] = arrival
+                previous[stop_to] = stop_from
+                rescan_block = rescan_block or arrival == departure
+                if stop_to == end_idx:
+                    end_arrival = arrival
+
+        return {stop: (arrival, previous[stop]) for stop, arrival in earliest.items()}
+
+    def _connection_scan_profile(self, start_point: int, departure_from: int, departure_to: int,
+                                 time_limit: int, day: Optional[int] = None) -> typing.Dict[
+        int, typing.List[typing.Tuple[int, int]]]:
+        """
+        Forward profile variant of the Connection Scan Algorithm
+        see https://arxiv.org/abs/1703.05997
+        Every stop keeps a Pareto set of (departure at start, arrival) labels, sorted by arrival,
+        which makes the departures sorted as well.
+        """
+        table = self._get_connection_scan_table()
+        end_time = departure_to + time_limit
+        start_idx = start_point
+
+        first = np.searchsorted(table.departure, departure_from, side="left")
+        last = np.searchsorted(table.departure, end_time, side="left")
+        departures, arrivals, stops_from, stops_to = table.get_connections(first, last, day)
+
+        # stop index → (arrivals, departures at start) of the Pareto set
+        profiles: typing.Dict[int, typing.Tuple[typing.List[int], typing.List[int]]] = {}
+        block_start = 0  # first connection with the current departure time
+        rescan_block = False
+        idx = 0
+        while idx < len(departures) or rescan_block:
+            if idx == len(departures) or departures[idx] != departures[block_start]:
+                if rescan_block:
+                    # a connection without travel time reached a stop,
+                    # connections of the same minute leaving from there may have been scanned before
+                    rescan_block = False
+                    idx = block_start
+                    continue
+                block_start = idx
+            departure = departures[idx]
+            arrival = arrivals[idx]
+            stop_from = stops_from[idx]
+            stop_to = stops_to[idx]
+            idx += 1
+            if arrival > end_time or stop_to == start_idx:
+                continue
+            if stop_from == start_idx:
+                if departure > departure_to:
+                    continue
+                start_departure = departure  # leave the start point with this connection
+            else:
+                profile = profiles.get(stop_from)
+                if profile is None:
+                    continue
+                # latest departure at start that arrives at stop_from in time for this connection
+                pos = bisect_left(profile[0], departure + 1) - 1
+                if pos < 0:
+                    continue  # cannot catch this connection
+                start_departure = profile[1][pos]
+
+            if stop_to not in profiles:
+                profiles[stop_to] = ([], [])
+            profile_arrivals, profile_departures = profiles[stop_to]
+            pos = bisect_left(profile_arrivals, arrival + 1)
+            if pos > 0 and profile_departures[pos - 1] >= start_departure:
+                continue  # dominated: an earlier or equal arrival for a later or equal departure is known
+            # remove the labels dominated by the new one: the ones with the same arrival (their departures are
+            # earlier, as the new label is not dominated) and the later arrivals without a later departure
+            begin = bisect_left(profile_arrivals, arrival, hi=pos)
+            end = pos
+            while end < len(profile_arrivals) and profile_departures[end] <= start_departure:
+                end += 1
+            profile_arrivals[begin:end] = [arrival]
+            profile_departures[begin:end] = [start_departure]
+            rescan_block = rescan_block or arrival == departure
+
+        return {stop: list(zip(profile_departures, profile_arrivals))
+                for stop, (profile_arrivals, profile_departures) in profiles.items()}
+
+    def _get_raptor_table(self) -> RaptorTable:
+        if self._raptor_table is None:
+            if self.trips is None:
+                raise ValueError("The network holds no trips, rebuild it to use the round based search")
+            trip_offsets = np.cumsum([0] + [len(trip.stops) for trip in self.trips]).astype(np.int64)
+
+            def flat(name):
+                return np.array([value for trip in self.trips for value in getattr(trip, name)], dtype=np.int32)
+
+            trip_stops, trip_arrival, trip_departure = flat("stops"), flat("arrivals"), flat("departures")
+            # e.g. connections added one by one, the search would silently miss them
+            connections = self._get_connection_scan_table()
+            if not trips_cover_connections(connections.stop_from, connections.stop_to, connections.departure,
+                                           connections.arrival, trip_offsets, trip_stops, trip_arrival,
+                                           trip_departure):
+                raise ValueError("The trips of the network do not cover all its connections, "
+                                 "use another search or build the network from trips")
+            trip_calendar, calendars = pack_service_days(trip.service_days for trip in self.trips)
+            self._raptor_table = RaptorTable.from_trips(
+                len(self.stop_ids), trip_offsets, trip_stops, trip_arrival, trip_departure,
+                np.array([trip.line for trip in self.trips], dtype=np.int32), trip_calendar, calendars)
+        return self._raptor_table
+
+    def _raptor(self, start_point: int, start_time: int, end_point: int, time_limit: int,
+                day: Optional[int] = None) -> typing.Dict[int, typing.Tuple[int, int]]:
+        """
+        Round based search (RAPTOR) for the earliest arrival at every stop, regardless of the number of transfers.
+        Gives the same arrival times as `_connection_scan` for trips not passing midnight.
+        """
+        _, reachable = self._raptor_rounds(start_point, start_time, end_point, time_limit, self.MAX_ROUNDS, 0, day)
+        return reachable
+
+    def _raptor_rounds(self, start_point: int, start_time: int, end_point: int, time_limit: int, max_rounds: int,
+                       transfer_time: int, day: Optional[int]) -> typing.Tuple[
+        typing.List[typing.Dict[int, typing.Tuple[int, int, int]]], typing.Dict[int, typing.Tuple[int, int]]]:
+        """
+        Round based public transit routing (RAPTOR)
+        see https://doi.org/10.1287/trsc.2014.0534
+        Round k scans the routes serving the stops improved in round k - 1 and finds the earliest arrivals
+        with k vehicles. No priority queue is needed, the stop times of a route are scanned in order.
+
+        Returns:
+            tuple: per round the stops improved in it: stop index → (arrival, boarding stop index, line code)
+            and the earliest arrival over all rounds: stop index → (arrival, previous stop index on the route).
+        """
+        table = self._get_raptor_table()
+        end_time = start_time + time_limit
+        active = None if day is None else active_calendars(table.calendars, day).tolist()
+        # earliest arrival over all rounds so far and the previous stop on the route it was reached with
+        best = {start_point: start_time}
+        previous = {start_point: start_point}
+        rounds = [{start_point: (start_time, start_point, -1)}]
+        marked = [start_point]
+        for num_trips in range(1, max_rounds + 1):
+            # arrivals with less vehicles, the arrivals of this round may not be used to board in this round
+            reached = dict(best)
+            ready_offset = transfer_time if num_trips > 1 else 0
+            # routes serving a marked stop, scanned from the first marked stop on
+            queue = {}
+            for stop in marked:
+                for route, position in table.get_stop_routes(stop):
+                    if position < queue.get(route, position + 1):
+                        queue[route] = position
+
+            improved = {}
+            for route_index, first_position in queue.items():
+                route = table.get_route(route_index)
+                stops = route.stops
+                trip = len(route.calendars)  # no trip boarded yet
+                trip_arrivals, trip_departures, boarding_stop = None, None, -1
+                for position in range(first_position, len(stops)):
+                    stop = stops[position]
+                    if trip_arrivals is not None:
+                        arrival = trip_arrivals[position]
+                        if (arrival <= end_time and trip_departures[position - 1] < end_time and
+                                arrival < best.get(stop, end_time + 1) and arrival < best.get(end_point, end_time + 1)):
+                            best[stop] = arrival
+                            previous[stop] = stops[position - 1]
+                            improved[stop] = (arrival, boarding_stop, route.line)
+                    ready = reached.get(stop)
+                    if ready is None:
+                        continue
+                    ready += ready_offset
+                    if trip_departures is not None and trip_departures[position] < ready:
+                        continue  # no earlier trip can be caught here
+                    # earliest trip running on the day that can be caught here
+                    departures = route.stop_departures[position]
+                    candidate = bisect_left(departures, ready, 0, trip)
+                    while candidate < trip and active is not None and not active[route.calendars[candidate]]:
+                        candidate += 1
+                    if candidate < trip and departures[candidate] < end_time:
+                        trip = candidate
+                        trip_arrivals, trip_departures = route.arrivals[trip], route.departures[trip]
+                        boarding_stop = stop
+            rounds.append(improved)
+            marked = list(improved)
+            if len(marked) == 0:
+                break
+        return rounds, {stop: (arrival, previous[stop]) for stop, arrival in best.items()}
+
+    def get_stop_index(self) -> typing.Mapping[str, int]:
+        """
+        Returns a dense numbering of the stops, iterating the stop IDs in the order of their index.
+
+        Returns:
+            Mapping: stop_id → stop index
+        """
+        return StopIndex(self.stop_ids)
+
     def get_stops(self) -> list:
         """
         Returns all stop IDs in the network.
@@ -149,7 +1328,7 @@ class Network:
         Returns:
             list: List of stop IDs.
         """
-        return list(self.stops.keys())
+        return [self.stop_ids[idx] for idx in self.stops.keys()]
 
     # code below is only needed to build the network from timetable data
 
@@ -160,22 +1339,85 @@ class Network:
         Args:
             to_remove_stop_id (str): Stop ID to remove.
         """
-        for stop_id, connections in self.stops.items():
-            connections.pop(to_remove_stop_id, None)
-        self.stops.pop(to_remove_stop_id, None)
+        to_remove = self.stop_ids.find(to_remove_stop_id)
+        for stop, connections in self.stops.items():
+            connections.pop(to_remove, None)
+        self.stops.pop(to_remove, None)
+        self._split_trips(lambda stop: stop != to_remove)
+        self._invalidate_indexes()
+
+    def retain_stops(self, stop_ids: typing.Iterable[str]) -> int:
+        """
+        Removes all stops except the given ones and all connections to/from the removed stops, in one pass
+        (instead of calling `remove_stop` per stop).
+
+        Args:
+            stop_ids (Iterable[str]): Stop IDs to keep, IDs not part of the network are ignored.
+
+        Returns:
+            int: Number of removed connections.
+        """
+        keep = {idx for idx in map(self.stop_ids.find, stop_ids) if idx in self.stops}
+        removed = 0
+        retained = {}
+        for stop, connections in self.stops.items():
+            if stop not in keep:
+                removed += sum(map(len, connections.values()))
+                continue
+            retained[stop] = {}
+            for connected_stop, timetable in connections.items():
+                if connected_stop in keep:
+                    retained[stop][connected_stop] = timetable
+                else:
+                    removed += len(timetable)
+        self.stops = retained
+        self._split_trips(keep.__contains__)
+        self._invalidate_indexes()
+        return removed
+
+    def _split_trips(self, keep: typing.Callable[[int], bool]) -> None:
+        """
+        Splits the trips at the stops removed from the network, like their connections are removed.
+        """
+        if self.trips is None:
+            return
+        trips = []
+        for trip in self.trips:
+            first = 0
+            for position in range(len(trip.stops) + 1):
+                if position == len(trip.stops) or not keep(trip.stops[position]):
+                    if position - first >= 2:
+                        trips.append(trip.get_part(first, position))
+                    first = position + 1
+        self.trips = trips
+
+    def _invalidate_indexes(self) -> None:
+        """
+        Drops the search indexes after the network was modified.
+        """
+        self._connection_scan_table = None
+        self._raptor_table = None
+        # the stop positions are kept, the fastest speed may have changed
+        self._lower_bound_table = None
+        self._stop_cache.clear()
 
-    def _add_stop(self, stop_id: str) -> None:
+    def _add_stop(self, stop_id: str) -> int:
         """
         Adds a new stop with no outgoing connections.
 
         Args:
             stop_id (str): New stop ID.
+
+        Returns:
+            int: The stop index.
         """
-        assert stop_id not in self.stops
-        self.stops[stop_id] = {}
+        idx = self.stop_ids.intern(stop_id)
+        assert idx not in self.stops
+        self.stops[idx] = {}
+        return idx
 
     def add_connection(self, stop_id_from: str, stop_id_to: str, departure: int, arrival: int, line: str,
-                       transport_type: str) -> None:
+                       transport_type: str, service_days: int = ALL_DAYS) -> None:
         """
         Adds a connection between two stops.
 
@@ -186,27 +1428,111 @@ class Network:
             arrival (int): Arrival time in minutes.
             line (str): Line number.
             transport_type (str): Transport type (e.g., bus, train).
+            service_days (int): Bitmask of the days the connection runs on, see `Connection`.
         """
-        if not stop_id_from in self.stops:
-            self._add_stop(stop_id_from)
-        if not stop_id_to in self.stops:
-            self._add_stop(stop_id_to)
+        self._insert_connection(stop_id_from, stop_id_to, departure, arrival, line, transport_type, service_days)
+        self._invalidate_indexes()
 
-        if stop_id_to not in self.stops[stop_id_from]:
-            self.stops[stop_id_from][stop_id_to] = []
-        self.stops[stop_id_from][stop_id_to].append(Connection(departure, arrival, line, transport_type))
+    def _insert_connection(self, stop_id_from: str, stop_id_to: str, departure: int, arrival: int, line: str,
+                           transport_type: str, service_days: int) -> None:
+        """
+        `add_connection` without dropping the search indexes, for callers adding many connections at once.
+        """
+        stop_from = self.stop_ids.find(stop_id_from)
+        if stop_from not in self.stops:
+            stop_from = self._add_stop(stop_id_from)
+        stop_to = self.stop_ids.find(stop_id_to)
+        if stop_to not in self.stops:
+            stop_to = self._add_stop(stop_id_to)
+
+        if stop_to not in self.stops[stop_from]:
+            self.stops[stop_from][stop_to] = []
+        # timetables are kept sorted by departure
+        insort(self.stops[stop_from][stop_to],
+               Connection(departure, arrival, self.lines.intern(line), self.transport_types.intern(transport_type),
+                          service_days))
+
+    def add_trip(self, stop_ids: typing.List[str], arrivals: typing.List[int], departures: typing.List[int],
+                 line: str, transport_type: str, service_days: int = ALL_DAYS) -> None:
+        """
+        Adds a vehicle trip: the connections between its consecutive stops and the trip itself.
+
+        Args:
+            stop_ids (list): Stop IDs in order of travel.
+            arrivals (list): Arrival time in minutes at each stop, the one at the first stop is not used.
+            departures (list): Departure time in minutes at each stop, the one at the last stop is not used.
+            line (str): Line number.
+            transport_type (str): Transport type (e.g., bus, train).
+            service_days (int): Bitmask of the days the trip runs on, see `Connection`.
+        """
+        for i in range(len(stop_ids) - 1):
+            self._insert_connection(stop_ids[i], stop_ids[i + 1], departures[i], arrivals[i + 1], line,
+                                    transport_type, service_days)
+        # once per trip instead of once per connection
+        self._invalidate_indexes()
+        if len(stop_ids) < 2:
+            return
+        # the times of a trip increase, times after midnight continue above 24 * 60
+        times = []
+        day_offset = 0
+        for time in [departures[0]] + [t for i in range(1, len(stop_ids) - 1)
+                                       for t in (arrivals[i], departures[i])] + [arrivals[-1]]:
+            if len(times) > 0 and time + day_offset < times[-1]:
+                day_offset += midnight
+            times.append(time + day_offset)
+        stops = tuple(self.stop_ids.find(stop_id) for stop_id in stop_ids)
+        self.trips.append(Trip(stops, tuple([times[0]] + times[1::2]), tuple(times[0::2] + [times[-1]]),
+                               self.lines.intern(line), self.transport_types.intern(transport_type), service_days))
 
     def merge(self, other: Network) -> None:
-        for stop_id, connections in other.stops.items():
-            if stop_id not in self.stops:
-                self._add_stop(stop_id)
-            for connecting_stop, timetable in connections.items():
-                if connecting_stop not in self.stops[stop_id]:
-                    self.stops[stop_id][connecting_stop] = []
-                    # concat lists
-                self.stops[stop_id][connecting_stop] += timetable
-                # de-duplicate
-                self.stops[stop_id][connecting_stop] = list(set(self.stops[stop_id][connecting_stop]))
+        self._invalidate_indexes()
+        if self.calendar_start is None:
+            self.calendar_start = other.calendar_start
+        elif other.calendar_start is not None and other.calendar_start != self.calendar_start:
+            raise ValueError(f"Cannot merge networks with calendar start {self.calendar_start} and "
+                             f"{other.calendar_start}")
+        if self.default_date is None:
+            self.default_date = other.default_date
+        # codes of the other network → codes of this network
+        stop_map = {idx: self.stop_ids.intern(other.stop_ids[idx]) for idx in other.stops.keys()}
+        line_map = [self.lines.intern(line) for line in other.lines]
+        type_map = [self.transport_types.intern(transport_type) for transport_type in other.transport_types]
+        if other._stop_positions is not None:
+            # positions of the other network for stops without a position in this network
+            positions = np.full((len(self.stop_ids), 3), np.nan)
+            if self._stop_positions is not None:
+                positions[:len(self._stop_positions)] = self._stop_positions
+            for other_stop, stop in stop_map.items():
+                if other_stop < len(other._stop_positions) and np.isnan(positions[stop]).any():
+                    positions[stop] = other._stop_positions[other_stop]
+            self._stop_positions = positions
+        if self.trips is not None:
+            if other.trips is None:
+                self.trips = None  # the merged network cannot hold all trips
+            else:
+                self.trips += [Trip(tuple(stop_map[stop] for stop in trip.stops), trip.arrivals, trip.departures,
+                                    line_map[trip.line], type_map[trip.transport_type], trip.service_days)
+                               for trip in other.trips]
+        for other_stop, connections in other.stops.items():
+            stop = stop_map[other_stop]
+            if stop not in self.stops:
+                self.stops[stop] = {}
+            for other_connecting_stop, timetable in connections.items():
+                connecting_stop = stop_map[other_connecting_stop]
+                if connecting_stop not in self.stops[stop]:
+                    self.stops[stop][connecting_stop] = []
+                # de-duplicate, the same connection on different days is combined into one
+                service_days = {}
+                for connection in self.stops[stop][connecting_stop]:
+                    key = (connection.departure, connection.arrival, connection.line, connection.transport_type)
+                    service_days[key] = service_days.get(key, 0) | connection.service_days
+                for connection in timetable:
+                    key = (connection.departure, connection.arrival, line_map[connection.line],
+                           type_map[connection.transport_type])
+                    service_days[key] = service_days.get(key, 0) | connection.service_days
+                # timetables are kept sorted by departure
+                self.stops[stop][connecting_stop] = sorted(Connection(*key, days)
+                                                           for key, days in service_days.items())
 
             # duplicates can be removed later
             # nevertheless there should not be any duplicated anyway
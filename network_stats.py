@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import datetime
+import os
+import typing
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from network import Network, active_calendars
+
+# a vehicle leaving at 0:30 is part of the previous operating day (the ticket from the previous day is still valid),
+# so the first departure of a day is the first one after this cutoff
+END_OF_DAY = 2 * 60 + 50  # 02:50
+# first departure of stops without a departure after the cutoff
+NO_DEPARTURE = 25 * 60
+
+
+@dataclass
+class NetworkStats:
+    """
+    Statistics per stop and per edge of a network on one day (or all days), computed from the flat
+    connection table in one pass, so analytics are lookups instead of a walk over all stops.
+    Stops and edges refer to the stop indices of the network the statistics were computed for.
+    """
+    num_connections: int  # connections of the network, to detect statistics of an outdated network
+    first_departure: np.ndarray  # per stop, first departure after `END_OF_DAY`, `NO_DEPARTURE` if there is none
+    departures_per_hour: np.ndarray  # per stop and hour of the day (0 - 23), number of departures
+    degree: np.ndarray  # per stop, number of connected stops
+    edge_from: np.ndarray  # per edge, stop index it starts at
+    edge_to: np.ndarray  # per edge, stop index it leads to
+    edge_vehicles: np.ndarray  # per edge, number of vehicles (connections) on that day
+
+    @staticmethod
+    def from_network(network: Network, date: Optional[datetime.date] = None) -> NetworkStats:
+        """
+        Computes the statistics.
+
+        Args:
+            network (Network): The network.
+            date (Optional[datetime.date]): Only count connections running on this date, None for all.
+
+        Returns:
+            NetworkStats: The statistics.
+        """
+        table = network._get_connection_scan_table()
+        num_stops = len(network.stop_ids)
+        departure, stop_from, stop_to = table.departure, table.stop_from, table.stop_to
+        day = network._service_day(date)
+        if day is not None:
+            active = active_calendars(table.calendars, day)[table.calendar]
+            departure, stop_from, stop_to = departure[active], stop_from[active], stop_to[active]
+
+        first_departure = np.full(num_stops, NO_DEPARTURE, dtype=np.int32)
+        after_cutoff = departure >= END_OF_DAY
+        np.minimum.at(first_departure, stop_from[after_cutoff], departure[after_cutoff])
+
+        departures_per_hour = np.zeros((num_stops, 24), dtype=np.int32)
+        np.add.at(departures_per_hour, (stop_from, (departure // 60) % 24), 1)
+
+        # unique edges with the number of their connections
+        edges, edge_vehicles = np.unique(stop_from.astype(np.int64) * num_stops + stop_to, return_counts=True)
+        edge_from, edge_to = np.divmod(edges, num_stops)
+        degree = np.bincount(edge_from, minlength=num_stops).astype(np.int32)
+        return NetworkStats(len(table.departure), first_departure, departures_per_hour, degree,
+                            edge_from.astype(np.int32), edge_to.astype(np.int32), edge_vehicles.astype(np.int32))
+
+    def save(self, file: typing.Union[str, typing.BinaryIO]) -> None:
+        np.savez(file, num_connections=self.num_connections, first_departure=self.first_departure,
+                 departures_per_hour=self.departures_per_hour, degree=self.degree, edge_from=self.edge_from,
+                 edge_to=self.edge_to, edge_vehicles=self.edge_vehicles)
+
+    @staticmethod
+    def load(file: typing.Union[str, typing.BinaryIO]) -> NetworkStats:
+        with np.load(file) as data:
+            return NetworkStats(int(data["num_connections"]), data["first_departure"], data["departures_per_hour"],
+                                data["degree"], data["edge_from"], data["edge_to"], data["edge_vehicles"])
+
+    def get_stop_table(self, network: Network) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: indexed by stop ID, columns first_departure, degree and departures_hh for every hour.
+        """
+        table = pd.DataFrame(self.departures_per_hour, columns=[f"departures_{hour:02}" for hour in range(24)])
+        table.insert(0, "degree", self.degree)
+        table.insert(0, "first_departure", self.first_departure)
+        table.index = pd.Index(list(network.stop_ids), name="DHID")
+        return table
+
+    def get_edge_table(self, network: Network) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: columns stop_from, stop_to (stop IDs) and vehicles, one row per edge.
+        """
+        stop_ids = np.array(list(network.stop_ids), dtype=object)
+        return pd.DataFrame({"stop_from": stop_ids[self.edge_from], "stop_to": stop_ids[self.edge_to],
+                             "vehicles": self.edge_vehicles})
+
+
+def get_stats_file(directory: str, date: Optional[datetime.date]) -> str:
+    """
+    Returns the file the statistics of the given date are stored in, inside a compiled network directory.
+    """
+    return os.path.join(directory, f"stats_{'all' if date is None else date.isoformat()}.npz")
+
+
+def write_network_stats(network: Network, directory: str, dates: typing.Iterable[Optional[datetime.date]]) -> None:
+    """
+    Computes and stores the statistics of the given dates next to a compiled network.
+
+    Args:
+        network (Network): The network opened from `directory`.
+        directory (str): Compiled network directory.
+        dates (Iterable[Optional[datetime.date]]): Dates to compute the statistics for, None for all days.
+    """
+    for date in dates:
+        NetworkStats.from_network(network, date).save(get_stats_file(directory, date))
+
+
+def get_network_stats(network: Network, date: Optional[datetime.date] = None) -> NetworkStats:
+    """
+    Returns the statistics of a network, read from the compiled network if they were stored at build time
+    (see `write_network_stats`), computed otherwise.
+
+    Args:
+        network (Network): The network.
+        date (Optional[datetime.date]): Only count connections running on this date, None for all.
+
+    Returns:
+        NetworkStats: The statistics.
+    """
+    directory = getattr(network.stops, "directory", None)
+    if directory is not None and os.path.isfile(get_stats_file(directory, date)):
+        stats = NetworkStats.load(get_stats_file(directory, date))
+        if stats.num_connections == len(network._get_connection_scan_table().departure):
+            return stats
+    return NetworkStats.from_network(network, date)
@@ -0,0 +1,77 @@
+import datetime
+import os
+import typing
+import zipfile
+
+from connection_columns import ConnectionColumns
+from parse_input_file import PARSER_VERSION
+
+
+class ParseCache:
+    """
+    Content-addressed cache of the connections parsed from the single xml files of a timetable zip.
+    Entries are keyed by CRC and size of the zip entry, the parser version and the calendar start,
+    so unchanged files are not parsed again when a new release of the timetable data is read.
+    """
+
+    def __init__(self, directory: str) -> None:
+        """
+        Args:
+            directory (str): Directory holding the cache entries, created if it does not exist.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(zip_info: zipfile.ZipInfo, calendar_start: datetime.date) -> str:
+        """
+        Returns the cache key of a zip entry.
+
+        Args:
+            zip_info (zipfile.ZipInfo): The zip entry.
+            calendar_start (datetime.date): Calendar start the file is parsed with.
+
+        Returns:
+            str: The key.
+        """
+        return f"{zip_info.CRC:08x}-{zip_info.file_size}-v{PARSER_VERSION}-{calendar_start.isoformat()}"
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def load(self, key: str) -> typing.Optional[ConnectionColumns]:
+        """
+        Returns the cached connections or None if the key is not cached.
+        """
+        try:
+            return ConnectionColumns.load(self._get_path(key))
+        except FileNotFoundError:
+            return None
+
+    def store(self, key: str, connections: ConnectionColumns) -> None:
+        """
+        Stores the connections parsed from a file.
+        """
+        # write to a temporary file first, so that an interrupted build leaves no broken entries
+        temp_path = self._get_path(key) + f".{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            connections.save(f)
+        os.replace(temp_path, self._get_path(key))
+
+    def prune(self, keys: typing.Iterable[str]) -> int:
+        """
+        Removes all entries except the given ones, e.g. of files no longer in the timetable data.
+
+        Args:
+            keys (Iterable[str]): Keys to keep.
+
+        Returns:
+            int: Number of removed entries.
+        """
+        keep = {os.path.basename(self._get_path(key)) for key in keys}
+        removed = 0
+        for file_name in os.listdir(self.directory):
+            if file_name not in keep:
+                os.remove(os.path.join(self.directory, file_name))
+                removed += 1
+        return removed
@@ -3,48 +3,44 @@
 from lxml import etree
 
 from datetime import datetime
-from network import Network, time_to_minutes
+from network import Network
+from utils import time_to_minutes
 
 xml_namespace = "{http://www.netex.org.uk/netex}"
 
 date_format = "%Y-%m-%dT00:00:00"
 
+# increase whenever the parsed result changes, so that cached parse results are not used anymore
+PARSER_VERSION = 2
+
 
 # returns a network object
 def consolidate_data(line_data, stop_points, stops, journeys, trips):
     network = Network(None)
 
-    for trip_id, (pattern, trip) in trips.items():
+    for trip_id, (pattern, trip, service_days) in trips.items():
         assert pattern in journeys
         line_id, journey_pattern = journeys[pattern]
         assert len(trip) == len(journey_pattern)
-        for i in range(len(trip) - 1):
-            (stop_from, _, depature) = trip[i]
-            (stop_to, arrival, _) = trip[i + 1]
-            assert arrival is not None
-            assert depature is not None
-            assert stop_from is not None
-            assert stop_to is not None
+        trip_stops = []
+        for i, (stop, arrival, depature) in enumerate(trip):
+            # the first stop has no arrival, the last one no departure
+            assert i == 0 or arrival is not None
+            assert i == len(trip) - 1 or depature is not None
+            assert stop is not None
 
             # get global id of stops
-            assert journey_pattern[i][0] == stop_from
-            stop_from = journey_pattern[i][1]
-            if not isinstance(stop_points[stop_from], list):
-                stop_from = "UNKNOWN"
-            else:
-                stop_from = stop_points[stop_from][0]
-                stop_from = stops[stop_from]["global_id"]
-
-            assert journey_pattern[i + 1][0] == stop_to
-            stop_to = journey_pattern[i + 1][1]
-            if not isinstance(stop_points[stop_to], list):
-                stop_to = "UNKNOWN"
+            assert journey_pattern[i][0] == stop
+            stop = journey_pattern[i][1]
+            if not isinstance(stop_points[stop], list):
+                stop = "UNKNOWN"
             else:
-                stop_to = stop_points[stop_to][0]
-                stop_to = stops[stop_to]["global_id"]
+                stop = stop_points[stop][0]
+                stop = stops[stop]["global_id"]
+            trip_stops.append(stop)
 
-            network.add_connection(stop_from, stop_to, depature, arrival, line_data[line_id]["Name"],
-                                   line_data[line_id]["type"])
+        network.add_trip(trip_stops, [arrival for _, arrival, _ in trip], [depature for _, _, depature in trip],
+                         line_data[line_id]["Name"], line_data[line_id]["type"], service_days)
 
     return network
 
@@ -73,24 +69,11 @@ def get_frame_type(frame):
 
 # TODO one could clean unused code, where fields are imported that are not used later
 
-def get_line_info_from_file(file_to_read, date_to_use):
-    line_data = dict()
-    # multiple stop_points can refer to the same stop (e.g. multiple platforms)
-    stop_points = dict()
-    stops = dict()
-
-    tree = etree.parse(file_to_read)
-    root = tree.getroot()
-    assert root.get("version") == "ntx:1.1"
-    composite_frame = get_single_children(get_single_children(root, "dataObjects"), "CompositeFrame")
-    # check that this is indeed a line definition
-    assert get_frame_type(composite_frame) == "epip:EU_PI_LINE_OFFER"
-
-    frame = get_single_children(composite_frame, "frames")
-
-    # ResourceFrame # vehicleTypes # listet die verwendeten Fahrzugtypen
-
-    service_frame = get_single_children(frame, "ServiceFrame")
+def parse_service_frame(service_frame, line_data, stop_points, journeys):
+    """
+    Reads lines, stop points and journey patterns of a ServiceFrame.
+    Returns False if the stop assignments are missing, which means the file cannot be used.
+    """
     assert get_frame_type(service_frame) == "epip:EU_PI_NETWORK"
 
     for line in get_single_children(service_frame, "lines"):
@@ -112,7 +95,7 @@ def get_line_info_from_file(file_to_read, date_to_use):
     stop_assignment = get_single_children(service_frame, "stopAssignments", allow_none=True)
     if stop_assignment is None:
         # could not read data
-        return Network(None)
+        return False
 
     for stop in stop_assignment:
         scheduled_stop_point = get_single_children(stop, "ScheduledStopPointRef").get("ref")
@@ -125,7 +108,6 @@ def get_line_info_from_file(file_to_read, date_to_use):
         origin = get_single_children(link, "FromPointRef").get("ref")
         dest = get_single_children(link, "ToPointRef").get("ref")
 
-    journeys = dict()
     for journey in get_single_children(service_frame, "journeyPatterns"):
         journey_stops = []
         id = journey.get("id")
@@ -136,8 +118,13 @@ def get_line_info_from_file(file_to_read, date_to_use):
             journey_stops.append((stop_point_id, stop_point_loc))
         assert id not in journeys
         journeys[id] = (line_id, journey_stops)
+    return True
+
 
-    site_frame = get_single_children(frame, "SiteFrame")
+def parse_site_frame(site_frame, stop_points, stops):
+    """
+    Reads the stop places of a SiteFrame.
+    """
     assert get_frame_type(site_frame) == "epip:EU_PI_STOP"
     for stop in get_single_children(site_frame, "stopPlaces"):
         id = stop.get("id")
@@ -161,13 +148,13 @@ def get_line_info_from_file(file_to_read, date_to_use):
             else:
                 stops[id] = {"Name": "UNKNOWN", "lat": "0", "lon": "0", "global_id": "UNKNOWN"}
 
-    # add a default stop
-    stops["UNKNOWN"] = {"Name": "UNKNOWN", "lat": "0", "lon": "0", "global_id": "UNKNOWN"}
 
-    # read in <dayTypes> from ServiceCalendarFrame
-    day_types = dict()
+def parse_service_calendar_frame(service_calendar_frame, calendar_start, day_types):
+    """
+    Reads the days each day type is valid on from a ServiceCalendarFrame,
+    as a bitmask where bit i is the i-th day after `calendar_start`.
+    """
     operating_periods = dict()
-    service_calendar_frame = get_single_children(frame, "ServiceCalendarFrame")
     assert get_frame_type(service_calendar_frame) == "epip:EU_PI_CALENDAR"
     ## UicOperatingPeriod are the dates
     # DayTypeAssignment are the assignment of operatingeriods to day Types
@@ -178,42 +165,122 @@ def get_line_info_from_file(file_to_read, date_to_use):
         to_date = datetime.strptime(get_single_children_value_or_none(period, "ToDate"), date_format).date()
         valid_day_bits = get_single_children_value_or_none(period, "ValidDayBits")
         assert len(valid_day_bits) == (to_date - from_date).days + 1  # +1 as date range is inclusive
-        valid_day = 0
-        if from_date <= date_to_use <= to_date:
-            valid_day = int(valid_day_bits[(date_to_use - from_date).days])
-        operating_periods[id] = valid_day
+        # first character is the first day, so it needs to become the lowest bit
+        valid_days = int(valid_day_bits[::-1], 2)
+        offset = (from_date - calendar_start).days
+        if offset >= 0:
+            valid_days = valid_days << offset
+        else:
+            valid_days = valid_days >> -offset  # days before the calendar start are dropped
+        operating_periods[id] = valid_days
     for assignment in get_single_children(calendar, "dayTypeAssignments"):
         op_period = get_single_children(assignment, "OperatingPeriodRef").get("ref")
         day_type = get_single_children(assignment, "DayTypeRef").get("ref")
         assert op_period is not None and day_type is not None
-        day_types[day_type] = operating_periods[op_period]
+        day_types[day_type] = day_types.get(day_type, 0) | operating_periods[op_period]
+
+
+def parse_vehicle_journey(journey):
+    """
+    Reads a ServiceJourney of the TimetableFrame.
+    Returns (id, journey pattern, day types, [(stop point in journey pattern, arrival, departure)]).
+    """
+    id = journey.get("id")
+    pattern = get_single_children(journey, "ServiceJourneyPatternRef").get("ref")
+    journey_day_types = [day_type_node.get("ref") for day_type_node in get_single_children(journey, "dayTypes")]
+    journey_stops = []
+    for time_info in get_single_children(journey, "passingTimes"):
+        stop_ref = get_single_children(time_info, "StopPointInJourneyPatternRef").get("ref")
+        arrival = get_single_children_value_or_none(time_info, "ArrivalTime")
+        if arrival is not None:
+            arrival = time_to_minutes(arrival)
+        depature = get_single_children_value_or_none(time_info, "DepartureTime")
+        if depature is not None:
+            depature = time_to_minutes(depature)
+        journey_stops.append((stop_ref, arrival, depature))
+    return id, pattern, journey_day_types, journey_stops
+
+
+def clear_element(element):
+    """
+    Frees a processed element and its already processed previous siblings, so that the parsed tree does not grow.
+    """
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
+
+def get_line_info_from_file(file_to_read, calendar_start):
+    """
+    Reads a NeTEx line file into a Network. Each connection keeps the days it runs on as a bitmask,
+    where bit i is the i-th day after `calendar_start`.
+    The file is parsed as a stream: every frame is processed as soon as it is read and freed afterwards,
+    the vehicle journeys of the TimetableFrame are processed and freed one by one.
+    So the memory needed does not depend on the size of the file, but on the largest frame besides the timetable.
+    """
+    line_data = dict()
+    # multiple stop_points can refer to the same stop (e.g. multiple platforms)
+    stop_points = dict()
+    stops = dict()
+    journeys = dict()
+    day_types = dict()
+    vehicle_journeys = []
+    has_calendar = False
+
+    frame_tags = {xml_namespace + tag for tag in
+                  ["ServiceFrame", "SiteFrame", "ServiceCalendarFrame", "TimetableFrame"]}
+    checked_structure = False
+    for _, element in etree.iterparse(file_to_read, events=("end",), tag=list(frame_tags) + [
+        xml_namespace + "ServiceJourney"]):
+        if not checked_structure:
+            # the root and the composite frame are already read, when the first frame or journey ends
+            root = element.getroottree().getroot()
+            assert root.get("version") == "ntx:1.1"
+            composite_frame = get_single_children(get_single_children(root, "dataObjects"), "CompositeFrame")
+            # check that this is indeed a line definition
+            assert get_frame_type(composite_frame) == "epip:EU_PI_LINE_OFFER"
+            frame = get_single_children(composite_frame, "frames")
+            checked_structure = True
+
+        if element.tag == xml_namespace + "ServiceJourney":
+            assert element.getparent().tag == xml_namespace + "vehicleJourneys"
+            # usually the calendar is already known, then journeys never running after the calendar start
+            # are skipped right away
+            if not has_calendar or any(day_types[day_type_node.get("ref")]
+                                       for day_type_node in get_single_children(element, "dayTypes")):
+                vehicle_journeys.append(parse_vehicle_journey(element))
+            clear_element(element)
+            continue
+
+        # ResourceFrame # vehicleTypes # listet die verwendeten Fahrzugtypen
+        assert element.getparent() is frame
+        if element.tag == xml_namespace + "ServiceFrame":
+            if not parse_service_frame(element, line_data, stop_points, journeys):
+                # could not read data
+                return Network(None)
+        elif element.tag == xml_namespace + "SiteFrame":
+            parse_site_frame(element, stop_points, stops)
+        elif element.tag == xml_namespace + "ServiceCalendarFrame":
+            parse_service_calendar_frame(element, calendar_start, day_types)
+            has_calendar = True
+        elif element.tag == xml_namespace + "TimetableFrame":
+            assert get_frame_type(element) == "epip:EU_PI_TIMETABLE"
+        clear_element(element)
+
+    # add a default stop
+    stops["UNKNOWN"] = {"Name": "UNKNOWN", "lat": "0", "lon": "0", "global_id": "UNKNOWN"}
 
     # parse timetable
+    # the service days are resolved afterwards, as the calendar may be read after the timetable
     trips = dict()
-    timetable_frame = get_single_children(frame, "TimetableFrame")
-    assert get_frame_type(timetable_frame) == "epip:EU_PI_TIMETABLE"
-    # < dayTypes >
-    for journey in get_single_children(timetable_frame, "vehicleJourneys"):
-        id = journey.get("id")
-        valid_for_date = False
-        pattern = get_single_children(journey, "ServiceJourneyPatternRef").get("ref")
-        for day_type_node in get_single_children(journey, "dayTypes"):
-            if day_types[day_type_node.get("ref")]:
-                valid_for_date = True
+    for id, pattern, journey_day_types, journey_stops in vehicle_journeys:
         assert pattern in journeys
-
-        if valid_for_date:
-            journey_stops = []
-            for time_info in get_single_children(journey, "passingTimes"):
-                stop_ref = get_single_children(time_info, "StopPointInJourneyPatternRef").get("ref")
-                arrival = get_single_children_value_or_none(time_info, "ArrivalTime")
-                if arrival is not None:
-                    arrival = time_to_minutes(arrival)
-                depature = get_single_children_value_or_none(time_info, "DepartureTime")
-                if depature is not None:
-                    depature = time_to_minutes(depature)
-                journey_stops.append((stop_ref, arrival, depature))
-            trips[id] = (pattern, journey_stops)
+        service_days = 0
+        for day_type in journey_day_types:
+            service_days |= day_types[day_type]
+        if service_days != 0:
+            trips[id] = (pattern, journey_stops, service_days)
 
     network = consolidate_data(line_data, stop_points, stops, journeys, trips)
+    network.calendar_start = calendar_start
     return network
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import typing
+
+import numpy as np
+import pandas as pd
+
+from stops import Stops
+
+# population store: a directory of numpy arrays that are memory-mapped when opened,
+# the points of the population csv grouped into tiles of `tile_size` degrees:
+#   tile_keys     sorted keys of the non-empty tiles, row * number of tile columns + column (see `get_tile_keys`)
+#   tile_offsets  tile → range of its points, one more entry than tiles
+#   lat, lon, population   one entry per point, grouped by tile, in the order of the csv within a tile
+#   meta.json     format version and tile size
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+DEFAULT_TILE_SIZE = 0.1  # degrees, about 11 x 7 km in Germany
+# rows of the csv converted at once
+CHUNK_SIZE = 1_000_000
+
+
+def get_store_dir(population_file: str) -> str:
+    """
+    Returns the directory the population store of a population csv is written to, next to the csv.
+    """
+    return population_file + ".grid"
+
+
+def get_tile_keys(lat: np.ndarray, lon: np.ndarray, tile_size: float) -> np.ndarray:
+    """
+    Returns the key of the tile of every point, row * number of tile columns + column,
+    with rows from the south pole and columns from the antimeridian.
+    """
+    num_columns = int(np.ceil(360 / tile_size))
+    row = np.floor((np.asarray(lat, dtype=np.float64) + 90) / tile_size).astype(np.int64)
+    column = np.clip(np.floor((np.asarray(lon, dtype=np.float64) + 180) / tile_size).astype(np.int64),
+                     0, num_columns - 1)
+    return row * num_columns + column
+
+
+def write_population_store(population_file: str, directory: str, tile_size: float = DEFAULT_TILE_SIZE) -> None:
+    """
+    Converts a population csv (columns Lat, Lon and Population) into the population store.
+    The csv is read twice in chunks, to count the points per tile and to write them, so the conversion
+    needs memory for one chunk only.
+
+    Args:
+        population_file (str): The population csv.
+        directory (str): Output directory, replaced if it exists.
+        tile_size (float): Edge length of the tiles in degrees.
+    """
+    def read_chunks():
+        return pd.read_csv(population_file, usecols=["Lat", "Lon", "Population"], dtype=np.float64,
+                           chunksize=CHUNK_SIZE)
+
+    counts: typing.Dict[int, int] = dict()
+    for chunk in read_chunks():
+        keys, key_counts = np.unique(get_tile_keys(chunk["Lat"], chunk["Lon"], tile_size), return_counts=True)
+        for key, count in zip(keys.tolist(), key_counts.tolist()):
+            counts[key] = counts.get(key, 0) + count
+    tile_keys = np.array(sorted(counts), dtype=np.int64)
+    tile_offsets = np.zeros(len(tile_keys) + 1, dtype=np.int64)
+    np.cumsum([counts[key] for key in tile_keys.tolist()], out=tile_offsets[1:])
+    num_points = int(tile_offsets[-1])
+
+    # written to a temporary directory first, so that an interrupted conversion leaves no broken store
+    temp_dir = directory + f".{os.getpid()}.tmp"
+    os.makedirs(temp_dir, exist_ok=True)
+    np.save(os.path.join(temp_dir, "tile_keys.npy"), tile_keys)
+    np.save(os.path.join(temp_dir, "tile_offsets.npy"), tile_offsets)
+    columns = {name: np.lib.format.open_memmap(os.path.join(temp_dir, f"{name}.npy"), mode="w+",
+                                               dtype=np.float64, shape=(num_points,))
+               for name in ("lat", "lon", "population")}
+    filled = np.zeros(len(tile_keys), dtype=np.int64)
+    for chunk in read_chunks():
+        tiles = np.searchsorted(tile_keys, get_tile_keys(chunk["Lat"], chunk["Lon"], tile_size))
+        order = np.argsort(tiles, kind="stable")
+        sorted_tiles = tiles[order]
+        # rank of every point within its tile in this chunk
+        first = np.searchsorted(sorted_tiles, sorted_tiles, side="left")
+        positions = tile_offsets[sorted_tiles] + filled[sorted_tiles] + np.arange(len(order)) - first
+        for name, column in (("lat", "Lat"), ("lon", "Lon"), ("population", "Population")):
+            columns[name][positions] = chunk[column].to_numpy()[order]
+        filled += np.bincount(tiles, minlength=len(tile_keys))
+    for column in columns.values():
+        column.flush()
+    del columns
+    with open(os.path.join(temp_dir, META_FILE), "w") as f:
+        json.dump({"version": FORMAT_VERSION, "tile_size": tile_size, "num_points": num_points}, f)
+
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.replace(temp_dir, directory)
+
+
+class PopulationGrid:
+    """
+    Population points of a population store (see `write_population_store`), memory-mapped,
+    so that a bounding box read only touches the tiles overlapping the box.
+    """
+
+    def __init__(self, directory: str) -> None:
+        """
+        Opens a population store.
+
+        Args:
+            directory (str): The store directory.
+        """
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"population store {directory} has format version {meta['version']}, "
+                             f"expected {FORMAT_VERSION}")
+        self.directory = directory
+        self.tile_size = meta["tile_size"]
+        self.num_columns = int(np.ceil(360 / self.tile_size))
+        self.tile_keys = np.load(os.path.join(directory, "tile_keys.npy"))
+        self.tile_offsets = np.load(os.path.join(directory, "tile_offsets.npy"))
+        self.lat = np.load(os.path.join(directory, "lat.npy"), mmap_mode="r")
+        self.lon = np.load(os.path.join(directory, "lon.npy"), mmap_mode="r")
+        self.population = np.load(os.path.join(directory, "population.npy"), mmap_mode="r")
+
+    @staticmethod
+    def open(population_file: str, tile_size: float = DEFAULT_TILE_SIZE) -> PopulationGrid:
+        """
+        Opens the population store next to a population csv, converting the csv first
+        if there is no store or it is older than the csv.
+
+        Args:
+            population_file (str): The population csv with the columns Lat, Lon and Population.
+            tile_size (float): Edge length of the tiles in degrees, if the store is written.
+
+        Returns:
+            PopulationGrid: The population points.
+        """
+        directory = get_store_dir(population_file)
+        meta_file = os.path.join(directory, META_FILE)
+        if not os.path.isfile(meta_file) or os.path.getmtime(meta_file) < os.path.getmtime(population_file):
+            write_population_store(population_file, directory, tile_size)
+        else:
+            with open(meta_file) as f:
+                if json.load(f)["version"] != FORMAT_VERSION:
+                    write_population_store(population_file, directory, tile_size)
+        return PopulationGrid(directory)
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def _get_ranges(self, lat1: float, lon1: float, lat2: float, lon2: float) -> typing.List[typing.Tuple[int, int]]:
+        # the tiles of one tile row are consecutive keys, so every row of the box is one range of points
+        first_key, last_key = get_tile_keys([lat1, lat2], [lon1, lon2], self.tile_size)
+        first_column = first_key % self.num_columns
+        last_column = last_key % self.num_columns
+        ranges = []
+        for row in range(first_key // self.num_columns, last_key // self.num_columns + 1):
+            first, last = np.searchsorted(self.tile_keys, [row * self.num_columns + first_column,
+                                                           row * self.num_columns + last_column + 1])
+            if first < last:
+                ranges.append((int(self.tile_offsets[first]), int(self.tile_offsets[last])))
+        return ranges
+
+    def in_bbox(self, lat1: float, lon1: float, lat2: float, lon2: float) -> pd.DataFrame:
+        """
+        Returns the population points inside the bounding box (bounds included).
+
+        Args:
+            lat1 (float): Southern latitude.
+            lon1 (float): Western longitude.
+            lat2 (float): Northern latitude.
+            lon2 (float): Eastern longitude.
+
+        Returns:
+            pd.DataFrame: columns Lat, Lon and Population.
+        """
+        ranges = self._get_ranges(lat1, lon1, lat2, lon2)
+        columns = [np.concatenate([column[first:last] for first, last in ranges]) if len(ranges) > 0
+                   else np.zeros(0) for column in (self.lat, self.lon, self.population)]
+        lat, lon, population = columns
+        inside = (lat1 <= lat) & (lat <= lat2) & (lon1 <= lon) & (lon <= lon2)
+        return pd.DataFrame({"Lat": lat[inside], "Lon": lon[inside], "Population": population[inside]})
+
+    def get_population_per_stop(self, stops: Stops, lat1: float, lon1: float, lat2: float,
+                                lon2: float) -> pd.Series:
+        """
+        Sums up the population inside the bounding box by the nearest stop, found with the spatial index
+        over all stops, so people living closer to a stop outside the box are counted for that stop.
+
+        Args:
+            stops (Stops): The stops.
+            lat1 (float): Southern latitude.
+            lon1 (float): Western longitude.
+            lat2 (float): Northern latitude.
+            lon2 (float): Eastern longitude.
+
+        Returns:
+            pd.Series: Population indexed by stop ID, only the stops that are nearest to at least one point.
+        """
+        points = self.in_bbox(lat1, lon1, lat2, lon2)
+        positions, _ = stops.query_nearest(points["Lat"].to_numpy(), points["Lon"].to_numpy())
+        nearest = positions[:, 0]
+        population = np.bincount(nearest, weights=points["Population"].to_numpy(), minlength=len(stops))
+        has_points = np.bincount(nearest, minlength=len(stops)) > 0
+        # stop IDs can appear more than once in the stations data
+        return pd.Series(population[has_points], index=stops.data.index[has_points],
+                         name="Population").groupby(level=0).sum()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="convert a population csv into the memory-mapped population store")
+    parser.add_argument('--population_file', default='data/population_deu_2019-07-01.csv', required=False,
+                        help='csv with the columns Lat, Lon and Population')
+    parser.add_argument('--output', default=None, required=False,
+                        help='store directory (default: next to the csv, where PopulationGrid.open finds it)')
+    parser.add_argument('--tile_size', default=DEFAULT_TILE_SIZE, type=float, help='in degrees', required=False)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    output = get_store_dir(args.population_file) if args.output is None else args.output
+    write_population_store(args.population_file, output, args.tile_size)
+    grid = PopulationGrid(output)
+    print(f"{len(grid)} points in {len(grid.tile_keys)} tiles")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import datetime
+import json
+import sys
+import typing
+
+from network import Network
+from utils import minutes_to_time, time_to_minutes
+
+# one-off reachability and fastest route queries from the command line, e.g.
+#   python query.py reachable --start de:06411:4734 --start_time 09:00 --time_limit 30
+#   python query.py route --start de:06411:4734 --end de:06432:24001 --start_time 09:00 --json
+# only the network is loaded (no pandas or plotting libraries), unless stations are given by name
+
+
+def find_stop(network: Network, stop_id: typing.Optional[str], name: typing.Optional[str],
+              stations_file: str) -> str:
+    """
+    Returns the stop ID of a stop given by ID or by station name.
+
+    Raises:
+        SystemExit: if the stop is unknown.
+    """
+    if name is not None:
+        # imported here, as only name lookups need the stations (and pandas)
+        from stops import Stops
+        from utils import find_closest_station_id_by_name
+
+        stop_id = find_closest_station_id_by_name(name, Stops.open(stations_file).data)
+        if stop_id is None:
+            raise SystemExit(f"no station found for {name}")
+    if stop_id not in network.get_stop_index():
+        raise SystemExit(f"unknown stop: {stop_id}")
+    return stop_id
+
+
+def get_reachable(network: Network, args: argparse.Namespace) -> typing.Dict[str, typing.Any]:
+    start = find_stop(network, args.start, args.start_name, args.stations_file)
+    reachable = network.get_reachable_stations_in_time(start, args.start_time, args.time_limit,
+                                                       algorithm=args.algorithm, date=args.date)
+    return {"start": start, "start_time": args.start_time,
+            "reachable": [{"stop_id": stop_id, "arrival": arrival, "previous": previous}
+                          for stop_id, (arrival, previous) in sorted(reachable.items(),
+                                                                     key=lambda item: (item[1][0], item[0]))]}
+
+
+def get_route(network: Network, args: argparse.Namespace) -> typing.Dict[str, typing.Any]:
+    start = find_stop(network, args.start, args.start_name, args.stations_file)
+    end = find_stop(network, args.end, args.end_name, args.stations_file)
+    reachable = network.get_fastest_route(start, args.start_time, end, algorithm=args.algorithm, date=args.date)
+    if end not in reachable:
+        raise SystemExit(f"{end} is not reachable from {start}")
+    # trace back the route from the end
+    route = [end]
+    while route[-1] != start:
+        route.append(reachable[route[-1]][1])
+    return {"start": start, "end": end, "start_time": args.start_time, "arrival": reachable[end][0],
+            "route": [{"stop_id": stop_id, "arrival": reachable[stop_id][0]} for stop_id in reversed(route)]}
+
+
+def print_result(command: str, result: typing.Dict[str, typing.Any]) -> None:
+    if command == "reachable":
+        print(f"{len(result['reachable'])} stops reachable from {result['start']} "
+              f"(starting {minutes_to_time(result['start_time'])})")
+        stops = result["reachable"]
+    else:
+        print(f"{result['start']} {minutes_to_time(result['start_time'])} → {result['end']} "
+              f"{minutes_to_time(result['arrival'])} ({result['arrival'] - result['start_time']} minutes)")
+        stops = result["route"]
+    for stop in stops:
+        print(f"{minutes_to_time(stop['arrival'])}  {stop['stop_id']}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="one-off reachability and fastest route queries")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_query_arguments(command, default_algorithm):
+        command.add_argument('--network_file', default='network.csr', required=False,
+                             help='compiled network directory (or a shelve file of the old format)')
+        command.add_argument('--stations_file', default='stops.csv', required=False,
+                             help='stations csv, only read for stations given by name')
+        command.add_argument('--json', action='store_true', help='print the result as JSON')
+        start = command.add_mutually_exclusive_group(required=True)
+        start.add_argument('--start', help='stop ID')
+        start.add_argument('--start_name', help='station name')
+        command.add_argument('--start_time', default='09:00', type=time_to_minutes, help='start time in HH:MM',
+                             required=False)
+        command.add_argument('--date', default=None, type=datetime.date.fromisoformat, required=False,
+                             help='day of service in YYYY-MM-DD (default: the default date of the network)')
+        command.add_argument('--algorithm', default=default_algorithm, choices=Network.ALGORITHMS,
+                             required=False)
+
+    reachable = commands.add_parser('reachable', help='all stops reachable within a time limit')
+    add_query_arguments(reachable, 'csa')
+    reachable.add_argument('--time_limit', default=30, type=int, help='time limit in minutes', required=False)
+
+    route = commands.add_parser('route', help='fastest route between two stops')
+    add_query_arguments(route, 'astar')
+    end = route.add_mutually_exclusive_group(required=True)
+    end.add_argument('--end', help='stop ID')
+    end.add_argument('--end_name', help='station name')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    network = Network(args.network_file)
+    try:
+        result = get_reachable(network, args) if args.command == "reachable" else get_route(network, args)
+    except ValueError as e:
+        # e.g. a search the network does not support
+        raise SystemExit(str(e))
+    if args.json:
+        json.dump(result, sys.stdout)
+        print()
+    else:
+        print_result(args.command, result)
+
+
+if __name__ == '__main__':
+    main()
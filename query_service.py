@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import datetime
+import json
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from network import Network
+from stops import Stops
+from utils import find_closest_station_id_by_name, time_to_minutes
+
+# local HTTP/JSON service answering queries on a network that is loaded once
+#   GET  /health                  number of stops
+#   GET  /station?name=...        closest station by name: stop_id, name, latitude, longitude
+#   POST /reachable               {"start", "start_time", "time_limit", "algorithm", "date"}
+#                                 → {"reachable": {stop_id: {"arrival", "previous"}}}
+#   POST /route                   {"start", "end", "start_time", "algorithm", "date"}
+#                                 → {"arrival", "route": [{"stop_id", "arrival"}, ...]}
+#   POST /batch                   {"queries": [{"type": "station" | "reachable" | "route", ...}, ...]}
+#                                 → {"results": [...]}, failed queries give {"error": ...}
+# start and end are stop IDs, or station names given as start_name / end_name,
+# times are minutes since midnight or "HH:MM", dates "YYYY-MM-DD" (default: the default date of the network)
+MAX_BODY_BYTES = 1 << 20
+
+# the network and stations of a worker process, opened once by the pool initializer
+_worker_network: typing.Optional[Network] = None
+_worker_stops: typing.Optional[pd.DataFrame] = None
+
+
+class QueryError(Exception):
+    """
+    Invalid query, answered with the given HTTP status.
+    """
+
+    def __init__(self, message: str, status: int = 400) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def _init_worker(network_file: str, stations_file: str, cache_entries: typing.Optional[int]) -> None:
+    global _worker_network, _worker_stops
+    # a compiled network is memory-mapped, so all workers share the same pages of the network
+    _worker_network = Network(network_file, cache_entries=cache_entries)
+    stops = Stops.open(stations_file).data
+    # a DHID listed more than once is answered with its first row
+    _worker_stops = stops[~stops.index.duplicated(keep="first")]
+
+
+def _get_time(query: dict, key: str, default: typing.Optional[int] = None) -> int:
+    value = query.get(key, default)
+    if value is None:
+        raise QueryError(f"missing {key}")
+    try:
+        return time_to_minutes(value) if isinstance(value, str) else int(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"invalid {key}: {value}")
+
+
+def _get_date(query: dict) -> typing.Optional[datetime.date]:
+    if query.get("date") is None:
+        return None
+    try:
+        return datetime.date.fromisoformat(query["date"])
+    except (TypeError, ValueError):
+        raise QueryError(f"invalid date: {query['date']}")
+
+
+def _get_algorithm(query: dict, default: str) -> str:
+    algorithm = query.get("algorithm", default)
+    if algorithm not in Network.ALGORITHMS:
+        raise QueryError(f"unknown algorithm: {algorithm}, use one of {', '.join(Network.ALGORITHMS)}")
+    return algorithm
+
+
+def _find_station(name: str) -> str:
+    if not isinstance(name, str):
+        raise QueryError(f"invalid station name: {name!r}")
+    stop_id = find_closest_station_id_by_name(name, _worker_stops)
+    if stop_id is None:
+        raise QueryError(f"no station found for {name}", status=404)
+    return stop_id
+
+
+def _get_stop(query: dict, key: str) -> str:
+    if query.get(f"{key}_name") is not None:
+        return _find_station(query[f"{key}_name"])
+    if query.get(key) is None:
+        raise QueryError(f"missing {key} or {key}_name")
+    if not isinstance(query[key], str):
+        raise QueryError(f"invalid {key}: {query[key]!r}, stop IDs are strings")
+    if query[key] not in _worker_network.get_stop_index():
+        raise QueryError(f"unknown stop: {query[key]}", status=404)
+    return query[key]
+
+
+def _station(query: dict) -> dict:
+    if query.get("name") is None:
+        raise QueryError("missing name")
+    stop_id = _find_station(query["name"])
+    station = _worker_stops.loc[stop_id]
+    return {"stop_id": stop_id, "name": station["Name"], "latitude": float(station["Latitude"]),
+            "longitude": float(station["Longitude"])}
+
+
+def _reachable(query: dict) -> dict:
+    reachable = _worker_network.get_reachable_stations_in_time(
+        _get_stop(query, "start"), _get_time(query, "start_time"), _get_time(query, "time_limit", 30),
+        algorithm=_get_algorithm(query, "csa"), date=_get_date(query))
+    return {"reachable": {stop_id: {"arrival": arrival, "previous": previous}
+                          for stop_id, (arrival, previous) in reachable.items()}}
+
+
+def _route(query: dict) -> dict:
+    start, end = _get_stop(query, "start"), _get_stop(query, "end")
+    reachable = _worker_network.get_fastest_route(start, _get_time(query, "start_time"), end,
+                                                  algorithm=_get_algorithm(query, "astar"), date=_get_date(query))
+    if end not in reachable:
+        raise QueryError(f"{end} is not reachable from {start}", status=404)
+    # trace back the route from the end
+    route = [end]
+    while route[-1] != start:
+        route.append(reachable[route[-1]][1])
+    return {"arrival": reachable[end][0],
+            "route": [{"stop_id": stop_id, "arrival": reachable[stop_id][0]} for stop_id in reversed(route)]}
+
+
+QUERIES: typing.Dict[str, typing.Callable[[dict], dict]] = {
+    "station": _station,
+    "reachable": _reachable,
+    "route": _route,
+}
+
+
+def run_query(kind: str, query: dict) -> typing.Tuple[int, dict]:
+    """
+    Answers a single query in a worker process.
+
+    Args:
+        kind (str): One of `QUERIES`.
+        query (dict): Parameters of the query.
+
+    Returns:
+        Tuple[int, dict]: HTTP status and the JSON response.
+    """
+    try:
+        return 200, QUERIES[kind](query)
+    except QueryError as e:
+        return e.status, {"error": str(e)}
+    except ValueError as e:
+        # e.g. a search the network does not support
+        return 400, {"error": str(e)}
+
+
+class QueryService:
+    """
+    Serves queries on a network over HTTP/JSON, see the top of this file for the endpoints.
+    The searches run in a process pool, each worker opens the network once,
+    so concurrent requests do not block each other and no request pays for loading the network.
+    """
+
+    def __init__(self, network_file: str, stations_file: str, num_workers: typing.Optional[int] = None,
+                 cache_entries: typing.Optional[int] = None) -> None:
+        """
+        Args:
+            network_file (str): Path to the network, should be a compiled network, so the workers share it.
+            stations_file (str): Stations csv with the columns DHID, Name, Latitude and Longitude.
+            num_workers (Optional[int]): Number of worker processes, defaults to the number of CPUs.
+            cache_entries (Optional[int]): Maximum number of decoded stops kept in memory per worker.
+        """
+        self.num_stops = len(Network(network_file).get_stop_index())
+        self.executor = ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker,
+                                            initargs=(network_file, stations_file, cache_entries))
+
+    async def _run(self, kind: str, query: typing.Any) -> typing.Tuple[int, dict]:
+        if kind not in QUERIES:
+            return 400, {"error": f"unknown query type: {kind}"}
+        if not isinstance(query, dict):
+            return 400, {"error": "a query has to be a JSON object"}
+        return await asyncio.get_running_loop().run_in_executor(self.executor, run_query, kind, query)
+
+    async def _batch(self, query: typing.Any) -> typing.Tuple[int, dict]:
+        if not isinstance(query, dict) or not isinstance(query.get("queries"), list):
+            return 400, {"error": "missing queries"}
+        # all queries of the batch are handed to the pool at once, a failing query only fails its own result
+        results = await asyncio.gather(*(self._run(q.get("type") if isinstance(q, dict) else None, q)
+                                         for q in query["queries"]), return_exceptions=True)
+        return 200, {"results": [{"error": f"{type(result).__name__}: {result}"} if isinstance(result, Exception)
+                                 else result[1] for result in results]}
+
+    async def handle(self, method: str, target: str, body: bytes) -> typing.Tuple[int, dict]:
+        """
+        Answers a request.
+
+        Args:
+            method (str): HTTP method.
+            target (str): Path and query string.
+            body (bytes): Request body, JSON for POST requests.
+
+        Returns:
+            Tuple[int, dict]: HTTP status and the JSON response.
+        """
+        url = urlsplit(target)
+        if method == "GET":
+            if url.path == "/health":
+                return 200, {"stops": self.num_stops}
+            if url.path == "/station":
+                return await self._run("station", {key: values[0] for key, values in parse_qs(url.query).items()})
+        elif method == "POST" and url.path in ("/reachable", "/route", "/batch"):
+            try:
+                query = json.loads(body)
+            except ValueError:
+                return 400, {"error": "invalid JSON"}
+            if url.path == "/batch":
+                return await self._batch(query)
+            return await self._run(url.path[1:], query)
+        return 404, {"error": f"no endpoint {method} {url.path}"}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if line == "":
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if len(request_line) != 3:
+                status, response = 400, {"error": "invalid request"}
+            elif length > MAX_BODY_BYTES:
+                status, response = 413, {"error": "request too large"}
+            else:
+                status, response = await self.handle(request_line[0], request_line[1],
+                                                     await reader.readexactly(length))
+        except (ValueError, asyncio.IncompleteReadError):
+            status, response = 400, {"error": "invalid request"}
+        except Exception as e:
+            status, response = 500, {"error": f"{type(e).__name__}: {e}"}
+        payload = json.dumps(response).encode("utf-8")
+        # one request per connection, which is enough for a local service
+        writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                     f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        """
+        Serves requests until cancelled.
+
+        Args:
+            host (str): Address to listen on, only the local machine by default.
+            port (int): Port to listen on.
+        """
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        """
+        Shuts the worker processes down.
+        """
+        self.executor.shutdown()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="serve reachability, routing and station queries over HTTP/JSON")
+    parser.add_argument('--network_file', default='network.csr', required=False)
+    parser.add_argument('--stations_file', default='stops.csv', required=False)
+    parser.add_argument('--host', default='127.0.0.1', required=False)
+    parser.add_argument('--port', default=8080, type=int, required=False)
+    parser.add_argument('--workers', default=None, type=int, help='number of worker processes', required=False)
+    parser.add_argument('--cache_entries', default=None, type=int,
+                        help='maximum number of decoded stops kept in memory per worker '
+                             '(default: only bounded by their size)', required=False)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    service = QueryService(args.network_file, args.stations_file, num_workers=args.workers,
+                           cache_entries=args.cache_entries)
+    print(f"serving {service.num_stops} stops on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
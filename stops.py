@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import os
+import pickle
+import typing
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from name_index import NameIndex, register_name_index
+from network import EARTH_RADIUS, get_stop_positions
+
+# increase whenever the layout of the persisted index changes, so that old index files are rebuilt
+INDEX_VERSION = 2
+
+
+def get_index_file(stations_file: str) -> str:
+    """
+    Returns the file the spatial index of a stations csv is persisted in, next to the csv.
+    """
+    return stations_file + ".idx"
+
+
+class Stops:
+    """
+    The stations (stop ID, name, latitude, longitude) with a spatial index for bounding box, radius and
+    nearest stop queries and a name index (see `name_index.NameIndex`). Stops without coordinates are dropped.
+    Radius and nearest queries use a KD-tree over the positions on the earth (see `get_stop_positions`),
+    bounding box queries a sorted latitude column.
+    """
+
+    def __init__(self, data: pd.DataFrame) -> None:
+        """
+        Builds the index.
+
+        Args:
+            data (pd.DataFrame): indexed by stop ID, with the columns Name, Latitude and Longitude.
+        """
+        self.data = data.dropna(subset=["Latitude", "Longitude"])
+        latitude = self.data["Latitude"].to_numpy(dtype=np.float64)
+        self._tree = cKDTree(get_stop_positions(latitude, self.data["Longitude"].to_numpy(dtype=np.float64)))
+        self._latitude_order = np.argsort(latitude, kind="stable")
+        self._sorted_latitude = latitude[self._latitude_order]
+        self.names = NameIndex(self.data["Name"].tolist(), self.data.index.tolist())
+        # `utils.find_closest_station_id_by_name` on `data` uses this index instead of building its own
+        register_name_index(self.data, self.names)
+
+    def __setstate__(self, state: typing.Dict[str, typing.Any]) -> None:
+        self.__dict__.update(state)
+        register_name_index(self.data, self.names)
+
+    @staticmethod
+    def open(stations_file: str) -> Stops:
+        """
+        Reads the stations csv, using the persisted index next to it (see `save`) if it is up to date,
+        otherwise the index is built and persisted.
+
+        Args:
+            stations_file (str): Stations csv with the columns DHID, Name, Latitude and Longitude.
+
+        Returns:
+            Stops: The stops.
+        """
+        index_file = get_index_file(stations_file)
+        if os.path.isfile(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(stations_file):
+            with open(index_file, "rb") as f:
+                version, stops = pickle.load(f)
+            if version == INDEX_VERSION:
+                return stops
+        stops = Stops(pd.read_csv(stations_file, index_col="DHID"))
+        stops.save(index_file)
+        return stops
+
+    def save(self, index_file: str) -> None:
+        """
+        Persists the stops with their index, so that it is not built again when opened.
+        """
+        temp_file = index_file + f".{os.getpid()}.tmp"
+        with open(temp_file, "wb") as f:
+            pickle.dump((INDEX_VERSION, self), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, index_file)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def in_bbox(self, lat1: float, lon1: float, lat2: float, lon2: float) -> pd.DataFrame:
+        """
+        Returns the stops strictly inside the bounding box, in the order of `data`.
+
+        Args:
+            lat1 (float): Southern latitude.
+            lon1 (float): Western longitude.
+            lat2 (float): Northern latitude.
+            lon2 (float): Eastern longitude.
+
+        Returns:
+            pd.DataFrame: The rows of `data` inside the box.
+        """
+        first = np.searchsorted(self._sorted_latitude, lat1, side="right")
+        last = np.searchsorted(self._sorted_latitude, lat2, side="left")
+        candidates = np.sort(self._latitude_order[first:last])
+        longitude = self.data["Longitude"].to_numpy()[candidates]
+        return self.data.iloc[candidates[(longitude > lon1) & (longitude < lon2)]]
+
+    def within_radius(self, latitude: float, longitude: float, radius: float) -> pd.DataFrame:
+        """
+        Returns the stops within the given distance, sorted by distance.
+
+        Args:
+            latitude (float): Latitude of the center.
+            longitude (float): Longitude of the center.
+            radius (float): Distance in meters.
+
+        Returns:
+            pd.DataFrame: The rows of `data` with an additional column Distance in meters.
+        """
+        center = get_stop_positions([latitude], [longitude])[0]
+        # the tree holds chord distances, which are slightly shorter than the distances on the surface
+        chord = 2 * EARTH_RADIUS * np.sin(min(radius / (2 * EARTH_RADIUS), np.pi / 2))
+        positions = np.array(self._tree.query_ball_point(center, chord), dtype=np.int64)
+        distances = self._to_surface_distance(np.linalg.norm(self._tree.data[positions] - center, axis=1)
+                                              if len(positions) > 0 else np.zeros(0))
+        order = np.argsort(distances, kind="stable")
+        return self.data.iloc[positions[order]].assign(Distance=distances[order])
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1) -> pd.DataFrame:
+        """
+        Returns the k stops closest to the given coordinates, sorted by distance.
+
+        Returns:
+            pd.DataFrame: The rows of `data` with an additional column Distance in meters.
+        """
+        positions, distances = self.query_nearest([latitude], [longitude], k=k)
+        valid = positions[0] < len(self.data)  # fewer stops than k
+        return self.data.iloc[positions[0][valid]].assign(Distance=distances[0][valid])
+
+    def query_nearest(self, latitudes: np.ndarray, longitudes: np.ndarray, k: int = 1) -> typing.Tuple[
+            np.ndarray, np.ndarray]:
+        """
+        Finds the nearest stops of many coordinates at once.
+
+        Args:
+            latitudes (np.ndarray): Latitude per query point.
+            longitudes (np.ndarray): Longitude per query point.
+            k (int): Number of stops per query point.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Positions of the stops in `data` and distances in meters,
+            with shape (number of query points, k); the position is len(data) if there are fewer stops than k.
+        """
+        chords, positions = self._tree.query(get_stop_positions(latitudes, longitudes), k=k)
+        positions, chords = np.asarray(positions).reshape(len(chords), k), np.asarray(chords).reshape(len(chords), k)
+        return positions, self._to_surface_distance(chords)
+
+    @staticmethod
+    def _to_surface_distance(chords: np.ndarray) -> np.ndarray:
+        # missing neighbours have an infinite distance
+        with np.errstate(invalid="ignore"):
+            distances = 2 * EARTH_RADIUS * np.arcsin(np.minimum(chords / (2 * EARTH_RADIUS), 1.0))
+        return np.where(np.isfinite(chords), distances, np.inf)
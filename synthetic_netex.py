@@ -0,0 +1,240 @@
+import argparse
+import dataclasses
+import datetime
+import math
+import os
+import random
+import typing
+import zipfile
+
+from parse_input_file import date_format, xml_namespace
+from utils import minutes_to_time
+
+# synthetic timetable data in the NeTEx layout of the DELFI release, to test and benchmark without the download:
+# the stops lie on a square grid, every line runs along a random walk over the grid in both directions,
+# one xml file per `lines_per_file` lines, just like the real data holds one or a few lines per file
+NETEX_NAMESPACE = xml_namespace[1:-1]
+GRID_ORIGIN = (49.85, 8.60)  # south west corner of the grid, around Darmstadt
+GRID_SPACING = 500.0  # meters between neighbouring stops
+
+# per transport mode: (share of the lines, speed in meters per minute, grid cells per stop to stop section)
+TRANSPORT_MODES = {
+    "bus": (0.6, 400.0, 1),
+    "tram": (0.25, 350.0, 1),
+    "rail": (0.15, 1200.0, 4),
+}
+# every line gets `journeys_per_line` journeys per direction on each day type,
+# given as the days of the week (0 = Monday) it runs on
+DAY_TYPES = {
+    "weekday": (0, 1, 2, 3, 4),
+    "weekend": (5, 6),
+    "daily": (0, 1, 2, 3, 4, 5, 6),
+}
+
+
+@dataclasses.dataclass
+class SyntheticTimetable:
+    """
+    Parameters of a synthetic timetable, the same parameters always give the same files.
+    """
+    num_stops: int = 400
+    num_lines: int = 40
+    lines_per_file: int = 2
+    stops_per_line: int = 12
+    journeys_per_line: int = 24  # per direction and day type
+    calendar_start: datetime.date = datetime.date(2025, 7, 21)
+    num_days: int = 28
+    seed: int = 0
+
+    @property
+    def grid_size(self) -> int:
+        return math.ceil(math.sqrt(self.num_stops))
+
+    def get_stop_id(self, stop: int) -> str:
+        return f"de:99999:{stop}"
+
+    def get_stop_coordinates(self) -> typing.Dict[str, typing.Tuple[float, float]]:
+        """
+        Returns:
+            dict: stop_id → (latitude, longitude)
+        """
+        lat_spacing = GRID_SPACING / 111320.0
+        lon_spacing = GRID_SPACING / (111320.0 * math.cos(math.radians(GRID_ORIGIN[0])))
+        return {self.get_stop_id(stop): (GRID_ORIGIN[0] + (stop // self.grid_size) * lat_spacing,
+                                         GRID_ORIGIN[1] + (stop % self.grid_size) * lon_spacing)
+                for stop in range(self.num_stops)}
+
+    def _get_grid_position(self, stop: int) -> typing.Tuple[int, int]:
+        return divmod(stop, self.grid_size)
+
+    def _get_route(self, rnd: random.Random, step: int) -> typing.List[int]:
+        # random walk over the grid without visiting a stop twice
+        route = [rnd.randrange(self.num_stops)]
+        while len(route) < self.stops_per_line:
+            row, column = self._get_grid_position(route[-1])
+            neighbours = [(row + dr) * self.grid_size + column + dc
+                          for dr, dc in ((step, 0), (-step, 0), (0, step), (0, -step))
+                          if 0 <= row + dr < self.grid_size and 0 <= column + dc < self.grid_size]
+            neighbours = [stop for stop in neighbours if stop < self.num_stops and stop not in route]
+            if len(neighbours) == 0:
+                break
+            route.append(rnd.choice(neighbours))
+        return route
+
+    def get_line_file(self, file_index: int) -> bytes:
+        """
+        Returns a NeTEx line file in the frame layout `parse_input_file.get_line_info_from_file` reads.
+
+        Args:
+            file_index (int): Index of the file, from 0 to `get_num_files() - 1`.
+
+        Returns:
+            bytes: The xml file.
+        """
+        rnd = random.Random(f"{self.seed}-{file_index}")
+        coordinates = self.get_stop_coordinates()
+        first_line = file_index * self.lines_per_file
+        lines = range(first_line, min(first_line + self.lines_per_file, self.num_lines))
+        modes = [rnd.choices(list(TRANSPORT_MODES), weights=[share for share, _, _ in TRANSPORT_MODES.values()])[0]
+                 for _ in lines]
+        routes = [self._get_route(rnd, TRANSPORT_MODES[mode][2]) for mode in modes]
+        # one journey pattern per line and direction
+        patterns = {f"JP{line}_{direction}": (line, mode, route if direction == 0 else route[::-1])
+                    for line, mode, route in zip(lines, modes, routes) for direction in range(2)}
+        stops = sorted({stop for route in routes for stop in route})
+
+        out = [f'<?xml version="1.0" encoding="UTF-8"?>',
+               f'<PublicationDelivery xmlns="{NETEX_NAMESPACE}" version="ntx:1.1"><dataObjects>',
+               f'<CompositeFrame id="CF{file_index}"><TypeOfFrameRef ref="epip:EU_PI_LINE_OFFER"/><frames>',
+               '<ResourceFrame id="RF"><TypeOfFrameRef ref="epip:EU_PI_COMMON"/></ResourceFrame>',
+               '<ServiceFrame id="SF"><TypeOfFrameRef ref="epip:EU_PI_NETWORK"/><lines>']
+        for line, mode in zip(lines, modes):
+            out.append(f'<Line id="L{line}"><Name>{mode.capitalize()} {line}</Name>'
+                       f'<TransportMode>{mode}</TransportMode></Line>')
+        out.append('</lines><scheduledStopPoints>')
+        for stop in stops:
+            out.append(f'<ScheduledStopPoint id="SSP{stop}"><Name>Stop {stop}</Name></ScheduledStopPoint>')
+        out.append('</scheduledStopPoints><stopAssignments>')
+        for stop in stops:
+            out.append(f'<PassengerStopAssignment id="PSA{stop}"><ScheduledStopPointRef ref="SSP{stop}"/>'
+                       f'<StopPlaceRef ref="SP{stop}"/></PassengerStopAssignment>')
+        out.append('</stopAssignments><serviceLinks>')
+        for pattern_id, (_, _, route) in patterns.items():
+            for i, (stop_from, stop_to) in enumerate(zip(route, route[1:])):
+                out.append(f'<ServiceLink id="SL{pattern_id}_{i}"><FromPointRef ref="SSP{stop_from}"/>'
+                           f'<ToPointRef ref="SSP{stop_to}"/></ServiceLink>')
+        out.append('</serviceLinks><journeyPatterns>')
+        for pattern_id, (line, _, route) in patterns.items():
+            out.append(f'<ServiceJourneyPattern id="{pattern_id}"><RouteView><LineRef ref="L{line}"/></RouteView>'
+                       f'<pointsInSequence>')
+            for i, stop in enumerate(route):
+                out.append(f'<StopPointInJourneyPattern id="{pattern_id}_{i}"><ScheduledStopPointRef ref="SSP{stop}"/>'
+                           f'</StopPointInJourneyPattern>')
+            out.append('</pointsInSequence></ServiceJourneyPattern>')
+        out.append('</journeyPatterns></ServiceFrame>')
+
+        out.append('<SiteFrame id="SITE"><TypeOfFrameRef ref="epip:EU_PI_STOP"/><stopPlaces>')
+        for stop in stops:
+            latitude, longitude = coordinates[self.get_stop_id(stop)]
+            out.append(f'<StopPlace id="SP{stop}"><keyList><KeyValue><Key>GlobalID</Key>'
+                       f'<Value>{self.get_stop_id(stop)}</Value></KeyValue></keyList><Name>Place {stop}</Name>'
+                       f'<Centroid><Location><Longitude>{longitude:.6f}</Longitude>'
+                       f'<Latitude>{latitude:.6f}</Latitude></Location></Centroid></StopPlace>')
+        out.append('</stopPlaces></SiteFrame>')
+
+        out.append('<ServiceCalendarFrame id="SCF"><TypeOfFrameRef ref="epip:EU_PI_CALENDAR"/>'
+                   '<ServiceCalendar id="SC"><operatingPeriods>')
+        last_day = self.calendar_start + datetime.timedelta(days=self.num_days - 1)
+        for day_type, weekdays in DAY_TYPES.items():
+            valid_day_bits = "".join(
+                "1" if (self.calendar_start + datetime.timedelta(days=day)).weekday() in weekdays else "0"
+                for day in range(self.num_days))
+            out.append(f'<UicOperatingPeriod id="OP_{day_type}">'
+                       f'<FromDate>{self.calendar_start.strftime(date_format)}</FromDate>'
+                       f'<ToDate>{last_day.strftime(date_format)}</ToDate>'
+                       f'<ValidDayBits>{valid_day_bits}</ValidDayBits></UicOperatingPeriod>')
+        out.append('</operatingPeriods><dayTypeAssignments>')
+        for day_type in DAY_TYPES:
+            out.append(f'<DayTypeAssignment id="DTA_{day_type}"><OperatingPeriodRef ref="OP_{day_type}"/>'
+                       f'<DayTypeRef ref="DT_{day_type}"/></DayTypeAssignment>')
+        out.append('</dayTypeAssignments></ServiceCalendar></ServiceCalendarFrame>')
+
+        out.append('<TimetableFrame id="TF"><TypeOfFrameRef ref="epip:EU_PI_TIMETABLE"/><vehicleJourneys>')
+        for pattern_id, (line, mode, route) in patterns.items():
+            speed = TRANSPORT_MODES[mode][1]
+            travel_times = [max(1, round(math.dist(self._get_grid_position(stop_from), self._get_grid_position(stop_to))
+                                         * GRID_SPACING / speed)) for stop_from, stop_to in zip(route, route[1:])]
+            for day_type in DAY_TYPES:
+                # evenly spread from 05:00 on, so some journeys run past midnight
+                headway = 20 * 60 // self.journeys_per_line
+                for journey in range(self.journeys_per_line):
+                    current = 5 * 60 + journey * headway + rnd.randrange(max(1, headway))
+                    out.append(f'<ServiceJourney id="SJ{pattern_id}_{day_type}_{journey}">'
+                               f'<ServiceJourneyPatternRef ref="{pattern_id}"/>'
+                               f'<dayTypes><DayTypeRef ref="DT_{day_type}"/></dayTypes><passingTimes>')
+                    for i in range(len(route)):
+                        out.append(f'<TimetabledPassingTime><StopPointInJourneyPatternRef ref="{pattern_id}_{i}"/>')
+                        if i > 0:
+                            out.append(f'<ArrivalTime>{minutes_to_time(current % (24 * 60))}</ArrivalTime>')
+                            current += rnd.randint(0, 1)  # dwell time
+                        if i < len(route) - 1:
+                            out.append(f'<DepartureTime>{minutes_to_time(current % (24 * 60))}</DepartureTime>')
+                            current += travel_times[i] + rnd.randint(0, 2)
+                        out.append('</TimetabledPassingTime>')
+                    out.append('</passingTimes></ServiceJourney>')
+        out.append('</vehicleJourneys></TimetableFrame>')
+        out.append('</frames></CompositeFrame></dataObjects></PublicationDelivery>')
+        return "\n".join(out).encode("utf-8")
+
+    def get_num_files(self) -> int:
+        return math.ceil(self.num_lines / self.lines_per_file)
+
+    def write_zip(self, path: str) -> None:
+        """
+        Writes all line files into a zip like the timetable release.
+        """
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+            for file_index in range(self.get_num_files()):
+                # fixed timestamps, so the same parameters give the same zip
+                zip_file.writestr(zipfile.ZipInfo(f"line_{file_index:05}.xml", date_time=(2025, 1, 1, 0, 0, 0)),
+                                  self.get_line_file(file_index), compress_type=zipfile.ZIP_DEFLATED)
+
+    def write_stations_csv(self, path: str) -> None:
+        """
+        Writes the stops in the layout of the zHV (central stop directory) csv.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("SeqNo;Type;DHID;Parent;Name;Latitude;Longitude\n")
+            for stop, (stop_id, (latitude, longitude)) in enumerate(self.get_stop_coordinates().items()):
+                # decimal comma, just like the zHV release
+                f.write(f"{stop};S;{stop_id};;Place {stop};{latitude:.6f};{longitude:.6f}\n".replace(".", ","))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="write a synthetic NeTEx timetable for tests and benchmarks")
+    parser.add_argument('--output', default='data', required=False, help='output directory')
+    parser.add_argument('--stops', default=400, type=int, required=False)
+    parser.add_argument('--lines', default=40, type=int, required=False)
+    parser.add_argument('--lines_per_file', default=2, type=int, required=False)
+    parser.add_argument('--stops_per_line', default=12, type=int, required=False)
+    parser.add_argument('--journeys_per_line', default=24, type=int, help='per direction and day type',
+                        required=False)
+    parser.add_argument('--days', default=28, type=int, help='length of the calendar', required=False)
+    parser.add_argument('--seed', default=0, type=int, required=False)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    timetable = SyntheticTimetable(num_stops=args.stops, num_lines=args.lines, lines_per_file=args.lines_per_file,
+                                   stops_per_line=args.stops_per_line, journeys_per_line=args.journeys_per_line,
+                                   num_days=args.days, seed=args.seed)
+    os.makedirs(args.output, exist_ok=True)
+    timetable.write_zip(os.path.join(args.output, "timetable.zip"))
+    timetable.write_stations_csv(os.path.join(args.output, "stations.csv"))
+    print(f"wrote {timetable.get_num_files()} line files with {args.lines} lines to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import datetime
+
+import pytest
+
+from network import DEFAULT_CACHE_BYTES, Network, StopCache
+
+
+def make_network(calendar_start):
+    network = Network(None)
+    network.calendar_start = calendar_start
+    network.add_trip(["a", "b", "c"], [0, 20, 30], [10, 21, 0], "L1", "bus", service_days=0b11)
+    return network
+
+
+def test_merge_keeps_calendar_start():
+    network = make_network(None)
+    network.merge(make_network(datetime.date(2025, 7, 21)))
+    assert network.calendar_start == datetime.date(2025, 7, 21)
+
+
+def test_merge_different_calendar_starts_raises():
+    network = make_network(datetime.date(2025, 7, 21))
+    with pytest.raises(ValueError):
+        network.merge(make_network(datetime.date(2025, 8, 1)))
+
+
+def test_lower_bounds_follow_added_connections():
+    network = Network(None)
+    network.add_connection("a", "b", 0, 100, "L1", "bus")
+    network.set_stop_coordinates({"a": (49.0, 8.0), "b": (49.1, 8.0), "c": (49.0, 9.0)})
+    # a faster detour, the lower bounds of the slow connection alone would rule it out
+    network.add_connection("a", "c", 0, 5, "L2", "train")
+    network.add_connection("c", "b", 6, 10, "L2", "train")
+    assert network.get_fastest_route("a", 0, "b", algorithm="astar")["b"] == (10, "c")
+
+
+def make_chain(**cache):
+    network = Network(None, **cache)
+    for stop_id, next_stop_id in zip("abcd", "bcde"):
+        network.add_connection(stop_id, next_stop_id, 0, 10, "L1", "bus")
+    for stop_id in "abcd":
+        network.get_connections(stop_id)
+    return network
+
+
+def test_stop_cache_evicts():
+    stats = make_chain(cache_entries=2).get_cache_stats()
+    assert stats["evictions"] == 2
+    assert stats["entries"] == 2
+    # each stop has one edge with one connection
+    stats = make_chain(cache_bytes=2 * (StopCache.EDGE_BYTES + StopCache.CONNECTION_BYTES)).get_cache_stats()
+    assert stats["evictions"] == 2
+    assert stats["entries"] == 2
+
+
+def test_stop_cache_is_bounded_by_default():
+    assert make_chain()._stop_cache.max_bytes == DEFAULT_CACHE_BYTES
+    assert make_chain(cache_bytes=None).get_cache_stats()["evictions"] == 0
@@ -0,0 +1,290 @@
+import argparse
+import io
+import os
+import sqlite3
+import typing
+from typing import Optional
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import diskcache
+import smopy
+from PIL import Image
+
+TILE_SERVER = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+# the tile cache drops the least recently used tiles above this size
+DEFAULT_SIZE_LIMIT = 512 * 2 ** 20
+# upper bound of the tiles a single prefetch may request, see the tile usage policy of OpenStreetMap
+# (https://operations.osmfoundation.org/policies/tiles/) before downloading large regions from the tile server
+MAX_PREFETCH_TILES = 10000
+
+
+class DirectoryTileSource:
+    """
+    Tiles stored as image files in a local directory, by default in the {z}/{x}/{y}.png layout of tile servers.
+    """
+    local = True
+
+    def __init__(self, directory: str, pattern: str = "{z}/{x}/{y}.png") -> None:
+        self.directory = directory
+        self.pattern = pattern
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        """
+        Returns the encoded tile, None if the directory does not have it.
+        """
+        try:
+            with open(os.path.join(self.directory, self.pattern.format(z=z, x=x, y=y)), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class MBTilesSource:
+    """
+    Tiles stored in an MBTiles file (an sqlite database with a tiles table), opened read-only.
+    """
+    local = True
+
+    def __init__(self, file: str) -> None:
+        self.file = file
+        if not os.path.isfile(file):
+            raise FileNotFoundError(file)
+        self._connection = sqlite3.connect(f"file:{file}?mode=ro", uri=True, check_same_thread=False)
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        """
+        Returns the encoded tile, None if the file does not have it.
+        """
+        # MBTiles counts the rows from the south (TMS), tile servers from the north
+        row = self._connection.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, (1 << z) - 1 - y)).fetchone()
+        return None if row is None else bytes(row[0])
+
+
+class TileServerSource:
+    """
+    Tiles downloaded from a tile server.
+    """
+    local = False
+
+    def __init__(self, url: str = TILE_SERVER) -> None:
+        """
+        Args:
+            url (str): URL template of the tiles with the placeholders {z}, {x} and {y}.
+        """
+        self.url = url
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        """
+        Returns the encoded tile, None if the server does not have it.
+        """
+        request = Request(self.url.format(z=z, x=x, y=y), data=None, headers={"User-Agent": "smopy"})
+        try:
+            with urlopen(request) as response:
+                return response.read()
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+
+TileSource = typing.Union[DirectoryTileSource, MBTilesSource, TileServerSource]
+
+
+def open_tile_source(source: str) -> TileSource:
+    """
+    Opens a tile source given as a URL template, an MBTiles file or a tile directory.
+    """
+    if source.startswith("http://") or source.startswith("https://"):
+        return TileServerSource(source)
+    if source.endswith(".mbtiles"):
+        return MBTilesSource(source)
+    if not os.path.isdir(source):
+        raise FileNotFoundError(source)
+    return DirectoryTileSource(source)
+
+
+def get_tile_range(box: typing.Tuple[float, float, float, float], z: int) -> typing.Tuple[int, int, int, int]:
+    """
+    Returns the tiles covering a box in geographical coordinates (lat1, lon1, lat2, lon2) at a zoom level,
+    as x0, y0, x1, y1 with x0 <= x1 and y0 <= y1.
+    """
+    return smopy.correct_box(smopy.get_tile_box(box, z), z)
+
+
+class TileMap(smopy.Map):
+    """
+    `smopy.Map` assembled from the tiles of a `TileCache` instead of downloading the whole map.
+    """
+
+    def __init__(self, box: typing.Tuple[float, float, float, float], tile_cache: "TileCache",
+                 **kwargs: typing.Any) -> None:
+        # `smopy.Map.__init__` calls `fetch`
+        self.tile_cache = tile_cache
+        super().__init__(box, **kwargs)
+
+    def fetch(self) -> Image.Image:
+        if self.img is None:
+            x0, y0, x1, y1 = get_tile_range(self.box, self.z)
+            sx, sy = smopy.get_box_size((x0, y0, x1, y1))
+            if sx * sy >= self.maxtiles:
+                raise ValueError(f"map of {sx * sy} tiles exceeds the limit of {self.maxtiles} tiles")
+            self.img = Image.new("RGB", (sx * self.tilesize, sy * self.tilesize))
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    self.img.paste(self.tile_cache.get_image(self.z, x, y),
+                                   (self.tilesize * (x - x0), self.tilesize * (y - y0)))
+        self.w, self.h = self.img.size
+        return self.img
+
+
+class TileCache:
+    """
+    Cache of map tiles keyed by (z, x, y) on disk, the maps of any box are assembled from the tiles,
+    so overlapping maps share their tiles and maps of cached regions need no downloads.
+    Missing tiles are read from the tile sources in order; tiles of local sources (directory, MBTiles)
+    are not copied into the cache, downloaded tiles are cached and the least recently used ones evicted
+    when the cache exceeds its size limit.
+    """
+
+    def __init__(self, directory: str, size_limit: int = DEFAULT_SIZE_LIMIT,
+                 sources: Optional[typing.Sequence[TileSource]] = None) -> None:
+        """
+        Args:
+            directory (str): Directory of the cache, created if it does not exist.
+            size_limit (int): Maximum size of the cached tiles in bytes.
+            sources (Optional[Sequence[TileSource]]): Tile sources in the order they are tried,
+                only the OpenStreetMap tile server if None.
+        """
+        self.sources = [TileServerSource()] if sources is None else sources
+        self._cache = diskcache.Cache(directory, size_limit=size_limit, eviction_policy="least-recently-used")
+
+    @property
+    def directory(self) -> str:
+        return self._cache.directory
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def volume(self) -> int:
+        """
+        Returns the approximate size of the cache on disk in bytes.
+        """
+        return self._cache.volume()
+
+    def close(self) -> None:
+        self._cache.close()
+
+    def _read_tile(self, z: int, x: int, y: int, use_local: bool) -> typing.Tuple[Optional[bytes], bool]:
+        # returns the tile and whether it was downloaded
+        tile = self._cache.get((z, x, y))
+        if tile is not None:
+            return tile, False
+        for source in self.sources:
+            if source.local and not use_local:
+                continue
+            tile = source.get_tile(z, x, y)
+            if tile is not None:
+                if not source.local:
+                    self._cache.set((z, x, y), tile)
+                return tile, not source.local
+        return None, False
+
+    def get_tile(self, z: int, x: int, y: int) -> bytes:
+        """
+        Returns the encoded tile, read from the cache or the first source that has it.
+
+        Raises:
+            KeyError: if no source has the tile.
+        """
+        tile, _ = self._read_tile(z, x, y, use_local=True)
+        if tile is None:
+            raise KeyError(f"no tile source has the tile {z}/{x}/{y}")
+        return tile
+
+    def get_image(self, z: int, x: int, y: int) -> Image.Image:
+        """
+        Returns the decoded tile.
+        """
+        image = Image.open(io.BytesIO(self.get_tile(z, x, y)))
+        image.load()
+        return image
+
+    def get_map(self, box: typing.Tuple[float, float, float, float], **kwargs: typing.Any) -> smopy.Map:
+        """
+        Assembles the map of a box from the tiles.
+
+        Args:
+            box (tuple): Lat1 Lon1 Lat2 Lon2 defining the boundaries of the map.
+            **kwargs: Options of `smopy.Map`, e.g. z, margin and maxtiles.
+
+        Returns:
+            smopy.Map: Map object
+        """
+        kwargs.setdefault("verbose", False)
+        return TileMap(box, self, **kwargs)
+
+    def prefetch(self, box: typing.Tuple[float, float, float, float], zoom_levels: typing.Iterable[int],
+                 margin: float = .05, max_tiles: int = MAX_PREFETCH_TILES) -> typing.Dict[str, int]:
+        """
+        Downloads all tiles of a region that are neither cached nor in a local source,
+        so that maps of the region can be drawn offline.
+
+        Args:
+            box (tuple): Lat1 Lon1 Lat2 Lon2 defining the region.
+            zoom_levels (Iterable[int]): Zoom levels to fetch.
+            margin (float): Relative margin around the region, the margin of the maps (see `smopy.Map`).
+            max_tiles (int): Maximum number of tiles of the region.
+
+        Returns:
+            dict: Number of "tiles" in the region, of "fetched" tiles and of "missing" tiles no source has.
+        """
+        box = smopy.extend_box(box, margin)
+        ranges = [(z, get_tile_range(box, z)) for z in zoom_levels]
+        num_tiles = sum((x1 - x0 + 1) * (y1 - y0 + 1) for _, (x0, y0, x1, y1) in ranges)
+        if num_tiles > max_tiles:
+            raise ValueError(f"region has {num_tiles} tiles, more than the limit of {max_tiles}")
+        stats = {"tiles": num_tiles, "fetched": 0, "missing": 0}
+        for z, (x0, y0, x1, y1) in ranges:
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    # local tiles are available offline anyway
+                    if any(source.local and source.get_tile(z, x, y) is not None for source in self.sources):
+                        continue
+                    tile, downloaded = self._read_tile(z, x, y, use_local=False)
+                    if tile is None:
+                        stats["missing"] += 1
+                    elif downloaded:
+                        stats["fetched"] += 1
+        return stats
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="prefetch the map tiles of a region into the tile cache")
+    parser.add_argument('--bbox', nargs=4, type=float, required=True, metavar=('LAT1', 'LON1', 'LAT2', 'LON2'))
+    parser.add_argument('--zoom', nargs=2, type=int, default=[8, 14], metavar=('MIN', 'MAX'),
+                        help='range of zoom levels (inclusive)', required=False)
+    parser.add_argument('--cache_dir', default='map_cache', required=False)
+    parser.add_argument('--size_limit', default=DEFAULT_SIZE_LIMIT, type=int, help='in bytes', required=False)
+    parser.add_argument('--tile_source', default=[], action='append', required=False,
+                        help='tile directory, MBTiles file or URL template, tried in the given order '
+                             '(default: the OpenStreetMap tile server)')
+    parser.add_argument('--max_tiles', default=MAX_PREFETCH_TILES, type=int, required=False)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    sources = [open_tile_source(source) for source in args.tile_source] or None
+    tile_cache = TileCache(args.cache_dir, args.size_limit, sources)
+    stats = tile_cache.prefetch(tuple(args.bbox), range(args.zoom[0], args.zoom[1] + 1), max_tiles=args.max_tiles)
+    print("{tiles} tiles in the region, {fetched} fetched, {missing} missing".format(**stats))
+    print(f"{len(tile_cache)} tiles cached, {tile_cache.volume() / 2 ** 20:.1f} MB")
+    tile_cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,15 @@
-import difflib
+from __future__ import annotations
+
 import typing
 from typing import Optional, Tuple
 
-import pandas as pd
-import smopy
-import diskcache
+# pandas and the map libraries are imported where they are used, so that the time helpers (and with them
+# network.py) load without them, which keeps the startup of query-only processes short
+if typing.TYPE_CHECKING:
+    import pandas as pd
+    import smopy
+
+    from tile_cache import TileCache
 
 # helper functions for converting times
 midnight = 24 * 60
@@ -52,25 +57,32 @@ def find_closest_station_id_by_name(target_name: str, df: pd.DataFrame) -> Optio
     if 'Name' not in df.columns:
         raise ValueError("The DataFrame must have a 'Name' column.")
 
-    # Try exact match first
-    exact_match = df[df["Name"] == target_name]
-    if not exact_match.empty:
-        return exact_match.index[0]  # Return the index of the exact match
+    from name_index import get_name_index
 
-    # Find the closest match
-    closest_match = difflib.get_close_matches(target_name, df["Name"], n=1, cutoff=0.5)
+    # the name index of the data frame is built on first use (or persisted, see `stops.Stops`)
+    return get_name_index(df).find(target_name)
 
-    if closest_match:
-        return df[df["Name"] == closest_match[0]].index[0]  # Return the index== station ID of the closest match
 
-    return None  # No close match found
+# the maps are assembled from map tiles cached on disk (see tile_cache.py), so overlapping maps share their tiles;
+# local tile sources (tile directory or MBTiles file, see `tile_cache.open_tile_source`) are tried before
+# the tile server, e.g. tile_sources.append(DirectoryTileSource("tiles")), to draw maps offline
+map_cache_dir = "map_cache"
+map_cache_size_limit: Optional[int] = None  # None for `tile_cache.DEFAULT_SIZE_LIMIT`
+tile_sources: list = []
+_tile_cache: Optional[TileCache] = None
 
 
-# Round to this many decimal places to consider maps "similar"
-COORD_ROUND_PRECISION = 4
+def get_tile_cache() -> TileCache:
+    """
+    Returns the tile cache of `get_map`, opened (and its directory created) on first use.
+    """
+    from tile_cache import DEFAULT_SIZE_LIMIT, TileCache, TileServerSource
 
-# caches the used maps on disk, so that we don't have to re-download it again
-cache = diskcache.Cache("map_cache")
+    global _tile_cache
+    if _tile_cache is None:
+        size_limit = DEFAULT_SIZE_LIMIT if map_cache_size_limit is None else map_cache_size_limit
+        _tile_cache = TileCache(map_cache_dir, size_limit, tile_sources + [TileServerSource()])
+    return _tile_cache
 
 
 def get_map(map_box: typing.Tuple[float, float, float, float]) -> smopy.Map:
@@ -83,9 +95,4 @@ def get_map(map_box: typing.Tuple[float, float, float, float]) -> smopy.Map:
     Returns:
         smopy.Map: Map object
     """
-    rounded_box = tuple(round(coord, COORD_ROUND_PRECISION) for coord in map_box)
-
-    with diskcache.Cache(cache.directory) as map_cache:
-        if rounded_box not in map_cache:
-            map_cache[rounded_box] = smopy.Map(rounded_box)  # download new map from openstreetmap
-        return map_cache[rounded_box]
+    return get_tile_cache().get_map(map_box)